@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import PurePosixPath
+
+import docker
+from datasets import load_dataset
+from tqdm import tqdm
+
+import utils.docker_utils as du
+from construction.filter_execution.constants import *
+from evaluation.eval import test_groups
+from utils.logger import get_logger
+from utils.test_map import TestMap
+from utils.utils import load_jsonl
+
+COVERAGE_DIR = "/tmp/ncbench_cov"
+COVERAGE_RC = "/tmp/ncbench_cov.rc"
+COLLECT_SCRIPT = "/tmp/ncbench_cov_collect.py"
+COLLECT_MARKER = "NCBENCH_COVERED_FILES"
+
+# measure every python process of the test command (tox, django workers, subprocesses); site-packages
+# too, since non-editable installs (e.g. `python setup.py install`) run the library from there
+COVERAGE_RC_TEMPLATE = """[run]
+parallel = True
+concurrency = multiprocessing,thread
+source =
+    {work_dir}
+    {site_packages}
+data_file = {coverage_dir}/.coverage
+"""
+# a covered file set made of these only means the library itself was not measured
+TEST_FILE_PATTERN = re.compile(r'(^|/)(tests?|testing)/|(^|/)(test_[^/]*|[^/]*_tests?|conftest)\.py$')
+STARTUP_PTH = "import coverage; coverage.process_startup()\n"
+COLLECT_TEMPLATE = """import json
+import coverage
+cov = coverage.Coverage(data_file='{coverage_dir}/.coverage')
+cov.combine(['{coverage_dir}'])
+import subprocess
+prefix = '{work_dir}/'
+site_prefix = '{site_packages}/'
+# installed copies of repository files are mapped back by their path suffix, e.g.
+# site-packages/matplotlib/axes/_base.py -> lib/matplotlib/axes/_base.py
+repo_files = subprocess.run(['git', 'ls-files'], cwd='{work_dir}', capture_output=True, text=True).stdout.split()
+by_suffix = {{}}
+for path in repo_files:
+    parts = path.split('/')
+    for i in range(len(parts)):
+        by_suffix.setdefault('/'.join(parts[i:]), path)
+files = set()
+for f in cov.get_data().measured_files():
+    if f.startswith(prefix):
+        files.add(f[len(prefix):])
+    elif f.startswith(site_prefix) and f[len(site_prefix):] in by_suffix:
+        files.add(by_suffix[f[len(site_prefix):]])
+print('{marker} ' + json.dumps(sorted(files)))
+"""
+
+
+def format_test_args(tests, conda_env):
+    if 'django' in conda_env:
+        names = []
+        for test_id in tests:
+            match = re.match(r"(.*?)\s+\((.*?)\)", test_id)
+            names.append(f"{match.group(2)}.{match.group(1)}" if match else test_id)
+        return ' '.join(f'"{name}"' for name in names)
+    return ' '.join(shlex.quote(test_id) for test_id in tests)
+
+
+def setup_coverage(container, config, work_dir, logger):
+    '''
+    Install coverage in the test env and hook it into every python process started with
+    COVERAGE_PROCESS_START set.
+    '''
+    env = config['conda_env']
+    if container.exec_run(f"conda run -n {env} python -c 'import coverage'").exit_code != 0:
+        cmd_res = container.exec_run(f"conda run -n {env} python -m pip install coverage")
+        if cmd_res.exit_code != 0:
+            logger.error(f"Failed to install coverage: {cmd_res.output[-2000:]}")
+            return False
+    cmd_res = container.exec_run(f"conda run -n {env} python -c \"import sysconfig; print(sysconfig.get_paths()['purelib'])\"")
+    site_packages = cmd_res.output.decode().strip().splitlines()[-1]
+    du.put_files_to_container(container, {'ncbench_coverage.pth': STARTUP_PTH}, site_packages)
+    du.put_files_to_container(container, {
+        PurePosixPath(COVERAGE_RC).name: COVERAGE_RC_TEMPLATE.format(work_dir=work_dir, coverage_dir=COVERAGE_DIR,
+                                                                     site_packages=site_packages),
+        PurePosixPath(COLLECT_SCRIPT).name: COLLECT_TEMPLATE.format(work_dir=work_dir, coverage_dir=COVERAGE_DIR,
+                                                                    site_packages=site_packages, marker=COLLECT_MARKER),
+    }, PurePosixPath(COVERAGE_RC).parent)
+    return True
+
+
+def covered_files(container, config, work_dir, tests, timeout, logger):
+    '''
+    Run `tests` in one invocation under coverage; returns the covered repository files or None.
+    '''
+    env = config['conda_env']
+    container.exec_run(f"bash -c 'rm -rf {COVERAGE_DIR} && mkdir -p {COVERAGE_DIR}'")
+    test_cmd = (f"env COVERAGE_PROCESS_START={COVERAGE_RC} conda run -n {env.strip()} {config['test_cmd'].strip()} "
+                f"{format_test_args(tests, env)}")
+    output, timed_out, duration = du.exec_run_with_timeout(container=container, cmd=test_cmd, workdir=work_dir,
+                                                           timeout=timeout)
+    logger.info(f"coverage run of {len(tests)} tests: {duration:.1f}s{' [timeout]' if timed_out else ''}")
+    cmd_res = container.exec_run(f"conda run -n {env} python {COLLECT_SCRIPT}", workdir=work_dir)
+    match = re.search(rf'^{COLLECT_MARKER} (.*)$', cmd_res.output.decode(errors='ignore'), re.MULTILINE)
+    if timed_out or not match:
+        logger.info(f"No coverage data for {tests[0]}: {cmd_res.output[-2000:]}")
+        return None
+    return json.loads(match.group(1))
+
+
+def run_coverage_instance(task, client, test_map, logger, proxy=None, timeout=600):
+    '''
+    Run the F2P and P2P tests of a task once under coverage on the gold patch, inside its
+    `ncbench_{instance_id}` image, and store the test -> covered files map of the instance.
+    Tests of one file share a run, so each test is mapped to the files covered by its file.
+    Nothing is stored if the install fails, and tests covering only test files (the library
+    was not measured) are left out. Returns the number of mapped tests.
+    '''
+    instance_id = task['instance_id']
+    repo_name = task['repo'].split('/')[-1]
+    work_dir = f'/root/{repo_name}'
+    config = MAP_REPO_TO_CONFIG[task['repo']][task['version']]
+    container = None
+    try:
+        # build container
+        container = du.build_container(image_name=f'ncbench_{instance_id}:latest',
+                                       container_name=f'ncbench_cov__{instance_id}', client=client,
+                                       logger=logger, proxy=proxy)
+        container.start()
+        # same setup as the execution filter, with the gold patch applied on top of the test patch
+        exit_code = du.prepare_repo(container, work_dir, task['base_commit'],
+                                    {'test patch': task['test_patch'], 'gold patch': task['feature_patch']},
+                                    config, logger)
+        if exit_code != 0:
+            logger.info(f"Setup failed (install exit code {exit_code}), not mapping {instance_id}")
+            return 0
+        if not setup_coverage(container, config, work_dir, logger):
+            return 0
+        test_files = {}
+        for tests in test_groups(task['FAIL2PASS'] + task['PASS2PASS'], config['conda_env']):
+            files = covered_files(container, config, work_dir, tests, timeout, logger)
+            if files and not all(TEST_FILE_PATTERN.search(f) for f in files):
+                test_files.update({test_id: files for test_id in tests})
+            elif files:
+                logger.info(f"Only test files covered by {tests[0]}, not mapping {len(tests)} tests")
+        if not test_files:
+            return 0
+        test_map.put(instance_id, test_files, 'coverage')
+        return len(test_files)
+    except Exception as e:
+        logger.error(f'error: {e}')
+        return 0
+    finally:
+        du.cleanup_container(client, container, logger)
+
+
+def main(args):
+    if 'jsonl' in args.bench_tasks:
+        tasks = load_jsonl(args.bench_tasks)
+    else:
+        tasks = load_dataset(args.bench_tasks, split='test')
+    os.makedirs(args.log_dir, exist_ok=True)
+    client = docker.from_env()
+    test_map = TestMap(args.output)
+    # instances mapped by build_test_map.py only have static rows and still need coverage
+    done = test_map.instance_ids('coverage') if args.resume else set()
+    tasks = [task for task in tasks if task['instance_id'] not in done]
+
+    def process(task):
+        logger = get_logger(log_name=f"cov_{task['instance_id']}",
+                            log_file=os.path.join(args.log_dir, f"{task['instance_id']}.log"))
+        return run_coverage_instance(task, client, test_map, logger, args.proxy, args.timeout)
+
+    mapped = 0
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        futures = [executor.submit(process, task) for task in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures), colour="MAGENTA"):
+            mapped += future.result()
+    print(f"Mapped {mapped} tests of {len(tasks)} instances to {args.output}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Map the F2P/P2P tests of every instance to the files they cover')
+    parser.add_argument("--bench_tasks", type=str, help="Path to benchmark task instances file", required=True)
+    parser.add_argument("--output", type=str, help="SQLite test map (readable by eval.py --p2p_memo_map)", required=True)
+    parser.add_argument("--log_dir", type=str, default='results/coverage_logs')
+    parser.add_argument("--max_workers", type=int, default=4)
+    parser.add_argument("--timeout", type=int, default=600, help="Timeout in seconds of one test invocation")
+    parser.add_argument("--proxy", type=str, default=None)
+    parser.add_argument("--resume", action="store_true", help="Skip instances that already have coverage rows in the map")
+    main(parser.parse_args())
@@ -1263,28 +1263,13 @@ def run_instance(
         container_name = f'{image_name}__{instance_id}'
         container = du.build_container(image_name=f'{image_name}:dev', container_name=container_name, client=client, logger=logger, proxy=proxy)
         container.start()
-        # reset branch
-        container.exec_run('git clean -fdx', workdir=work_dir)
-        container.exec_run('git reset --hard HEAD', workdir=work_dir)
-        # checkout base_commit 
-        git_checkout_cmd = f"git checkout {example['execution']['base_commit']}"
-        container.exec_run(git_checkout_cmd, workdir=work_dir)
-        # apply test patch
-        TEMP_PATCH = Path(patch_path)
-        TEMP_PATCH.write_text(example['execution']['test_patch'])
-        du.copy_to_container(container, TEMP_PATCH, PurePosixPath(DOCKER_PATCH))
-        cmd_res = container.exec_run(f"git apply {DOCKER_PATCH}", workdir=work_dir)
-        if cmd_res.exit_code != 0:
-            logger.info(f"Failed to apply test patch to container")
-            return None
         # get the config of the instance
         config = MAP_REPO_TO_CONFIG[example['repo']][example['execution']['version']]
-        # run pre_install
-        if 'pre_install' in config:
-            for pre_install_cmd in config['pre_install']:
-                cmd_res = container.exec_run(cmd=pre_install_cmd, workdir=work_dir)
-        # conda activate and install
-        cmd_res = container.exec_run(f"conda run -n {config['conda_env']} {config['install']}", workdir=work_dir)
+        # checkout base_commit, apply test patch, pre_install and install
+        if du.prepare_repo(container, work_dir, example['execution']['base_commit'],
+                           {'test patch': example['execution']['test_patch']}, config, logger) is None:
+            return None
+        TEMP_PATCH = Path(patch_path)
         # before
         before_test_logs = []
         logger.info(f'begin to run tests(before)')
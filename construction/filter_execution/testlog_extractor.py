@@ -1,43 +1,41 @@
 import re
 
 
-def extract_pytest_info(test_content: str, old=False):
-    test_content = re.sub(
-        r'ERROR conda\.cli\.main_run:execute\(\d+\): .*? failed\. \(See above for error\)\n',
-        '',
-        test_content
-    )
-    test_content = re.sub(
-        r'<frozen importlib._bootstrap>:241: RuntimeWarning: numpy.ndarray size changed, may indicate binary incompatibility. Expected 88 from C header, got 96 from PyObject\n\n',
-        '',
-        test_content
-    )
+# conda appends its failure message to the last line of the test output
+CONDA_ERROR_PATTERN = re.compile(
+    r'ERROR conda\.cli\.main_run:execute\(\d+\): .*? failed\. \(See above for error\)\n'
+)
+NUMPY_WARNING_PATTERN = re.compile(
+    r'<frozen importlib._bootstrap>:241: RuntimeWarning: numpy.ndarray size changed, may indicate binary incompatibility. Expected 88 from C header, got 96 from PyObject\n\n'
+)
+PYTEST_STATUSES = frozenset(['PASSED', 'FAILED', 'ERROR', 'XFAIL'])
 
-    lines = test_content.splitlines()
-    res = []
-    option_pattern = re.compile(r"(.*?)\[(.*)\]")
 
-    for line in lines:
-        parts = line.split(' ', 1)
-        if parts[0] not in ['PASSED', 'FAILED', 'ERROR', 'XFAIL']:
-            continue
-        if parts[0] == 'ERROR' and 'conda.cli.main_run' in parts[1]:
-            continue
-        has_option = option_pattern.search(parts[1])
-        if has_option:
-            main, option = has_option.groups()
-            test_name = f"{main}[{option}]"
-        else:
-            test_name = parts[1]
-        res.append((parts[0], test_name))
+def extract_pytest_info(test_content: str, old=False):
+    # the substitutions only run when their dot-free part occurs in the log
+    if 'ERROR conda' in test_content:
+        test_content = CONDA_ERROR_PATTERN.sub('', test_content)
+    if '_bootstrap>:241: RuntimeWarning: numpy' in test_content:
+        test_content = NUMPY_WARNING_PATTERN.sub('', test_content)
 
-    if old:
-        for line in lines:
+    res = []
+    # "<file> <STATUS>" lines of old pytest versions, listed after the "<STATUS> <name>" lines
+    old_res = []
+    for line in test_content.splitlines():
+        status, sep, name = line.partition(' ')
+        if sep and status in PYTEST_STATUSES:
+            if not (status == 'ERROR' and 'conda.cli.main_run' in name):
+                # keep parametrization ids up to the last ']'
+                end = name.rfind(']')
+                if end != -1 and -1 < name.find('[') < end:
+                    name = name[:end + 1]
+                res.append((status, name))
+        if old:
             parts = line.split()
-            if len(parts) >= 2 and parts[1] in ['PASSED', 'ERROR', 'FAILED', 'XFAIL']:
-                res.append((parts[1], parts[0]))
+            if len(parts) >= 2 and parts[1] in PYTEST_STATUSES:
+                old_res.append((parts[1], parts[0]))
 
-    return res
+    return res + old_res
 
 
 # -------------- old -----------------
@@ -87,41 +85,193 @@ def extract_pytest_info_old1(test_content, old=False):
     return res
 
 
+SYMPY_STATUSES = {'ok': 'PASSED', 'F': 'FAILED', 'E': 'ERROR', 'f': 'XFAIL'}
+SYMPY_SUFFIXES = (' E', ' ok', ' F', ' f')
+
+
 def extract_sympy_tests(tests_content):
-    lines = tests_content.splitlines()
-    lines = [line.strip() for line in lines]
     res = []
-    test_map = {'ok': 'PASSED', 'F': 'FAILED', 'E': 'ERROR', 'f': 'XFAIL'}
-    for line in lines:
+    for line in tests_content.splitlines():
         line = line.strip()
-        if line.startswith('test_') and any([line.endswith(i) for i in [' E', ' ok', ' F', ' f']]):
+        if line.startswith('test_') and line.endswith(SYMPY_SUFFIXES):
             parts = line.split()
-            res.append((test_map[parts[-1]], parts[0]))
+            res.append((SYMPY_STATUSES[parts[-1]], parts[0]))
     return res
 
+
+DJANGO_NAME_PATTERN = re.compile(r'test_.+? \(.+?\)')
+DJANGO_STATUSES = {'ok': 'PASSED', 'FAIL': 'FAILED', 'ERROR': 'ERROR'}
+DJANGO_SUFFIXES = ('... ok', '... ERROR', '... FAIL')
+
+
+def _last_django_name(line):
+    if 'test_' not in line or ' (' not in line:
+        return None
+    name = None
+    for match in DJANGO_NAME_PATTERN.finditer(line):
+        name = match.group(0)
+    return name
+
+
 def extract_django_tests(tests_content):
-    test_lines = tests_content.splitlines()
     tests = []
-    pattern = r'test_.+? \(.+?\)'
-    test_lines.reverse()
-    test_map = {'ok': 'PASSED', 'FAIL': 'FAILED', 'ERROR': 'ERROR'}
-    for i in range(len(test_lines)):
-        line = test_lines[i]
-        if line.startswith('test_') and any(line.endswith(i) for i in ['... ok', '... ERROR', '... FAIL']):
-            matches = re.findall(pattern, line)
-            test_name = matches[-1].strip()
-            test_res = line.split(' ... ')[-1].strip()
-            tests.insert(0, (test_map[test_res], test_name))
-        elif any(line.endswith(i) for i in ['... ok', '... ERROR', '... FAIL']) and not line.startswith('test_'):
-            test_name = ''
-            test_res = line.split(' ... ')[-1].strip()
-            # look up util finding test name
-            while i < len(test_lines) - 1:
-                i += 1
-                line = test_lines[i]
-                match = re.findall(pattern, line)
-                if match:
-                    test_name = match[-1]
-                    tests.insert(0, (test_map[test_res], test_name))
-                    break 
+    # name of the closest previous line naming a test, for results printed below a docstring
+    previous_name = None
+    for line in tests_content.splitlines():
+        name = _last_django_name(line)
+        if line.endswith(DJANGO_SUFFIXES):
+            test_res = DJANGO_STATUSES[line.rpartition(' ... ')[2].strip()]
+            if line.startswith('test_'):
+                tests.append((test_res, name.strip()))
+            elif previous_name is not None:
+                tests.append((test_res, previous_name))
+        if name is not None:
+            previous_name = name
     return tests
+
+
+def extract_xpass_ids(test_content: str):
+    """
+    Ids of the `XPASS <id>` lines of a pytest log. The stdout extractors do not report them
+    as passed, while JUnit XML records a non-strict XPASS as a plain pass.
+    """
+    ids = set()
+    for line in test_content.splitlines():
+        status, sep, rest = line.partition(' ')
+        if sep and status == 'XPASS' and rest.split():
+            ids.add(rest.split()[0])
+    return ids
+
+
+def _junit_status(testcase):
+    # a non-strict XPASS is indistinguishable from a pass here, see extract_xpass_ids
+    status = 'PASSED'
+    for child in testcase:
+        if child.tag == 'failure':
+            return 'FAILED'
+        if child.tag == 'error':
+            return 'ERROR'
+        if child.tag == 'skipped':
+            status = 'XFAIL' if child.get('type') == 'pytest.xfail' else 'SKIPPED'
+    return status
+
+
+def _junit_node_ids(classname, name, file=None):
+    """
+    Candidate pytest node ids of a testcase: exact with the `file` attribute (xunit1),
+    otherwise one per split of the dotted classname into module path and classes (xunit2).
+    """
+    parts = classname.split('.') if classname else []
+    if file:
+        module_depth = len(file[:-len('.py')].split('/')) if file.endswith('.py') else len(parts)
+        return ['::'.join([file] + parts[module_depth:] + [name])]
+    return ['::'.join(['/'.join(parts[:k]) + '.py'] + parts[k:] + [name]) for k in range(len(parts), 0, -1)]
+
+
+def extract_junit_results(xml_file, expected_ids=None):
+    """
+    (status, node id) tuples of a pytest JUnit XML report, parsed incrementally.
+
+    Without a `file` attribute the node id is ambiguous; the candidate in `expected_ids`
+    (the ids the invocation was asked to run) is used, other testcases are dropped.
+    """
+    import xml.etree.ElementTree as ET
+    expected_ids = set(expected_ids or [])
+    res = []
+    for _, elem in ET.iterparse(xml_file, events=('end',)):
+        if elem.tag != 'testcase':
+            continue
+        candidates = _junit_node_ids(elem.get('classname', ''), elem.get('name', ''), elem.get('file'))
+        node_id = candidates[0] if len(candidates) == 1 else next((c for c in candidates if c in expected_ids), None)
+        if node_id is not None:
+            res.append((_junit_status(elem), node_id))
+        elem.clear()
+    return res
+
+
+def is_result_line(line):
+    """
+    Whether an extractor above reads a result from `line`, or (django) the test name a later
+    result line refers to. Used to keep the results of test logs too long to be retained.
+    """
+    status, _, _ = line.partition(' ')
+    if status in PYTEST_STATUSES or status == 'XPASS':
+        return True
+    parts = line.split(None, 2)
+    if len(parts) >= 2 and parts[1] in PYTEST_STATUSES:
+        return True
+    stripped = line.strip()
+    if stripped.startswith('test_') and stripped.endswith(SYMPY_SUFFIXES):
+        return True
+    return line.endswith(DJANGO_SUFFIXES) or _last_django_name(line) is not None
+
+
+def _synthetic_logs(n_tests, seed=0):
+    '''
+    Large pytest / django / sympy logs with the quirks the parsers handle
+    (parametrized ids, conda error suffixes, docstring lines, tracebacks).
+    '''
+    import random
+    rng = random.Random(seed)
+    pytest_lines, django_lines, sympy_lines = [], [], []
+    for i in range(n_tests):
+        status = rng.choice(['PASSED', 'PASSED', 'PASSED', 'FAILED', 'ERROR', 'XFAIL'])
+        name = f"tests/test_mod{i % 50}.py::TestCls::test_{i}"
+        if i % 7 == 0:
+            name += f"[param-{i}-[nested]]"
+        pytest_lines.append(f"{name} {status}" if i % 11 == 0 else f"{status} {name}")
+        if i % 13 == 0:
+            pytest_lines.append(f"    assert x == {i}  # [{i}] traceback")
+        result = rng.choice(['ok', 'ok', 'ok', 'FAIL', 'ERROR'])
+        if i % 5 == 0:
+            django_lines.append(f"test_{i} (app{i % 30}.tests.Tests{i % 9})")
+            django_lines.append(f"Docstring of test {i}. ... {result}")
+        else:
+            django_lines.append(f"test_{i} (app{i % 30}.tests.Tests{i % 9}) ... {result}")
+        if i % 17 == 0:
+            django_lines.append("Traceback (most recent call last):")
+        sympy_lines.append(f"test_{i} {rng.choice(['ok', 'ok', 'F', 'E', 'f'])}")
+    pytest_lines.append("FAILED tests/test_last.py::test_z ERROR conda.cli.main_run:execute(47): "
+                        "`conda run pytest` failed. (See above for error)")
+    pytest_lines.append("PASSED tests/test_after.py::test_y")
+    return '\n'.join(pytest_lines) + '\n', '\n'.join(django_lines) + '\n', '\n'.join(sympy_lines) + '\n'
+
+
+if __name__ == '__main__':
+    # benchmark of the parsers on large synthetic logs; given the path of a previous version of this
+    # module (e.g. `git show <rev>:construction/filter_execution/testlog_extractor.py > /tmp/prev.py`),
+    # its parsers are timed too and must return the same results
+    import importlib.util
+    import sys
+    import time
+
+    previous = None
+    if len(sys.argv) > 1:
+        spec = importlib.util.spec_from_file_location('previous_testlog_extractor', sys.argv[1])
+        previous = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(previous)
+
+    def bench(fn, *args, repeat=3):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn(*args)
+            best = min(best, time.perf_counter() - start)
+        return result, best
+
+    for n_tests in [10000, 100000]:
+        pytest_log, django_log, sympy_log = _synthetic_logs(n_tests)
+        cases = [
+            ('pytest', 'extract_pytest_info', (pytest_log,)),
+            ('pytest old', 'extract_pytest_info', (pytest_log, True)),
+            ('django', 'extract_django_tests', (django_log,)),
+            ('sympy', 'extract_sympy_tests', (sympy_log,)),
+        ]
+        for label, name, args in cases:
+            result, current_time = bench(globals()[name], *args)
+            line = f"{label:<12}{n_tests:>8} tests {len(args[0]) / 2 ** 20:6.1f} MB  current {current_time:7.3f}s"
+            if previous is not None:
+                expected, previous_time = bench(getattr(previous, name), *args)
+                assert result == expected, f"{label}: results differ"
+                line += f"  previous {previous_time:7.3f}s  ({previous_time / current_time:.1f}x)"
+            print(line)
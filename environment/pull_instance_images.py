@@ -1,43 +1,194 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+pull_instance_images.py
+
+Pull the ncbench_{instance_id} images from the hub (or another registry) and tag them
+as ncbench_{instance_id}:latest. Pulls run concurrently; one image per repo is pulled
+first so that the layers shared by the images of a repo are downloaded once. Tags
+already present with the remote digest are skipped, failed pulls are retried with
+backoff, and a summary of the transferred bytes is printed at the end.
+"""
 
 import argparse
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import docker
 from tqdm import tqdm
 from datasets import load_dataset
 
+from utils.image_index import ImageIndex
+
 
 DOCKERHUB_USER = 'nocodebench'
 REPO_NAME = 'nocode-bench-instances'
 
 
-def pull_and_tag_image(client, instance_id):
-    remote_tag = f'{DOCKERHUB_USER}/{REPO_NAME}:ncbench_{instance_id}'
-    local_tag = f'ncbench_{instance_id}:latest'
+class PullStats:
+    """
+    Layers and bytes seen in the progress streams of all pulls. A layer is counted once,
+    even if several images containing it are pulled at the same time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._layer_bytes = {}
+        self.downloaded = set()
+        self.reused = set()
+        self.pulled = 0
+        self.skipped = 0
+        self.failed = []
+        self.start = time.time()
+
+    def update(self, line):
+        layer = line.get('id')
+        status = line.get('status', '')
+        if not layer or layer.startswith('ncbench_'):
+            return
+        with self._lock:
+            if status == 'Downloading':
+                total = (line.get('progressDetail') or {}).get('total') or 0
+                self._layer_bytes[layer] = max(self._layer_bytes.get(layer, 0), total)
+            elif status in ('Download complete', 'Pull complete'):
+                self.downloaded.add(layer)
+            elif status == 'Already exists':
+                self.reused.add(layer)
+
+    def record(self, outcome, instance_id=None):
+        with self._lock:
+            if outcome == 'pulled':
+                self.pulled += 1
+            elif outcome == 'skipped':
+                self.skipped += 1
+            else:
+                self.failed.append(instance_id)
+
+    @property
+    def bytes_transferred(self):
+        with self._lock:
+            return sum(self._layer_bytes.get(layer, 0) for layer in self.downloaded)
+
+    def rate_mbps(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        return self.bytes_transferred * 8 / 2 ** 20 / elapsed
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        transferred = self.bytes_transferred
+        return (f'pulled {self.pulled}, skipped {self.skipped}, failed {len(self.failed)}; '
+                f'{len(self.downloaded)} layers downloaded, {len(self.reused - self.downloaded)} already present; '
+                f'{transferred / 2 ** 30:.2f} GB in {elapsed:.0f}s ({transferred / 2 ** 20 / max(elapsed, 1e-6):.1f} MB/s)')
+
+
+def remote_repository(registry=None):
+    return f'{registry}/{DOCKERHUB_USER}/{REPO_NAME}' if registry else f'{DOCKERHUB_USER}/{REPO_NAME}'
+
 
+def is_up_to_date(client, images, local_tag, remote_tag):
+    """
+    Whether `local_tag` exists and need not be pulled: it carries the digest of `remote_tag`,
+    or it was built locally (no digest of the remote repository).
+    """
+    if local_tag not in images:
+        return False
+    repository = remote_tag.rsplit(':', 1)[0]
+    digests = [d.split('@', 1)[1] for d in images.repo_digests(local_tag) if d.split('@', 1)[0] == repository]
+    if not digests:
+        return True
     try:
-        print(f'Pulling {remote_tag} ...')
-        image = client.images.pull(remote_tag)
-        image.tag(local_tag)
-        print(f'Tagged as {local_tag}')
+        return client.images.get_registry_data(remote_tag).id in digests
+    except docker.errors.APIError:
+        # registry not reachable, keep the local image
         return True
-    except Exception as e:
-        print(f'Failed to pull/tag {remote_tag}: {e}')
-        return False
+
+
+def pull_and_tag_image(client, instance_id, images=None, stats=None, registry=None, retries=3, backoff=5.0):
+    remote_repo = remote_repository(registry)
+    remote_tag = f'{remote_repo}:ncbench_{instance_id}'
+    local_tag = f'ncbench_{instance_id}:latest'
+
+    if images is not None and is_up_to_date(client, images, local_tag, remote_tag):
+        if stats is not None:
+            stats.record('skipped')
+        return True
+    for attempt in range(retries + 1):
+        try:
+            # the daemon keeps completed layers, a retry only downloads the missing ones
+            for line in client.api.pull(remote_repo, tag=f'ncbench_{instance_id}', stream=True, decode=True):
+                if 'error' in line:
+                    raise docker.errors.APIError(line['error'])
+                if stats is not None:
+                    stats.update(line)
+            image = client.images.get(remote_tag)
+            image.tag(local_tag)
+            if images is not None:
+                images.add(image, local_tag)
+            if stats is not None:
+                stats.record('pulled')
+            return True
+        except Exception as e:
+            if attempt == retries:
+                tqdm.write(f'Failed to pull/tag {remote_tag}: {e}')
+                if stats is not None:
+                    stats.record('failed', instance_id)
+                return False
+            delay = backoff * 2 ** attempt
+            tqdm.write(f'Pull of {remote_tag} failed ({e}), retrying in {delay:.0f}s')
+            time.sleep(delay)
+
+
+def order_by_repo(tasks):
+    """
+    One image per repo first (they bring the layers shared by the repo), then the rest.
+    """
+    by_repo = defaultdict(list)
+    for task in tasks:
+        by_repo[task['repo']].append(task)
+    firsts = [group[0] for group in by_repo.values()]
+    rest = [task for group in by_repo.values() for task in group[1:]]
+    return firsts, rest
 
 
 def main():
     parser = argparse.ArgumentParser(description='Pull and rename ncbench images from Docker Hub')
     parser.add_argument("--bench_tasks", type=str, help="Path to benchmark task instances file", required=True,
                         choices=['NoCode-bench/NoCode-bench_Verified', 'NoCode-bench/NoCode-bench_Full'], default='NoCode-bench/NoCode-bench_Verified')
+    parser.add_argument('--max_workers', type=int, default=4,
+                        help='Images pulled at the same time')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Retries of a failed pull, with exponential backoff')
+    parser.add_argument('--max_mbps', type=float, default=0,
+                        help='Do not start new pulls while the average rate is above this many Mbit/s (0: no limit)')
+    parser.add_argument('--registry', type=str, default=None,
+                        help='Pull from this registry (e.g. localhost:5000) instead of Docker Hub')
     args = parser.parse_args()
 
     tasks = load_dataset(args.bench_tasks, split='test')
     client = docker.from_env()
+    images = ImageIndex(client)
+    stats = PullStats()
+
+    def pull(task):
+        # the daemon does the transfer, so the rate is bounded by holding back new pulls
+        while args.max_mbps and stats.rate_mbps() > args.max_mbps:
+            time.sleep(1)
+        return pull_and_tag_image(client, task['instance_id'], images, stats, args.registry, args.retries)
+
+    firsts, rest = order_by_repo(tasks)
+    with tqdm(total=len(tasks), desc='pulling') as progress:
+        with ThreadPoolExecutor(args.max_workers) as pool:
+            for batch in [firsts, rest]:
+                futures = [pool.submit(pull, task) for task in batch]
+                for _ in as_completed(futures):
+                    progress.update(1)
+                    progress.set_postfix_str(f'{stats.bytes_transferred / 2 ** 30:.1f} GB')
 
-    for task in tqdm(tasks, desc='pulling'):
-        instance_id = task['instance_id']
-        pull_and_tag_image(client, instance_id)
+    print(stats.summary())
+    if stats.failed:
+        print(f'Failed: {" ".join(stats.failed)}')
 
 
 if __name__ == '__main__':
@@ -1,9 +1,24 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+"""
+push_instance_images.py
+
+Push the ncbench_{instance_id}:latest images to the hub (or another registry).
+The tags already in the remote repository are listed once (and cached on disk) instead
+of being checked per image, images are pushed by a bounded pool of threads with one
+aggregated progress bar, and pushed instances are recorded in a state file so that an
+interrupted push restarts where it stopped.
+"""
 
 import argparse
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import docker
+import requests
 from tqdm import tqdm
 from datasets import load_dataset
 
@@ -11,43 +26,171 @@ DOCKERHUB_USER = 'nocodebench'
 REPO_NAME = 'nocode-bench-instances'
 
 
-def docker_login(client, username: str, password: str):
+def docker_login(client, username: str, password: str, registry=None):
     try:
-        client.login(username=username, password=password)
+        client.login(username=username, password=password, registry=registry)
         print(f'Successfully logged in as {username}')
     except docker.errors.APIError as e:
         print(f'Login failed: {e}')
         exit(1)
 
 
-def check_remote_image_exists(client, remote_tag):
-    try:
-        client.images.get_registry_data(remote_tag)
-        return True
-    except docker.errors.APIError:
-        return False
+def remote_repository(registry=None):
+    return f'{registry}/{DOCKERHUB_USER}/{REPO_NAME}' if registry else f'{DOCKERHUB_USER}/{REPO_NAME}'
+
+
+def fetch_remote_tags(registry=None, auth=None):
+    """
+    All tags of the remote repository, listed page by page: through the Docker Hub API,
+    or the registry API (`/v2/<name>/tags/list`) of `registry`.
+    """
+    tags = set()
+    if registry:
+        scheme = 'http' if registry.startswith(('localhost', '127.0.0.1')) else 'https'
+        url = f'{scheme}://{registry}/v2/{DOCKERHUB_USER}/{REPO_NAME}/tags/list?n=1000'
+        while url:
+            resp = requests.get(url, auth=auth, timeout=30)
+            if resp.status_code == 404:
+                # the repository does not exist yet
+                break
+            resp.raise_for_status()
+            tags.update(resp.json().get('tags') or [])
+            next_url = resp.links.get('next', {}).get('url')
+            url = f'{scheme}://{registry}{next_url}' if next_url and next_url.startswith('/') else next_url
+    else:
+        url = f'https://hub.docker.com/v2/repositories/{DOCKERHUB_USER}/{REPO_NAME}/tags?page_size=100'
+        while url:
+            resp = requests.get(url, timeout=30)
+            if resp.status_code == 404:
+                break
+            resp.raise_for_status()
+            data = resp.json()
+            tags.update(result['name'] for result in data.get('results', []))
+            url = data.get('next')
+    return tags
+
+
+class RemoteTagCache:
+    """
+    Tags of the remote repository, listed once and kept in a JSON file
+    `{repository: {"fetched_at": float, "tags": [...]}}` for `ttl` seconds.
+    Tags pushed by this process are added as they complete.
+
+    Args:
+        fpath (str): JSON file.
+        repository (str): Remote repository whose tags are cached.
+        ttl (float): Seconds after which the listing is fetched again.
+    """
+
+    def __init__(self, fpath, repository, ttl):
+        self.fpath = fpath
+        self.repository = repository
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        if fpath and os.path.exists(fpath):
+            with open(fpath, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+
+    def load(self, fetch):
+        entry = self._entries.get(self.repository)
+        if entry is None or time.time() - entry['fetched_at'] > self.ttl:
+            entry = {'fetched_at': time.time(), 'tags': sorted(fetch())}
+            with self._lock:
+                self._entries[self.repository] = entry
+                self._save()
+        self.tags = set(entry['tags'])
+        return self.tags
+
+    def add(self, tag):
+        with self._lock:
+            self.tags.add(tag)
+            self._entries[self.repository]['tags'] = sorted(self.tags)
+            self._save()
+
+    def _save(self):
+        if not self.fpath:
+            return
+        tmp_fpath = f'{self.fpath}.{os.getpid()}.tmp'
+        with open(tmp_fpath, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_fpath, self.fpath)
+
+
+class PushState:
+    """
+    Instances pushed so far to `repository`, one `repository<TAB>instance_id` line per push,
+    appended as each push completes. A file may be shared by several targets, only the
+    lines of `repository` count.
+    """
 
+    def __init__(self, fpath, repository):
+        self.fpath = fpath
+        self.repository = repository
+        self._lock = threading.Lock()
+        self.done = set()
+        if os.path.exists(fpath):
+            with open(fpath, 'r', encoding='utf-8') as f:
+                for line in f:
+                    repository, _, instance_id = line.strip().partition('\t')
+                    # lines without a repository predate the per-target state, the remote tags decide
+                    if instance_id and repository == self.repository:
+                        self.done.add(instance_id)
 
-def push_image(client, instance_id):
+    def mark(self, instance_id):
+        with self._lock:
+            self.done.add(instance_id)
+            with open(self.fpath, 'a', encoding='utf-8') as f:
+                f.write(f'{self.repository}\t{instance_id}\n')
+
+
+class PushProgress:
+    """
+    Layers and bytes of all concurrent pushes, counted once per layer.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._layer_bytes = {}
+        self.pushed_layers = set()
+        self.existing_layers = set()
+
+    def update(self, line):
+        layer = line.get('id')
+        status = line.get('status', '')
+        if not layer:
+            return
+        with self._lock:
+            if status == 'Pushing':
+                total = (line.get('progressDetail') or {}).get('total') or 0
+                self._layer_bytes[layer] = max(self._layer_bytes.get(layer, 0), total)
+            elif status == 'Pushed':
+                self.pushed_layers.add(layer)
+            elif status == 'Layer already exists':
+                self.existing_layers.add(layer)
+
+    @property
+    def bytes_pushed(self):
+        with self._lock:
+            return sum(self._layer_bytes.get(layer, 0) for layer in self.pushed_layers)
+
+
+def push_image(client, instance_id, registry=None, progress=None):
     local_tag = f'ncbench_{instance_id}:latest'
-    remote_tag = f'{DOCKERHUB_USER}/{REPO_NAME}:ncbench_{instance_id}'
+    remote_repo = remote_repository(registry)
+    remote_tag = f'{remote_repo}:ncbench_{instance_id}'
 
     try:
-        # 检查远程镜像是否存在
-        if check_remote_image_exists(client, remote_tag):
-            print(f'Image {remote_tag} already exists in remote repository, skipping...')
-            return True
-
         image = client.images.get(local_tag)
         image.tag(remote_tag)
-        print(f'Tagged {local_tag} as {remote_tag}')
-        for line in client.images.push(remote_tag, stream=True, decode=True):
-            status = line.get('status') or line.get('error')
-            if status:
-                print(status)
+        for line in client.images.push(remote_repo, tag=f'ncbench_{instance_id}', stream=True, decode=True):
+            if 'error' in line:
+                raise docker.errors.APIError(line['error'])
+            if progress is not None:
+                progress.update(line)
         return True
     except Exception as e:
-        print(f'Failed to push image {local_tag}: {e}')
+        tqdm.write(f'Failed to push image {local_tag}: {e}')
         return False
 
 
@@ -60,6 +203,16 @@ def main():
                         help='Docker Hub username')
     parser.add_argument('--dockerhub_pass', required=False,
                         help='Docker Hub password (or use DOCKERHUB_PASS env var)')
+    parser.add_argument('--registry', type=str, default=None,
+                        help='Push to this registry (e.g. localhost:5000) instead of Docker Hub')
+    parser.add_argument('--max_workers', type=int, default=4,
+                        help='Images pushed at the same time')
+    parser.add_argument('--state_file', type=str, default='push_state.txt',
+                        help='Instances pushed so far per remote repository; a rerun to the same target skips them')
+    parser.add_argument('--tag_cache', type=str, default='remote_tags.json',
+                        help='Cache of the tags listed from the remote repository')
+    parser.add_argument('--tag_cache_ttl', type=float, default=24,
+                        help='Hours before the remote tags are listed again')
     args = parser.parse_args()
 
     password = args.dockerhub_pass or os.getenv('DOCKERHUB_PASS')
@@ -70,13 +223,38 @@ def main():
     tasks = load_dataset(args.bench_tasks, split='test')
     client = docker.from_env()
 
-    docker_login(client, args.dockerhub_user, password)
+    docker_login(client, args.dockerhub_user, password, args.registry)
+
+    state = PushState(args.state_file, remote_repository(args.registry))
+    remote_tags = RemoteTagCache(args.tag_cache, remote_repository(args.registry), args.tag_cache_ttl * 3600)
+    remote_tags.load(lambda: fetch_remote_tags(args.registry, (args.dockerhub_user, password)))
+    todo = [task['instance_id'] for task in tasks
+            if task['instance_id'] not in state.done and f'ncbench_{task["instance_id"]}' not in remote_tags.tags]
+    print(f'{len(tasks) - len(todo)} of {len(tasks)} images already pushed, pushing {len(todo)}')
+
+    progress = PushProgress()
+    failed = []
+
+    def push(instance_id):
+        if push_image(client, instance_id, args.registry, progress):
+            state.mark(instance_id)
+            remote_tags.add(f'ncbench_{instance_id}')
+            return True
+        failed.append(instance_id)
+        return False
 
-    for task in tqdm(tasks, desc='pushing'):
-        instance_id = task['instance_id']
-        push_image(client, instance_id)
+    with tqdm(total=len(todo), desc='pushing') as bar:
+        with ThreadPoolExecutor(args.max_workers) as pool:
+            futures = [pool.submit(push, instance_id) for instance_id in todo]
+            for _ in as_completed(futures):
+                bar.update(1)
+                bar.set_postfix_str(f'{progress.bytes_pushed / 2 ** 30:.1f} GB, {len(failed)} failed')
+
+    print(f'pushed {len(todo) - len(failed)}, failed {len(failed)}; {len(progress.pushed_layers)} layers '
+          f'({progress.bytes_pushed / 2 ** 30:.2f} GB) uploaded, {len(progress.existing_layers)} already in the registry')
+    if failed:
+        print(f'Failed: {" ".join(failed)}')
 
 
 if __name__ == '__main__':
     main()
-
@@ -3,45 +3,242 @@
 """
 create_instance_image.py
 
-Build a minimal ncbench_{instance_id}:latest image for each SWE-bench instance.
-Steps: checkout base commit → run pre_install → install deps → commit image.
+Build a minimal ncbench_{instance_id}:latest image for each NoCode-bench instance.
+Steps per instance: checkout base commit → run pre_install → install → commit image.
 No patches and no tests are applied.
+With --env_layers, tasks are grouped by (repo, version, conda_env) and each group shares
+an environment layer (ncbench_env_{repo}:{version}_{conda_env}) with the dependencies
+installed once; the instance images are committed on top of it.
 """
 
 import argparse
+import json
 import os
+import time
+from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from itertools import zip_longest
+from threading import Lock
 
 import docker
 from tqdm import tqdm
 
 import utils.docker_utils as du
 from construction.filter_execution.constants import MAP_REPO_TO_CONFIG
+from utils.image_index import ImageIndex
 from utils.logger import get_logger
+from utils.resource_governor import ResourceGovernor
 from datasets import load_dataset
 
 
+_env_layer_locks = defaultdict(Lock)
+_env_layer_locks_guard = Lock()
+_env_layers = {}
+_report_lock = Lock()
+
+
+def group_key(task):
+    cfg = MAP_REPO_TO_CONFIG[task['repo']][task['version']]
+    return task['repo'], task['version'], cfg['conda_env'].strip()
+
+
+def env_layer_name(repo_name, version, conda_env):
+    return f'ncbench_env_{repo_name}:{version}_{conda_env}'
+
+
+def interleave_groups(tasks):
+    """
+    Order tasks round-robin over their (repo, version, conda_env) groups, so the first
+    workers build the environment layers of different groups in parallel.
+    """
+    groups = defaultdict(list)
+    for task in tasks:
+        groups[group_key(task)].append(task)
+    ordered = sorted(groups.values(), key=len, reverse=True)
+    return [task for batch in zip_longest(*ordered) for task in batch if task is not None]
+
+
+def image_sizes(client, image_name):
+    """
+    (total size, size of the top layer) of an image in bytes; the top layer is what a
+    committed image adds on top of its parent.
+    """
+    image = client.images.get(image_name)
+    history = image.history()
+    return image.attrs.get('Size', 0), history[0].get('Size', 0) if history else 0
+
+
+def project_distributions(freeze_output, work_dir):
+    """
+    Names of the distributions installed from `work_dir`, parsed from `pip freeze`:
+    editable installs (`-e git+...#egg=name`, `-e /root/repo`) and direct installs
+    (`name @ file:///root/repo`).
+    """
+    names = []
+    for line in freeze_output.splitlines():
+        line = line.strip()
+        if line.startswith('-e '):
+            if '#egg=' in line:
+                names.append(line.split('#egg=', 1)[1].split('&', 1)[0])
+            elif line[3:].strip().rstrip('/') == work_dir:
+                names.append(os.path.basename(work_dir))
+        elif ' @ file://' in line and line.split(' @ file://', 1)[1].rstrip('/') == work_dir:
+            names.append(line.split(' @ ', 1)[0])
+    return names
+
+
+def run_setup(container, cfg, work_dir, slot):
+    """
+    Run pre_install and install of a config in the container; returns the install exit code.
+    """
+    for cmd in cfg.get('pre_install', []):
+        container.exec_run(cmd, workdir=work_dir, demux=True)
+    with slot():
+        cmd_res = container.exec_run(f'conda run -n {cfg["conda_env"]} {cfg["install"]}', workdir=work_dir,
+                                     demux=True)
+    return cmd_res.exit_code
+
+
+def build_env_layer(task, client, logger, proxy=None, governor=None, report=None, images=None):
+    """
+    Return the shared environment layer of the task's (repo, version, conda_env) group.
+    On first use it is built from `fb_{repo}:dev` by installing the repo at the task's base
+    commit, so the dependencies of the conda env are resolved once per group, then the
+    project itself is uninstalled again; every instance image runs the full install of
+    its own base commit on top of it.
+    Returns `fb_{repo}:dev` if the layer could not be built.
+    """
+    repo_url, version, conda_env = group_key(task)
+    repo_name = repo_url.split('/')[-1]
+    work_dir = f'/root/{repo_name}'
+    dev_image = f'fb_{repo_name}:dev'
+    layer = env_layer_name(repo_name, version, conda_env)
+    with _env_layer_locks_guard:
+        key_lock = _env_layer_locks[layer]
+
+    with key_lock:
+        if layer in _env_layers:
+            return _env_layers[layer]
+        if images is not None and layer in images:
+            _env_layers[layer] = layer
+            return layer
+        if images is None:
+            try:
+                client.images.get(layer)
+                _env_layers[layer] = layer
+                return layer
+            except docker.errors.ImageNotFound:
+                pass
+
+        logger.info(f'building environment layer {layer}')
+        slot = governor.slot if governor is not None else nullcontext
+        start = time.time()
+        container = None
+        _env_layers[layer] = dev_image
+        try:
+            container = du.build_container(
+                image_name=dev_image,
+                container_name=f'fb_{repo_name}__env_{version}_{conda_env}',
+                client=client,
+                logger=logger,
+                proxy=proxy
+            )
+            container.start()
+            container.exec_run(f'git checkout {task["base_commit"]}', workdir=work_dir)
+            exit_code = run_setup(container, MAP_REPO_TO_CONFIG[repo_url][version], work_dir, slot)
+            if exit_code != 0:
+                # a broken environment is not shared, instances of the group start from the dev image
+                logger.error(f'install failed, not committing environment layer {layer}')
+                return dev_image
+            # keep the dependencies only, each instance installs the project at its own base commit
+            cfg = MAP_REPO_TO_CONFIG[repo_url][version]
+            freeze = container.exec_run(f'conda run -n {cfg["conda_env"]} pip freeze', workdir=work_dir)
+            projects = project_distributions(freeze.output.decode(errors='ignore'), work_dir)
+            if freeze.exit_code != 0 or not projects:
+                logger.error(f'could not find the project install of {repo_name}, not committing environment layer {layer}')
+                return dev_image
+            cmd_res = container.exec_run(f'conda run -n {cfg["conda_env"]} pip uninstall -y {" ".join(projects)}',
+                                         workdir=work_dir)
+            if cmd_res.exit_code != 0:
+                logger.error(f'uninstalling {projects} failed, not committing environment layer {layer}')
+                return dev_image
+            # leave a clean worktree, each instance checks out its own base commit
+            container.exec_run('git clean -fdx', workdir=work_dir)
+            container.exec_run('git reset --hard HEAD', workdir=work_dir)
+            repository, tag = layer.split(':')
+            with slot():
+                img = container.commit(repository=repository, tag=tag)
+            if images is not None:
+                images.add(img, layer)
+            size, layer_size = image_sizes(client, layer)
+            record = {'image': layer, 'kind': 'env', 'build_time': time.time() - start,
+                      'size': size, 'layer_size': layer_size}
+            write_report(report, record)
+            logger.info(f'committed environment layer {layer} in {record["build_time"]:.0f}s, '
+                        f'adds {layer_size / 2 ** 20:.0f} MB')
+            _env_layers[layer] = layer
+            return layer
+        except Exception as e:
+            logger.error(f'failed to build environment layer {layer}: {e}')
+            return dev_image
+        finally:
+            du.cleanup_container(client, container, logger)
+
+
+def write_report(report, record):
+    if report is None:
+        return
+    with _report_lock:
+        with open(report, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
 def build_image_for_instance(task: dict,
                              client: docker.DockerClient,
                              log_dir: str,
-                             proxy: str = None):
+                             proxy: str = None,
+                             governor: ResourceGovernor = None,
+                             report: str = None,
+                             images: ImageIndex = None,
+                             env_layers: bool = False):
+    """
+    Build ncbench_{instance_id}:latest from `fb_{repo}:dev`, or with `env_layers` on top of
+    the environment layer of the instance's group; the build time and sizes are appended
+    to `report` (jsonl). Existence checks go through the `images` index when given.
+    """
     instance_id = task['instance_id']
     repo_url    = task['repo']
     repo_name   = repo_url.split('/')[-1]
     work_dir    = f'/root/{repo_name}'
-    img_repo = f'ncbench_{instance_id}'
+    img_repo, img_tag = f'ncbench_{instance_id}', 'latest'
 
-    if any(img_repo in tag for img in client.images.list(name=img_repo) for tag in img.tags):
+    if images is not None:
+        exists = f'{img_repo}:{img_tag}' in images
+    else:
+        try:
+            client.images.get(f'{img_repo}:{img_tag}')
+            exists = True
+        except docker.errors.ImageNotFound:
+            exists = False
+    if exists:
         print(f"Image {img_repo}:latest already exists, skipping...")
         return
 
     logger = get_logger(instance_id,
                         os.path.join(log_dir, f'{instance_id}.log'))
+    slot = governor.slot if governor is not None else nullcontext
     container = None
     try:
+        start = time.time()
+        if env_layers:
+            base_image = build_env_layer(task, client, logger, proxy, governor, report, images)
+        else:
+            base_image = f'fb_{repo_name}:dev'
+
         # 1. 启动容器
         container = du.build_container(
-            image_name=f'fb_{repo_name}:dev',
+            image_name=base_image,
             container_name=f'fb_{repo_name}__{instance_id}',
             client=client,
             logger=logger,
@@ -54,20 +251,23 @@ def build_image_for_instance(task: dict,
         container.exec_run('git reset --hard HEAD', workdir=work_dir)
         container.exec_run(f'git checkout {task["base_commit"]}', workdir=work_dir)
 
-        # 3. 预安装脚本和依赖安装
+        # 3. 预安装脚本和依赖安装 (full install, also on top of an environment layer)
         cfg = MAP_REPO_TO_CONFIG[repo_url][task['version']]
-        for cmd in cfg.get('pre_install', []):
-            container.exec_run(cmd, workdir=work_dir, demux=True)
-        install_cmd = f'conda run -n {cfg["conda_env"]} {cfg["install"]}'
-        container.exec_run(install_cmd, workdir=work_dir, demux=True)
+        if run_setup(container, cfg, work_dir, slot) != 0:
+            logger.error(f'install failed for {instance_id}')
 
         # 4. 提交镜像
-        img_repo, img_tag = f'ncbench_{instance_id}', 'latest'
-        if not any(img_repo in tag
-                   for img in client.images.list(name=img_repo)
-                   for tag in img.tags):
+        with slot():
             img = container.commit(repository=img_repo, tag=img_tag)
-            logger.info(f'committed image: {img.tags[0]}')
+        if images is not None:
+            images.add(img, f'{img_repo}:{img_tag}')
+        logger.info(f'committed image: {img.tags[0]}')
+        size, layer_size = image_sizes(client, f'{img_repo}:{img_tag}')
+        record = {'image': f'{img_repo}:{img_tag}', 'kind': 'instance', 'instance_id': instance_id,
+                  'base_image': base_image, 'build_time': time.time() - start, 'size': size,
+                  'layer_size': layer_size}
+        write_report(report, record)
+        return record
 
     except Exception as e:
         logger.error(f'build failed: {e}')
@@ -75,9 +275,30 @@ def build_image_for_instance(task: dict,
         du.cleanup_container(client, container, logger)
 
 
+def summarize_report(report):
+    """
+    Totals of a build report: images, build time and disk added by the layers.
+    """
+    records = []
+    if os.path.exists(report):
+        with open(report) as f:
+            records = [json.loads(line) for line in f if line.strip()]
+    lines = []
+    for kind in ['env', 'instance']:
+        of_kind = [r for r in records if r['kind'] == kind]
+        if not of_kind:
+            continue
+        added = sum(r['layer_size'] for r in of_kind)
+        build_time = sum(r['build_time'] for r in of_kind)
+        lines.append(f'{kind} images: {len(of_kind)}, build time {build_time:.0f}s '
+                     f'(mean {build_time / len(of_kind):.0f}s), added {added / 2 ** 30:.2f} GB '
+                     f'(mean {added / len(of_kind) / 2 ** 20:.0f} MB)')
+    return '\n'.join(lines)
+
+
 def main():
     parser = argparse.ArgumentParser(
-        description='Build ncbench images from SWE-bench tasks (no patches, no tests)')
+        description='Build ncbench images from NoCode-bench tasks (no patches, no tests)')
     parser.add_argument("--bench_tasks", type=str, help="Path to benchmark task instances file", required=True,
                         choices=['NoCode-bench/NoCode-bench_Verified', 'NoCode-bench/NoCode-bench_Full'],
                         default='NoCode-bench/NoCode-bench_Verified')
@@ -85,6 +306,14 @@ def main():
                         help='Directory for build logs')
     parser.add_argument('--max_workers', type=int, default=1,
                         help='Thread pool size')
+    parser.add_argument('--cpu_slots', type=int, default=0,
+                        help='Max installs and commits running at once (default: no limit besides max_workers)')
+    parser.add_argument('--min_free_gb', type=int, default=0,
+                        help='Hold back new installs and commits while the Docker root dir has less free space')
+    parser.add_argument('--proxy', type=str, default=None,
+                        help='Proxy passed to the build containers')
+    parser.add_argument('--env_layers', action='store_true',
+                        help='Build the instance images on shared (repo, version, conda_env) environment layers')
     args = parser.parse_args()
 
     os.makedirs(args.log_dir, exist_ok=True)
@@ -92,20 +321,35 @@ def main():
                         os.path.join(args.log_dir, 'build_images.log'))
     logger.info(args)
 
-    tasks = load_dataset(args.bench_tasks, split='test')
     client = docker.from_env()
+    # one daemon call to plan the whole dataset
+    images = ImageIndex(client)
+    all_tasks = load_dataset(args.bench_tasks, split='test')
+    tasks = [t for t in all_tasks if f'ncbench_{t["instance_id"]}:latest' not in images]
+    logger.info(f'{len(all_tasks) - len(tasks)} of {len(all_tasks)} images already exist, building {len(tasks)}')
+    if args.env_layers:
+        tasks = interleave_groups(tasks)
+    report = os.path.join(args.log_dir, 'build_report.jsonl')
+
+    governor = None
+    if args.cpu_slots > 0 or args.min_free_gb > 0:
+        governor = ResourceGovernor(args.cpu_slots if args.cpu_slots > 0 else args.max_workers,
+                                    disk_headroom_mb=args.min_free_gb * 1024,
+                                    disk_path=client.info().get('DockerRootDir'))
 
     if args.max_workers == 1:
         for t in tqdm(tasks, desc='building'):
-            build_image_for_instance(t, client, args.log_dir)
+            build_image_for_instance(t, client, args.log_dir, args.proxy, governor, report, images, args.env_layers)
     else:
         with ThreadPoolExecutor(args.max_workers) as pool:
             futures = [pool.submit(build_image_for_instance,
-                                   t, client, args.log_dir) for t in tasks]
+                                   t, client, args.log_dir, args.proxy, governor, report, images, args.env_layers)
+                       for t in tasks]
             for _ in tqdm(as_completed(futures),
                           total=len(futures), desc='building'):
                 pass
 
+    logger.info(summarize_report(report))
     logger.info('all done')
 
 
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+slim_instance_images.py
+
+Optional post-build stage for the ncbench_{instance_id}:latest images: remove the conda
+envs the instance does not use (every env of setup_<repo>.sh except the one of its
+MAP_REPO_TO_CONFIG entry), clear pip/conda caches and build temp dirs, then squash the
+image into a single layer, since files deleted in a new layer would still be pulled.
+The size before and after is written to <log_dir>/slim_report.jsonl.
+
+A squashed image no longer shares the layers of fb_{repo}:dev (or of its environment
+layer) with the other images; it is smaller to pull and start on its own, but a host
+keeping many instance images of one repo may use more disk than before.
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock
+
+import docker
+from tqdm import tqdm
+
+import utils.docker_utils as du
+from construction.filter_execution.constants import MAP_REPO_TO_CONFIG
+from utils.image_index import ImageIndex
+from utils.logger import get_logger
+from datasets import load_dataset
+
+
+CLEAN_CMDS = [
+    'conda clean -afy',
+    'rm -rf /root/.cache/pip /tmp/*',
+]
+
+SLIM_LABEL = 'ncbench.slimmed'
+
+_report_lock = Lock()
+
+
+def unused_envs(container, keep_env):
+    """
+    Names of the conda envs of the container other than `base` and `keep_env`.
+    """
+    cmd_res = container.exec_run('conda env list --json')
+    if cmd_res.exit_code != 0:
+        return []
+    envs = json.loads(cmd_res.output.decode(errors='ignore')).get('envs', [])
+    return [os.path.basename(path) for path in envs
+            if '/envs/' in path and os.path.basename(path) != keep_env]
+
+
+def config_changes(config):
+    """
+    Dockerfile instructions restoring the config of the original image on the imported one.
+    """
+    changes = []
+    for env in config.get('Env') or []:
+        key, _, value = env.partition('=')
+        changes.append(f'ENV {key}={json.dumps(value)}')
+    if config.get('WorkingDir'):
+        changes.append(f'WORKDIR {config["WorkingDir"]}')
+    if config.get('User'):
+        changes.append(f'USER {config["User"]}')
+    if config.get('Entrypoint'):
+        changes.append(f'ENTRYPOINT {json.dumps(config["Entrypoint"])}')
+    if config.get('Cmd'):
+        changes.append(f'CMD {json.dumps(config["Cmd"])}')
+    for key, value in (config.get('Labels') or {}).items():
+        changes.append(f'LABEL {json.dumps(key)}={json.dumps(value)}')
+    changes.append(f'LABEL {SLIM_LABEL}=1')
+    return changes
+
+
+def slim_image(task, client, log_dir, images=None, keep_original=False, report=None):
+    """
+    Slim and squash ncbench_{instance_id}:latest in place; returns its report record.
+    """
+    instance_id = task['instance_id']
+    repo_name = task['repo'].split('/')[-1]
+    work_dir = f'/root/{repo_name}'
+    img_repo, img_tag = f'ncbench_{instance_id}', 'latest'
+    image_name = f'{img_repo}:{img_tag}'
+
+    if images is not None and image_name not in images:
+        print(f'Image {image_name} does not exist, skipping...')
+        return None
+
+    logger = get_logger(instance_id, os.path.join(log_dir, f'{instance_id}.log'))
+    container = None
+    try:
+        start = time.time()
+        original = client.images.get(image_name)
+        if SLIM_LABEL in ((original.attrs.get('Config') or {}).get('Labels') or {}):
+            logger.info(f'{image_name} is already slimmed')
+            return None
+        size_before = original.attrs.get('Size', 0)
+        keep_env = MAP_REPO_TO_CONFIG[task['repo']][task['version']]['conda_env'].strip()
+
+        container = du.build_container(image_name=image_name, container_name=f'{img_repo}__slim', client=client,
+                                       logger=logger)
+        container.start()
+
+        removed = unused_envs(container, keep_env)
+        for env in removed:
+            container.exec_run(f'conda env remove -y -n {env}')
+        for cmd in CLEAN_CMDS:
+            container.exec_run(['bash', '-c', cmd])
+        # object files of C extensions, the built libraries are kept
+        container.exec_run(['bash', '-c', f"find {work_dir} -type d -path '*/build/temp.*' -prune -exec rm -rf {{}} +"])
+        container.stop(timeout=5)
+
+        if keep_original:
+            original.tag(img_repo, 'unslimmed')
+        # export + import writes the container filesystem as a single layer
+        client.api.import_image_from_data(client.api.export(container.id), repository=img_repo, tag=img_tag,
+                                          changes=config_changes(original.attrs.get('Config') or {}))
+        slimmed = client.images.get(image_name)
+        if images is not None:
+            images.add(slimmed, image_name)
+        if not keep_original:
+            try:
+                client.images.remove(original.id)
+            except docker.errors.APIError as e:
+                logger.info(f'original image {original.id} not removed: {e}')
+
+        record = {'instance_id': instance_id, 'image': image_name, 'removed_envs': removed,
+                  'size_before': size_before, 'size_after': slimmed.attrs.get('Size', 0),
+                  'duration': time.time() - start}
+        logger.info(f'slimmed {image_name}: {size_before / 2 ** 30:.2f} GB -> '
+                    f'{record["size_after"] / 2 ** 30:.2f} GB, removed envs {removed}')
+        if report is not None:
+            with _report_lock:
+                with open(report, 'a') as f:
+                    f.write(json.dumps(record) + '\n')
+        return record
+    except Exception as e:
+        logger.error(f'slimming failed: {e}')
+    finally:
+        du.cleanup_container(client, container, logger)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Slim and squash ncbench instance images')
+    parser.add_argument("--bench_tasks", type=str, help="Path to benchmark task instances file", required=True,
+                        choices=['NoCode-bench/NoCode-bench_Verified', 'NoCode-bench/NoCode-bench_Full'],
+                        default='NoCode-bench/NoCode-bench_Verified')
+    parser.add_argument('--log_dir', required=True,
+                        help='Directory for logs and the size report')
+    parser.add_argument('--max_workers', type=int, default=1,
+                        help='Thread pool size')
+    parser.add_argument('--keep_original', action='store_true',
+                        help='Keep the original image as ncbench_{instance_id}:unslimmed')
+    args = parser.parse_args()
+
+    os.makedirs(args.log_dir, exist_ok=True)
+    logger = get_logger('slim_images', os.path.join(args.log_dir, 'slim_images.log'))
+    logger.info(args)
+
+    tasks = load_dataset(args.bench_tasks, split='test')
+    client = docker.from_env()
+    images = ImageIndex(client)
+    report = os.path.join(args.log_dir, 'slim_report.jsonl')
+
+    records = []
+    with ThreadPoolExecutor(args.max_workers) as pool:
+        futures = [pool.submit(slim_image, t, client, args.log_dir, images, args.keep_original, report)
+                   for t in tasks]
+        for future in tqdm(as_completed(futures), total=len(futures), desc='slimming'):
+            record = future.result()
+            if record:
+                records.append(record)
+
+    before = sum(r['size_before'] for r in records)
+    after = sum(r['size_after'] for r in records)
+    logger.info(f'slimmed {len(records)} images: {before / 2 ** 30:.1f} GB -> {after / 2 ** 30:.1f} GB')
+    print(f'slimmed {len(records)} images: {before / 2 ** 30:.1f} GB -> {after / 2 ** 30:.1f} GB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from datasets import load_dataset
+from tqdm import tqdm
+
+from utils.patch_precheck import has_commit
+from utils.test_map import TestMap, static_test_files
+from utils.utils import load_jsonl
+
+
+def build_instance_map(task, repos_dir, test_map):
+    '''
+    Store the static import closure of every P2P test of `task`, computed on the base
+    commit of the local clone with the test patch applied. Returns the number of mapped tests.
+    eval.py only uses these rows for the repos given to --p2p_memo_static_repos.
+    '''
+    repo_dir = os.path.join(repos_dir, task['repo'].split('/')[-1])
+    if not os.path.isdir(repo_dir) or not has_commit(repo_dir, task['base_commit']):
+        return 0
+    with tempfile.TemporaryDirectory(prefix='ncbench_test_map_') as tmp_dir:
+        subprocess.run(f"git -C {repo_dir} archive --format=tar {task['base_commit']} | tar -x -C {tmp_dir}",
+                       shell=True, check=True)
+        test_patch_path = os.path.join(tmp_dir, '.ncbench_test_patch.diff')
+        with open(test_patch_path, 'w', encoding='utf-8') as f:
+            f.write(task['test_patch'])
+        subprocess.run(['git', 'apply', test_patch_path], cwd=tmp_dir, env={**os.environ, 'GIT_CEILING_DIRECTORIES': tmp_dir},
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        os.remove(test_patch_path)
+        test_files = static_test_files(tmp_dir, task['repo'], task['PASS2PASS'])
+    test_map.put(task['instance_id'], test_files, 'static')
+    return len(test_files)
+
+
+def main(args):
+    if 'jsonl' in args.bench_tasks:
+        tasks = load_jsonl(args.bench_tasks)
+    else:
+        tasks = load_dataset(args.bench_tasks, split='test')
+    test_map = TestMap(args.output)
+    mapped = total = 0
+    with ThreadPoolExecutor(max_workers=args.max_workers) as executor:
+        futures = {executor.submit(build_instance_map, task, args.repos, test_map): task for task in tasks}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            task = futures[future]
+            try:
+                mapped += future.result()
+            except Exception as e:
+                print(f"Failed to map {task['instance_id']}: {e}")
+            total += len(task['PASS2PASS'])
+    print(f"Mapped {mapped} / {total} P2P tests of {len(tasks)} instances to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the static P2P test -> file map used by eval.py --p2p_memo_map')
+    parser.add_argument("--bench_tasks", type=str, help="Path to benchmark task instances file", required=True)
+    parser.add_argument("--repos", type=str, default='repos', help="Directory with the clones of repos/collect.sh")
+    parser.add_argument("--output", type=str, help="SQLite file of the map", required=True)
+    parser.add_argument("--max_workers", type=int, default=4, help="(Optional) Instances mapped in parallel")
+    main(parser.parse_args())
@@ -1,28 +1,240 @@
 import argparse
 import docker
+import hashlib
 import json
 import os
 from concurrent.futures import ThreadPoolExecutor
 from concurrent.futures import as_completed
+from collections import Counter, defaultdict
 from datasets import load_dataset
 from docker.errors import DockerException
-from pathlib import Path, PurePosixPath
-from threading import Lock
+from pathlib import PurePosixPath
+from threading import Event, Lock, Thread
 from tqdm import tqdm
 from unidiff import PatchSet
+import io
+import re
 import shlex
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from contextlib import nullcontext
 
 import utils.docker_utils as du
+from utils.apply_cache import ApplyCache
+from utils.container_pool import ContainerPool
+from utils.image_index import ImageIndex
+from utils.patch_precheck import precheck_patch
+from utils.resource_governor import ResourceGovernor
+from utils.result_store import ResultStore, ReportCache, report_key
+from utils.test_map import TestMap, memo_test_files, provably_unaffected
+from utils.work_queue import WorkQueue, serve_queue, parse_address
+from utils.scheduler import (load_timing_history, update_timing_table, estimate_costs, simulate_makespan,
+                             run_scheduled)
 from construction.filter_execution.constants import *
 from construction.filter_execution.testlog_extractor import *
 from utils.logger import get_logger
-from utils.utils import load_jsonl, dump_jsonl
+from utils.utils import load_jsonl, dump_jsonl, iter_jsonl_from
+
+# the test patch is uploaded together with the feature patch (DOCKER_PATCH) in one archive
+DOCKER_TEST_PATCH = "/tmp/test_patch.diff"
 
 GIT_APPLY_CMDS = [
     "git apply --verbose",
     "git apply --verbose --reject",
     "patch --batch --fuzz=5 -p1 -i",
 ]
+# printed by the apply script with the index of the command that succeeded
+APPLY_MARKER = "NCBENCH_APPLIED"
+# JUnit XML reports of the test invocations (structured_results), fetched with one get_archive
+DOCKER_JUNIT_DIR = "/tmp/ncbench_junit"
+
+# files whose change requires rebuilding an editable install (metadata, entry points, C/Cython extensions)
+BUILD_FILE_PATTERNS = [
+    r'(^|/)setup\.py$',
+    r'(^|/)setup\.cfg$',
+    r'(^|/)pyproject\.toml$',
+    r'(^|/)MANIFEST\.in$',
+    r'(^|/)meson\.build$',
+    r'(^|/)requirements[^/]*\.txt$',
+    r'\.(pyx|pxd|pxi|c|cc|cpp|h|hpp|f|f90)$',
+]
+
+
+def needs_reinstall(feature_patch, config):
+    '''
+    Decide whether the install command has to be rerun after applying the feature patch.
+    Returns (needed, reason). Only editable installs of pure-Python edits are skipped.
+    '''
+    if '-e' not in config['install'].split():
+        return True, 'non-editable install'
+    try:
+        patch_set = PatchSet(feature_patch)
+    except Exception:
+        return True, 'unparsable feature patch'
+    for patched_file in patch_set:
+        paths = {patched_file.source_file, patched_file.target_file, patched_file.path}
+        for path in paths:
+            path = re.sub(r'^[ab]/', '', path or '')
+            if any(re.search(pattern, path) for pattern in BUILD_FILE_PATTERNS):
+                return True, f'build file changed: {path}'
+    return False, 'pure-Python edit of an editable install'
+
+
+_base_image_locks = defaultdict(Lock)
+_base_image_locks_guard = Lock()
+
+
+def base_commit_image_name(image_name, version, commit_id):
+    return f'{image_name}_base:{version}_{commit_id[:12]}'
+
+
+def build_base_commit_image(client, image_name, repo, version, commit_id, work_dir, proxy, logger,
+                            container_limits=None, images=None):
+    '''
+    Return the cached "post-install base commit" image of (repo, version, base_commit).
+    On first use it is built from `{image_name}:dev` (checkout, pre_install, install) and
+    committed, so every later prediction on the same base commit skips these steps.
+    Returns None if the image could not be built. Existence is looked up in the `images`
+    index when given.
+    '''
+    base_image = base_commit_image_name(image_name, version, commit_id)
+    with _base_image_locks_guard:
+        key_lock = _base_image_locks[base_image]
+
+    with key_lock:
+        if images is not None and base_image in images:
+            return base_image
+        if images is None:
+            try:
+                client.images.get(base_image)
+                return base_image
+            except docker.errors.ImageNotFound:
+                pass
+
+        logger.info(f"Building base commit image {base_image}")
+        container_name = f'{image_name}__base_{version}_{commit_id[:12]}'
+        container = None
+        try:
+            try:
+                client.containers.get(container_name).remove(force=True)
+            except docker.errors.NotFound:
+                pass
+            container = du.build_container(image_name=f'{image_name}:dev', container_name=container_name, client=client,
+                                           logger=logger, proxy=proxy, **(container_limits or {}))
+            container.start()
+            container.exec_run('git clean -fdx', workdir=work_dir)
+            container.exec_run('git reset --hard HEAD', workdir=work_dir)
+            cmd_res = container.exec_run(f"git checkout {commit_id}", workdir=work_dir)
+            if cmd_res.exit_code != 0:
+                logger.info(f"Failed to checkout {commit_id} for base commit image")
+                return None
+            config = MAP_REPO_TO_CONFIG[repo][version]
+            for pre_install_cmd in config.get('pre_install', []):
+                container.exec_run(cmd=pre_install_cmd, workdir=work_dir)
+            cmd_res = container.exec_run(f"conda run -n {config['conda_env']} {config['install']}", workdir=work_dir)
+            if cmd_res.exit_code != 0:
+                # do not cache a broken install, the instance falls back to the uncached flow
+                logger.info(f"Install failed, not caching base commit image {base_image}")
+                return None
+            repository, tag = base_image.split(':')
+            image = container.commit(repository=repository, tag=tag)
+            if images is not None:
+                images.add(image, base_image)
+            logger.info(f"Committed base commit image {base_image}")
+            return base_image
+        except Exception as e:
+            logger.error(f"Failed to build base commit image {base_image}: {e}")
+            return None
+        finally:
+            du.cleanup_container(client, container, logger)
+
+
+def apply_chain(cached=None):
+    '''
+    Indices of GIT_APPLY_CMDS to try for a patch with the `ApplyCache` entry `cached`.
+    Only the plain `git apply` is atomic: after a cached success of a later command, the
+    commands from `--reject` on are replayed since they build on each other's leftovers.
+    '''
+    if cached is None or not cached.get('applied'):
+        return list(range(len(GIT_APPLY_CMDS)))
+    return list(range(min(cached['strategy'], 1), len(GIT_APPLY_CMDS)))
+
+
+def apply_script(chain, patch_path):
+    '''
+    Shell script running the apply commands of `chain` until one succeeds (one exec instead of one per command).
+    '''
+    lines = [f'{GIT_APPLY_CMDS[i]} {patch_path} && {{ echo "{APPLY_MARKER} {i}"; exit 0; }}' for i in chain]
+    return "\n".join(lines + ['exit 1'])
+
+
+def supports_junit(config):
+    '''
+    Whether the test command of a config is pytest (directly or through tox), which can write JUnit XML.
+    Django's runner and sympy's bin/test are parsed from stdout.
+    '''
+    test_cmd = config['test_cmd'].strip()
+    return test_cmd.startswith('pytest') or test_cmd.startswith('tox')
+
+
+def exec_tests(container, cmd, work_dir, timeout, max_output_bytes=None):
+    '''
+    du.exec_run_with_timeout keeping only the last `max_output_bytes` of the output. Result
+    lines (is_result_line) of the dropped part are collected as the output streams in and put
+    in front of the retained tail, so the extractors still see every result.
+    '''
+    if not max_output_bytes:
+        return du.exec_run_with_timeout(container=container, cmd=cmd, workdir=work_dir, timeout=timeout)
+    result_lines = []
+
+    def keep(line):
+        line = line.rstrip('\r')
+        if is_result_line(line):
+            result_lines.append(line)
+
+    output, timed_out, duration = du.exec_run_with_timeout(container=container, cmd=cmd, workdir=work_dir,
+                                                           timeout=timeout, max_output_bytes=max_output_bytes,
+                                                           line_callback=keep)
+    if output.startswith(du.TRUNCATED_MARKER):
+        output = '\n'.join(result_lines) + '\n' + output
+    return output, timed_out, duration
+
+
+def test_groups(test_ids, conda_env):
+    '''
+    Test ids grouped by file (pytest `path::name`) or module label (django `name (module.Class)`).
+    '''
+    groups = defaultdict(list)
+    for test_id in test_ids:
+        if 'django' in conda_env:
+            match = re.match(r".*?\s+\((.*?)\)", test_id)
+            key = match.group(1).rsplit('.', 1)[0] if match else test_id
+        else:
+            key = test_id.split('::')[0] if '::' in test_id else ''
+        groups[key].append(test_id)
+    return list(groups.values())
+
+
+def group_test_ids(test_ids, conda_env, batch_size):
+    '''
+    Split test ids into batches of at most `batch_size` ids, keeping the ids of a `test_groups` group together.
+    '''
+    batches = []
+    current = []
+    for ids in test_groups(test_ids, conda_env):
+        if current and len(current) + len(ids) > batch_size:
+            batches.append(current)
+            current = []
+        for i in range(0, len(ids), batch_size):
+            chunk = ids[i:i + batch_size]
+            if len(chunk) == batch_size:
+                batches.append(chunk)
+            else:
+                current.extend(chunk)
+    if current:
+        batches.append(current)
+    return batches
 
 
 def run_instance(
@@ -39,63 +251,126 @@ def run_instance(
         client,
         log_dir,
         proxy,
-        image_level
+        image_level,
+        timeout=1200,
+        pool=None,
+        base_cache=False,
+        skip_reinstall=False,
+        test_batch_size=1,
+        governor=None,
+        container_limits=None,
+        apply_cache=None,
+        p2p_skipped=None,
+        structured_results=False,
+        max_output_bytes=None,
+        images=None
 ):
     '''
     Run a single instance with the given prediction.
+    If a `ContainerPool` is given, the container is taken from and returned to the pool
+    instead of being created and removed for this instance.
+    With `base_cache` in repo-level mode, the container starts from the cached
+    post-install image of base_commit instead of checking out and installing it.
+    With `skip_reinstall`, the install after the feature patch is skipped when the base
+    commit is already installed and the patch touches no build-relevant files.
+    With `test_batch_size` > 1, test ids are grouped by file (django: by module label)
+    into invocations of at most that many ids instead of one invocation per id.
+    Every test invocation is limited to `timeout` seconds; its duration and timeout
+    status are reported in `f2p_timing` / `p2p_timing`, stage durations in `timing`.
+    A `ResourceGovernor` shared by all instances bounds the installs and test commands
+    running at once; `container_limits` (`cpus`, `mem_limit`) are applied to the container.
+    The feature patch is applied by a single script running the GIT_APPLY_CMDS fallback chain;
+    an `ApplyCache` remembers the outcome per (base_commit, patch) so that reruns skip the
+    commands known to fail and do not retry patches that no command could apply.
+    P2P tests in `p2p_skipped` (proven unaffected by the patch) are not run and are
+    reported in `p2p_skipped`.
+    With `structured_results`, pytest invocations also write JUnit XML reports that are
+    fetched in one archive after the tests and parsed into `f2p_structured` / `p2p_structured`
+    (one list of (status, test id) per output, None where stdout has to be scraped).
+    With `max_output_bytes`, only that much of the end of each test output is kept in memory,
+    plus the result lines of the part before it.
+    An `ImageIndex` shared by all instances answers image existence checks without a daemon call.
     '''
     container = None
-    patch_dir = os.path.join(log_dir, "patches")
-    test_patch_dir = os.path.join(log_dir, "test_patches")
+    failed = False
+    base_image = None
     logfile_dir = os.path.join(log_dir, "exec_logs")
 
-    os.makedirs(patch_dir, exist_ok=True)
-    os.makedirs(test_patch_dir, exist_ok=True)
     os.makedirs(logfile_dir, exist_ok=True)
 
-    patch_path = os.path.join(patch_dir, f'patch_{instance_id}.diff')
-    test_patch_path = os.path.join(test_patch_dir, f'test_patch_{instance_id}.diff')
     logger = get_logger(
         log_name=instance_id,
         log_file=os.path.join(logfile_dir, f'{instance_id}.log')
     )
+    logger.info("begin to run instance")
 
     test_results = {
         'instance_id': instance_id,
         'f2p': [],
         'p2p': [],
-        'feature_patch_applied': False
+        'feature_patch_applied': False,
+        'timing': {}
     }
+    # wall-clock seconds per stage, accumulated into test_results['timing']
+    run_start = stage_start = time.time()
+
+    def cpu_slot():
+        return governor.slot() if governor is not None else nullcontext()
+
+    def put_patches():
+        # both patches in one in-memory archive; /tmp exists in every image
+        du.put_files_to_container(container, {
+            PurePosixPath(DOCKER_TEST_PATCH).name: test_patch,
+            PurePosixPath(DOCKER_PATCH).name: feature_patch,
+        }, PurePosixPath(DOCKER_PATCH).parent)
+
+    def end_stage(stage):
+        nonlocal stage_start
+        now = time.time()
+        test_results['timing'][stage] = test_results['timing'].get(stage, 0.0) + now - stage_start
+        stage_start = now
+
     try:
-        if image_level == 'repo':
-            container_name = f'{image_name}__{instance_id}'
-            try:
-                existing_container = client.containers.get(container_name)
-                logger.info(f"Found container with the same name {container_name} running, forcibly stopping and removing it")
-                existing_container.stop(timeout=0)  # Force immediate stop
-                existing_container.remove(force=True)
-                logger.info(f"Successfully removed container with the same name {container_name}")
-            except docker.errors.NotFound:
-                # Container doesn't exist, continue normal flow
-                pass
-            except Exception as e:
-                logger.error(f"Error cleaning up container with the same name: {str(e)}")
-            
-            # build container
-            container = du.build_container(image_name=f'{image_name}:dev', container_name=container_name, client=client,
-                                           logger=logger, proxy=proxy)
-            container.start()
+        if image_level == 'repo' and base_cache:
+            base_image = build_base_commit_image(client, image_name, repo, version, commit_id, work_dir, proxy, logger,
+                                                 container_limits, images)
+            end_stage('base_image')
+        elif image_level != 'repo':
+            base_image = f'ncbench_{instance_id}:latest'
+
+        if base_image is None:
+            if pool is not None:
+                container = pool.acquire(f'{image_name}:dev', work_dir, logger, snapshot=False)
+            else:
+                container_name = f'{image_name}__{instance_id}'
+                try:
+                    existing_container = client.containers.get(container_name)
+                    logger.info(f"Found container with the same name {container_name} running, forcibly stopping and removing it")
+                    existing_container.stop(timeout=0)  # Force immediate stop
+                    existing_container.remove(force=True)
+                    logger.info(f"Successfully removed container with the same name {container_name}")
+                except docker.errors.NotFound:
+                    # Container doesn't exist, continue normal flow
+                    pass
+                except Exception as e:
+                    logger.error(f"Error cleaning up container with the same name: {str(e)}")
+
+                # build container
+                container = du.build_container(image_name=f'{image_name}:dev', container_name=container_name, client=client,
+                                               logger=logger, proxy=proxy, **(container_limits or {}))
+                container.start()
+            end_stage('container_start')
             # reset branch
             container.exec_run('git clean -fdx', workdir=work_dir)
             container.exec_run('git reset --hard HEAD', workdir=work_dir)
             # checkout base_commit
             git_checkout_cmd = f"git checkout {commit_id}"
             container.exec_run(git_checkout_cmd, workdir=work_dir)
+            end_stage('checkout')
             # apply test patch
-            test_patch_file = Path(test_patch_path)
-            test_patch_file.write_text(test_patch)
-            du.copy_to_container(container, test_patch_file, PurePosixPath(DOCKER_PATCH))
-            cmd_res = container.exec_run(f"git apply {DOCKER_PATCH}", workdir=work_dir)
+            put_patches()
+            cmd_res = container.exec_run(f"git apply {DOCKER_TEST_PATCH}", workdir=work_dir)
+            end_stage('patch_apply')
             if cmd_res.exit_code != 0:
                 logger.info(f"Failed to apply test patch to container")
                 return test_results
@@ -107,33 +382,37 @@ def run_instance(
             if 'pre_install' in config:
                 for pre_install_cmd in config['pre_install']:
                     cmd_res = container.exec_run(cmd=pre_install_cmd, workdir=work_dir)
+            end_stage('pre_install')
 
 
         else:
-            # Check if container with the same name exists and clean it up
-            container_name = f'{image_name}__{instance_id}'
-            try:
-                existing_container = client.containers.get(container_name)
-                logger.info(f"Found container with the same name {container_name} running, forcibly stopping and removing it")
-                existing_container.stop(timeout=0)  # Force immediate stop
-                existing_container.remove(force=True)
-                logger.info(f"Successfully removed container with the same name {container_name}")
-            except docker.errors.NotFound:
-                # Container doesn't exist, continue normal flow
-                pass
-            except Exception as e:
-                logger.error(f"Error cleaning up container with the same name: {str(e)}")
-                
-            # build container
-            container = du.build_container(image_name=f'ncbench_{instance_id}:latest', container_name=container_name, client=client,
-                                           logger=logger, proxy=proxy)
-            container.start()
+            if pool is not None:
+                container = pool.acquire(base_image, work_dir, logger, snapshot=True)
+            else:
+                # Check if container with the same name exists and clean it up
+                container_name = f'{image_name}__{instance_id}'
+                try:
+                    existing_container = client.containers.get(container_name)
+                    logger.info(f"Found container with the same name {container_name} running, forcibly stopping and removing it")
+                    existing_container.stop(timeout=0)  # Force immediate stop
+                    existing_container.remove(force=True)
+                    logger.info(f"Successfully removed container with the same name {container_name}")
+                except docker.errors.NotFound:
+                    # Container doesn't exist, continue normal flow
+                    pass
+                except Exception as e:
+                    logger.error(f"Error cleaning up container with the same name: {str(e)}")
+
+                # build container
+                container = du.build_container(image_name=base_image, container_name=container_name, client=client,
+                                               logger=logger, proxy=proxy, **(container_limits or {}))
+                container.start()
+            end_stage('container_start')
 
             # apply test patch
-            test_patch_file = Path(test_patch_path)
-            test_patch_file.write_text(test_patch)
-            du.copy_to_container(container, test_patch_file, PurePosixPath(DOCKER_PATCH))
-            cmd_res = container.exec_run(f"git apply {DOCKER_PATCH}", workdir=work_dir)
+            put_patches()
+            cmd_res = container.exec_run(f"git apply {DOCKER_TEST_PATCH}", workdir=work_dir)
+            end_stage('patch_apply')
             if cmd_res.exit_code != 0:
                 logger.info(f"Failed to apply test patch to container")
                 return test_results
@@ -143,31 +422,60 @@ def run_instance(
             # get the config of the instance
             config = MAP_REPO_TO_CONFIG[repo][version]
 
-        # apply feature patch
-        feature_patch_file = Path(patch_path)
-        feature_patch_file.write_text(feature_patch)
-        du.copy_to_container(container, feature_patch_file, PurePosixPath(DOCKER_PATCH))
+        # apply feature patch (uploaded with the test patch)
         applied_patch = False
-        for git_apply_cmd in GIT_APPLY_CMDS:
-            cmd_res = container.exec_run(f"{git_apply_cmd} {DOCKER_PATCH}", workdir=work_dir)
-            if cmd_res.exit_code == 0:
-                logger.info(f"Successfully applied feature patch to container")
+        cached = apply_cache.get(commit_id, feature_patch) if apply_cache is not None else None
+        strategy = None
+        if cached is not None and not cached['applied']:
+            logger.info(f"Skipping feature patch apply, no command applied it before (apply cache)")
+        else:
+            chain = apply_chain(cached)
+            cmd_res = container.exec_run(['bash', '-c', apply_script(chain, DOCKER_PATCH)], workdir=work_dir)
+            match = re.search(rf'^{APPLY_MARKER} (\d+)$', cmd_res.output.decode(errors='ignore'), re.MULTILINE)
+            if cmd_res.exit_code == 0 and match:
+                strategy = int(match.group(1))
+                logger.info(f"Successfully applied feature patch to container: {GIT_APPLY_CMDS[strategy]}")
                 applied_patch = True
                 test_results['feature_patch_applied'] = True
-                break
             else:
-                logger.info(f"Failed to apply feature patch to container: {git_apply_cmd}")
+                logger.info(f"Failed to apply feature patch to container: {[GIT_APPLY_CMDS[i] for i in chain]}")
+            if apply_cache is not None:
+                apply_cache.put(commit_id, feature_patch, applied_patch, strategy)
+        test_results['patch_apply'] = {
+            'strategy': GIT_APPLY_CMDS[strategy] if strategy is not None else None,
+            'cached': cached is not None,
+        }
+        end_stage('patch_apply')
 
         if not applied_patch:
             logger.info(f"Failed to apply feature patch to container")
             return test_results
 
         # conda activate and install
-        cmd_res = container.exec_run(f"conda run -n {config['conda_env']} {config['install']}",
-                                     workdir=work_dir)
+        # images with the base commit already installed only need a rebuild for build-relevant changes
+        if skip_reinstall and base_image is not None:
+            reinstall, reason = needs_reinstall(feature_patch, config)
+        else:
+            reinstall, reason = True, 'base commit not installed' if base_image is None else 'skip_reinstall disabled'
+        if reinstall:
+            with cpu_slot():
+                cmd_res = container.exec_run(f"conda run -n {config['conda_env']} {config['install']}",
+                                             workdir=work_dir)
+        end_stage('install')
+        test_results['install'] = {
+            'skipped': not reinstall,
+            'reason': reason,
+            'duration': test_results['timing']['install'],
+        }
+        logger.info(f"Install {'skipped' if not reinstall else 'done'} ({reason})")
         # run f2p and p2p
+        junit = structured_results and supports_junit(config)
+        if junit:
+            container.exec_run(f"bash -c 'rm -rf {DOCKER_JUNIT_DIR} && mkdir -p {DOCKER_JUNIT_DIR}'")
+
         def run_tests_in_parallel(container, test_files, config, work_dir, timeout, logger, test_type):
             results = [None] * len(test_files)
+            timings = [None] * len(test_files)
 
             def format_django_test_name(test_str):
                 match = re.match(r"(.*?)\s+\((.*?)\)", test_str)
@@ -176,78 +484,138 @@ def run_instance(
                     return f"{class_path}.{method_name}"
                 return test_str
 
-            def run_test(index, test_file):
-                # logger.info(f'begin to run {test_type}: {test_file}')
+            def run_tests(index, tests, outputs, timings):
+                # logger.info(f'begin to run {test_type}: {tests}')
+                test_ids = tests
                 if "django" in config['conda_env']:
-                    test_file = format_django_test_name(test_file)
-                    test_file_escaped = f'"{test_file}"'
+                    tests = [format_django_test_name(test_file) for test_file in tests]
+                    test_file_escaped = ' '.join(f'"{test_file}"' for test_file in tests)
                 else:
-                    test_file_escaped = shlex.quote(test_file)
+                    test_file_escaped = ' '.join(shlex.quote(test_file) for test_file in tests)
 
                 if "sphinx" in config['conda_env']:
                     clean_cmd = "rm -rf /root/sphinx/.tox/py*"
                     clean_res = du.exec_run_with_timeout(container=container, cmd=clean_cmd, workdir=work_dir,
                                                          timeout=timeout)
                     logger.info(f"Sphinx cleanup completed for test {index}: {clean_res}")
-                    test_file_escaped = f'"{test_file}"'
+                    test_file_escaped = ' '.join(f'"{test_file}"' for test_file in tests)
 
-                test_cmd = f"conda run -n {config['conda_env'].strip()} {config['test_cmd'].strip()} {test_file_escaped}"
+                junit_name = f"{test_type}_{uuid.uuid4().hex}.xml" if junit else None
+                junit_arg = f" --junitxml={DOCKER_JUNIT_DIR}/{junit_name}" if junit else ""
+                test_cmd = f"conda run -n {config['conda_env'].strip()} {config['test_cmd'].strip()}{junit_arg} {test_file_escaped}"
 
-                cmd_res = du.exec_run_with_timeout(
-                    container=container,
-                    cmd=test_cmd,
-                    workdir=work_dir,
-                    timeout=timeout
-                )
+                with cpu_slot():
+                    cmd_res = exec_tests(container, test_cmd, work_dir, timeout, max_output_bytes)
+
+                duration, timed_out = cmd_res[2], cmd_res[1]
 
                 if "sphinx" in config['conda_env'] and 'PASSED' not in cmd_res[0].upper():
-                    test_cmd = f"conda run -n {config['conda_env'].strip()} pytest -rA --color=no -W ignore '{test_file}'"
-                    cmd_res = du.exec_run_with_timeout(
-                        container=container,
-                        cmd=test_cmd,
-                        workdir=work_dir,
-                        timeout=timeout
-                    )
-
-                results[index] = cmd_res[0]
+                    quoted = ' '.join(f"'{test_file}'" for test_file in tests)
+                    test_cmd = f"conda run -n {config['conda_env'].strip()} pytest -rA --color=no -W ignore{junit_arg} {quoted}"
+                    with cpu_slot():
+                        cmd_res = exec_tests(container, test_cmd, work_dir, timeout, max_output_bytes)
+                    duration, timed_out = duration + cmd_res[2], timed_out or cmd_res[1]
+
+                outputs[index] = cmd_res[0]
+                timings[index] = {'tests': test_ids, 'duration': duration, 'timed_out': timed_out}
+                if junit_name:
+                    timings[index]['junit'] = junit_name
                 logger.info(f"test cmd: {test_cmd}")
                 logger.info(f"test log: {cmd_res}")
 
-            is_sphinx = "sphinx" in config['conda_env']
-
-            if is_sphinx:
-                logger.info("Sphinx environment detected, running tests sequentially to avoid tox conflicts")
-                for i, test_file in enumerate(test_files):
-                    run_test(i, test_file)
-            else:
-                min_worker = min(25, len(test_files)) if len(test_files) > 0 else 1
-                logger.info(f"Running tests in parallel with {min_worker} workers")
-                with ThreadPoolExecutor(max_workers=min_worker) as executor:
-                    futures = [executor.submit(run_test, i, test_file) for i, test_file in enumerate(test_files)]
-                    for future in as_completed(futures):
-                        future.result()
-
-            return results
+            def run_all(jobs, outputs, timings):
+                if "sphinx" in config['conda_env']:
+                    logger.info("Sphinx environment detected, running tests sequentially to avoid tox conflicts")
+                    for i, tests in enumerate(jobs):
+                        run_tests(i, tests, outputs, timings)
+                else:
+                    min_worker = min(25, len(jobs)) if len(jobs) > 0 else 1
+                    logger.info(f"Running tests in parallel with {min_worker} workers")
+                    with ThreadPoolExecutor(max_workers=min_worker) as executor:
+                        futures = [executor.submit(run_tests, i, tests, outputs, timings) for i, tests in enumerate(jobs)]
+                        for future in as_completed(futures):
+                            future.result()
+
+            if test_batch_size <= 1 or len(test_files) <= 1:
+                run_all([[test_file] for test_file in test_files], results, timings)
+                return results, timings
+
+            # one invocation per group of test ids, then per-test runs only for ids missing from the batch output
+            batches = group_test_ids(test_files, config['conda_env'], test_batch_size)
+            batch_results = [None] * len(batches)
+            batch_timings = [None] * len(batches)
+            logger.info(f"Running {len(test_files)} {test_type} tests in {len(batches)} batches")
+            run_all(batches, batch_results, batch_timings)
+
+            found = {name for output in batch_results for _, name in extract_test_info(output or '', instance_id)}
+            missing = [test_file for test_file in test_files if test_file not in found]
+            logger.info(f"{len(missing)} {test_type} tests missing from batch output, rerunning them one by one")
+            missing_results = [None] * len(missing)
+            missing_timings = [None] * len(missing)
+            run_all([[test_file] for test_file in missing], missing_results, missing_timings)
+
+            return batch_results + missing_results, batch_timings + missing_timings
 
         # Run f2p tests in parallel
         logger.info(f'begin to run f2p tests')
-        f2p_results = run_tests_in_parallel(container, f2p, config, work_dir, 1200, logger, 'f2p')
+        f2p_results, f2p_timings = run_tests_in_parallel(container, f2p, config, work_dir, timeout, logger, 'f2p')
+        end_stage('f2p_tests')
 
         # Run p2p tests in parallel
         logger.info(f'begin to run p2p tests')
-        p2p_results = run_tests_in_parallel(container, p2p, config, work_dir, 1200, logger, 'p2p')
+        skipped = set(p2p_skipped or [])
+        p2p_run = [test for test in p2p if test not in skipped]
+        if skipped:
+            logger.info(f'skipping {len(p2p) - len(p2p_run)} p2p tests unaffected by the patch')
+        p2p_results, p2p_timings = run_tests_in_parallel(container, p2p_run, config, work_dir, timeout, logger, 'p2p')
+        end_stage('p2p_tests')
 
         # Update test results
         test_results.update({
             'f2p': f2p_results,
-            'p2p': p2p_results
+            'p2p': p2p_results,
+            'f2p_timing': f2p_timings,
+            'p2p_timing': p2p_timings
         })
+        if skipped:
+            test_results['p2p_skipped'] = sorted(skipped)
+        if junit:
+            reports = {PurePosixPath(name).name: content
+                       for name, content in du.fetch_files_from_container(container, DOCKER_JUNIT_DIR).items()}
+            for test_type, timings in [('f2p', f2p_timings), ('p2p', p2p_timings)]:
+                structured = []
+                for timing in timings:
+                    content = reports.get((timing or {}).get('junit'))
+                    try:
+                        structured.append(extract_junit_results(io.BytesIO(content), timing['tests'])
+                                          if content else None)
+                    except ET.ParseError:
+                        # truncated by a timeout: fall back to stdout
+                        structured.append(None)
+                test_results[f'{test_type}_structured'] = structured
+            logger.info(f"Fetched {len(reports)} JUnit reports")
 
     except Exception as e:
+        failed = True
         logger.error(f'error: {e}')
         raise
     finally:
-        du.cleanup_container(client, container, logger)
+        # processes of timed out tests that survived SIGKILL; containers with leaks are never pooled again
+        leaked = du.leaked_processes(container, reset=True) if container is not None else 0
+        if leaked:
+            test_results['leaked_processes'] = leaked
+            logger.warning(f"{leaked} processes of timed out tests are still running in {container.name}")
+        if pool is not None:
+            # a non-editable install leaves the feature patch in site-packages, never reuse it;
+            # neither a container with leaked processes, they would compete with the next instance
+            install_cmd = MAP_REPO_TO_CONFIG.get(repo, {}).get(version, {}).get('install', '')
+            recycle = (not failed and not leaked and
+                       (base_image is None or 'setup.py install' not in install_cmd))
+            pool.release(container, logger, recycle=recycle)
+        else:
+            du.cleanup_container(client, container, logger)
+        end_stage('cleanup')
+        test_results['timing']['total'] = time.time() - run_start
 
     return test_results
 
@@ -264,10 +632,22 @@ def extract_test_info(content, instance_id):
 
 
 def eval_instance(task, report):
-    all_tests = report['f2p'] + report['p2p']
     all_results = []
-    for r in all_tests:
-        all_results.extend(extract_test_info(r, report['instance_id']))
+    for test_type in ['f2p', 'p2p']:
+        # JUnit results where available, completed by the stdout of the same invocation for the ids
+        # the JUnit report could not resolve; XPASS lines of stdout are scored as on the stdout path
+        structured = report.get(f'{test_type}_structured') or []
+        for index, r in enumerate(report[test_type]):
+            stdout_results = extract_test_info(r, report['instance_id'])
+            if index < len(structured) and structured[index] is not None:
+                xpassed = extract_xpass_ids(r)
+                junit_ids = set()
+                for status, test_id in structured[index]:
+                    junit_ids.add(test_id)
+                    all_results.append(('XPASS' if status == 'PASSED' and test_id in xpassed else status, test_id))
+                all_results.extend(result for result in stdout_results if result[1] not in junit_ids)
+            else:
+                all_results.extend(stdout_results)
     try:
         tests_record = {i[1]: i[0] for i in all_results}
     except:
@@ -285,12 +665,17 @@ def eval_instance(task, report):
 
     p2p_success = []
     p2p_failure = []
+    # not run: passed in the gold run and unaffected by the patch
+    skipped_by_proof = set(report.get('p2p_skipped', []))
+    p2p_skipped = []
     for test_case in task['PASS2PASS']:
         if test_case in tests_record:
             if tests_record[test_case] == 'PASSED':
                 p2p_success.append(test_case)
             else:
                 p2p_failure.append(test_case)
+        elif test_case in skipped_by_proof:
+            p2p_skipped.append(test_case)
         else:
             p2p_failure.append(test_case)
 
@@ -304,18 +689,106 @@ def eval_instance(task, report):
             "failure": p2p_failure,
         },
     }
+    if skipped_by_proof:
+        results['p2p']['skipped'] = p2p_skipped
     if report['instance_id']=='sphinx__sphinx-doc__sphinx-7005':
         print(results)
 
     return results
 
 
+# run_instance arguments that change the report of the same patches on the same image
+REPORT_OPTIONS = ['timeout', 'test_batch_size', 'structured_results', 'max_output_bytes', 'base_cache',
+                  'skip_reinstall', 'p2p_skipped']
+
+
+def report_options(job):
+    '''
+    The REPORT_OPTIONS of an `instance_job`, part of the report cache key.
+    '''
+    options = {name: job.get(name) for name in REPORT_OPTIONS}
+    options['p2p_skipped'] = sorted(options['p2p_skipped'] or [])
+    return options
+
+
+def instance_job(pred, task, args, p2p_skipped=None):
+    '''
+    Serializable run_instance arguments of a prediction (everything except the docker
+    client, log dir, pool and governor, which belong to the process running it).
+    '''
+    repo_name = task['repo'].split('/')[-1]
+    return {
+        'instance_id': pred['instance_id'],
+        'image_name': f'fb_{repo_name}',
+        'commit_id': task['base_commit'],
+        'test_patch': task['test_patch'],
+        'feature_patch': task['feature_patch'] if args.gold else pred['model_patch'],
+        'version': task['version'],
+        'repo': task['repo'],
+        'p2p': task['PASS2PASS'],
+        'f2p': task['FAIL2PASS'],
+        'work_dir': f'/root/{repo_name}',
+        'proxy': args.proxy,
+        'image_level': args.image_level,
+        'timeout': args.timeout,
+        'base_cache': args.base_cache,
+        'skip_reinstall': args.skip_reinstall,
+        'test_batch_size': args.test_batch_size,
+        'container_limits': {'cpus': args.container_cpus, 'mem_limit': args.container_mem},
+        'p2p_skipped': p2p_skipped,
+        'structured_results': args.structured_results,
+        'max_output_bytes': args.max_output_kb * 1024 if args.max_output_kb else None,
+    }
+
+
+def open_result_store(args):
+    """
+    Result store of the run in `args.log_dir`, or None when reports are kept in `0reports.jsonl`.
+    Reports already appended to `0reports.jsonl` are imported on first use.
+    """
+    if not args.result_store:
+        return None
+    store = ResultStore(args.result_store, args.run_id or os.path.abspath(args.log_dir))
+    store.import_reports_jsonl(os.path.join(args.log_dir, '0reports.jsonl'))
+    return store
+
+
+def report_stream(reports_fpath, store=None, position=0):
+    """
+    Yield (report, position) for the reports after `position`: a row id of the store,
+    or a byte offset of `reports_fpath` when no store is used.
+    """
+    if store is not None:
+        yield from store.iter_reports(position)
+    elif os.path.exists(reports_fpath):
+        yield from iter_jsonl_from(reports_fpath, position)
+
+
+def reports_fingerprint(reports_fpath, offset, window=65536):
+    """
+    Identity of the first `offset` bytes of `reports_fpath`: its inode and a hash of the
+    (at most `window`) bytes before `offset`. A file recreated or rewritten since the offset
+    was saved does not match, even if it has grown past it.
+    """
+    if not os.path.exists(reports_fpath) or os.path.getsize(reports_fpath) < offset:
+        return None
+    with open(reports_fpath, 'rb') as f:
+        start = max(offset - window, 0)
+        f.seek(start)
+        digest = hashlib.sha256(f.read(offset - start)).hexdigest()
+    return {'inode': os.stat(reports_fpath).st_ino, 'sha256': digest}
+
+
 def run_instances(args):
     # two loggers: one total, one per test
     os.makedirs(args.log_dir, exist_ok=True)
     detail_path = os.path.join(args.log_dir, 'evaluation_details.jsonl')
+    store = open_result_store(args)
+    has_prev = store.has_details() if store is not None else os.path.exists(detail_path)
     prev_instance = []
-    if os.path.exists(detail_path):
+    if store is not None:
+        prev_instance = store.details()
+    elif has_prev:
         prev_instance = load_jsonl(detail_path)
     existing = {i['instance_id']: i for i in prev_instance}
     logger = get_logger(log_name='eval', log_file=os.path.join(args.log_dir, '0eval.log'))
@@ -327,12 +800,14 @@ def run_instances(args):
     tasks_record = {i['instance_id']: i for i in tasks}
     logger.info(f'Loaded {len(tasks)} tasks')
     predictions = load_jsonl(args.predictions_path)
-    client = docker.from_env()
+    # the coordinator does not run containers itself
+    client = docker.from_env() if not args.coordinator else None
     if args.gold:
         predictions = tasks
+    predictions_record = {p['instance_id']: p for p in predictions if p}
 
     # Filter instances to process
-    if args.unresolved_only and os.path.exists(detail_path):
+    if args.unresolved_only and has_prev:
         # In unresolved_only mode, only process unresolved tasks
         unresolved_ids = set()
         for instance in prev_instance:
@@ -342,7 +817,7 @@ def run_instances(args):
         # Only keep unresolved tasks
         predictions = [pred for pred in predictions if pred['instance_id'] in unresolved_ids]
         logger.info(f'Filtered to {len(predictions)} unresolved tasks')
-    elif os.path.exists(detail_path):
+    elif has_prev:
         # In all instances mode, also process instances with empty reports
         not_attempted_ids = set()
         for instance in prev_instance:
@@ -355,62 +830,410 @@ def run_instances(args):
                       pred['instance_id'] in not_attempted_ids]
         logger.info(f'Running {len(predictions)} tasks (new or previously not attempted)')
 
+    def already_reported(instance_id):
+        # For all instance mode, only skip if instance exists and doesn't have the note
+        return (instance_id in existing and
+                not args.unresolved_only and
+                existing[instance_id].get('notes') != "Instance not attempted or report was empty.")
+
     def process_instance(pred, tasks_record, write_lock=None):
         instance_id = pred['instance_id']
 
-        # For all instance mode, only skip if instance exists and doesn't have the note
-        if (instance_id in existing and
-            not args.unresolved_only and
-            existing[instance_id].get('notes') != "Instance not attempted or report was empty."):
+        if already_reported(instance_id):
             logger.info(f"Skipping existing instance_id: {instance_id}")
             return
 
-        task = tasks_record[instance_id]
-        repo_name = task['repo'].split('/')[-1]
-
-        feature_patch = task['feature_patch'] if args.gold else pred['model_patch']
-
         try:
             report = run_instance(
-                instance_id=pred['instance_id'],
-                image_name=f'fb_{repo_name}',
-                commit_id=task['base_commit'],
-                test_patch=task['test_patch'],
-                feature_patch=feature_patch,
-                version=task['version'],
-                repo=task['repo'],
-                p2p=task['PASS2PASS'],
-                f2p=task['FAIL2PASS'],
-                work_dir=f'/root/{repo_name}',
+                **instance_job(pred, tasks_record[instance_id], args, p2p_skips.get(instance_id)),
                 client=client,
                 log_dir=args.log_dir,
-                proxy=args.proxy,
-                image_level=args.image_level
+                pool=pool,
+                governor=governor,
+                apply_cache=apply_cache,
+                images=images
             )
         except (DockerException, Exception) as e:
             logger.error(f"Instance {instance_id} skipped due to docker error: {e}")
             return
+        write_report(report)
+
+    def write_report(report):
+        if (cache is not None and report['instance_id'] in cache_keys and
+                not any(t['timed_out'] for t in (report.get('f2p_timing') or []) + (report.get('p2p_timing') or []))):
+            # timed out runs may pass on another try, they are not reused
+            cache.put(cache_keys[report['instance_id']], report, args.log_dir)
+        if store is not None:
+            store.add_report(report)
+            return
         with write_lock:
             with open(reports_fpath, 'a', encoding='utf-8') as f:
                 f.write(json.dumps(report) + '\n')
 
+    # P2P tests that passed with the gold patch and cannot import any file changed by the model patch
+    p2p_skips = {}
+    if args.p2p_memo_map and args.p2p_memo_gold and not args.gold:
+        test_map = TestMap(args.p2p_memo_map)
+        gold_passed = {d['instance_id']: set(d.get('P2P', {}).get('success', []))
+                       for d in load_jsonl(os.path.join(args.p2p_memo_gold, 'evaluation_details.jsonl'))}
+        for pred in predictions:
+            instance_id = pred['instance_id']
+            if instance_id not in gold_passed or instance_id not in tasks_record:
+                continue
+            test_files = memo_test_files(test_map, instance_id, tasks_record[instance_id]['repo'],
+                                          args.p2p_memo_static_repos)
+            skipped = provably_unaffected(tasks_record[instance_id]['PASS2PASS'], gold_passed[instance_id],
+                                          test_files, pred.get('model_patch', ''))
+            if skipped:
+                p2p_skips[instance_id] = skipped
+        logger.info(f'Skipping {sum(len(v) for v in p2p_skips.values())} P2P tests unaffected by the patch '
+                    f'in {len(p2p_skips)} instances')
+
+    # identical evaluations (instance, base commit, patches, image, options) of earlier runs are not repeated
+    cache = ReportCache(args.report_cache) if args.report_cache else None
+    # inventory of the local images, one daemon call for the whole run
+    images = ImageIndex(client) if client is not None else None
+    if images is not None and args.image_level != 'repo':
+        missing = images.missing([f"ncbench_{p['instance_id']}:latest" for p in predictions])
+        if missing:
+            logger.warning(f'{len(missing)} instance images are missing, e.g. {missing[:3]}')
+    cache_keys = {}
+    cached_reports = []
+    if cache is not None:
+        digests = {}
+
+        def image_digest(image):
+            if image not in digests:
+                # the coordinator has no docker client, its workers are expected to share the images
+                digests[image] = images.image_id(image) if images is not None else image
+            return digests[image]
+
+        remaining = []
+        for pred in predictions:
+            instance_id = pred['instance_id']
+            if instance_id not in tasks_record:
+                remaining.append(pred)
+                continue
+            job = instance_job(pred, tasks_record[instance_id], args, p2p_skips.get(instance_id))
+            image = f"{job['image_name']}:dev" if args.image_level == 'repo' else f'ncbench_{instance_id}:latest'
+            digest = image_digest(image)
+            if digest is not None:
+                key = report_key(instance_id, job['commit_id'], job['test_patch'], job['feature_patch'], digest,
+                                 report_options(job))
+                cached = cache.get(key)
+                if cached is not None:
+                    cached_reports.append(cached)
+                    continue
+                cache_keys[instance_id] = key
+            remaining.append(pred)
+        predictions = remaining
+        logger.info(f'Reusing {len(cached_reports)} cached reports, {len(predictions)} predictions left')
+
+    # predictions that no apply command can apply on the host clone never get a container
+    rejected_reports = []
+    if args.precheck_repos and not args.gold:
+        def precheck(pred):
+            task = tasks_record[pred['instance_id']]
+            repo_dir = os.path.join(args.precheck_repos, task['repo'].split('/')[-1])
+            return precheck_patch(repo_dir, task['base_commit'], task['test_patch'], pred.get('model_patch', ''),
+                                  lambda patch_path: apply_script(apply_chain(), patch_path))
+
+        precheck_start = time.time()
+        candidates = [pred for pred in predictions if pred['instance_id'] in tasks_record]
+        with ThreadPoolExecutor(max_workers=max(args.max_workers, 1)) as executor:
+            outcomes = list(executor.map(precheck, candidates))
+        rejected_ids = set()
+        for pred, (applies, reason) in zip(candidates, outcomes):
+            if applies is False:
+                rejected_ids.add(pred['instance_id'])
+                rejected_reports.append({
+                    'instance_id': pred['instance_id'],
+                    'f2p': [],
+                    'p2p': [],
+                    'feature_patch_applied': False,
+                    'timing': {},
+                    'precheck': {'applies': False, 'reason': reason},
+                })
+                logger.info(f"Precheck rejected {pred['instance_id']}: {reason}")
+            elif applies is None:
+                logger.info(f"Precheck inconclusive for {pred['instance_id']}: {reason}")
+        predictions = [pred for pred in predictions if pred['instance_id'] not in rejected_ids]
+        logger.info(f'Precheck rejected {len(rejected_ids)} of {len(candidates)} predictions '
+                    f'in {time.time() - precheck_start:.0f}s')
+
+    # order by predicted cost and estimate the makespan from previous timings
+    def repo_key(pred):
+        return tasks_record.get(pred['instance_id'], {}).get('repo', '')
+
+    history_paths = [args.log_dir] + (args.timing_history or [])
+    if args.timing_table:
+        history_paths.append(args.timing_table)
+    history = load_timing_history(history_paths)
+    pred_tasks = [tasks_record[p['instance_id']] for p in predictions if p['instance_id'] in tasks_record]
+    costs = estimate_costs(pred_tasks, history)
+    if args.schedule == 'longest_first':
+        predictions = sorted(predictions, key=lambda p: -costs.get(p['instance_id'], 0.0))
+    estimated_makespan = simulate_makespan(predictions, args.max_workers, repo_key,
+                                           lambda p: costs.get(p['instance_id'], 0.0), args.max_per_repo)
+    logger.info(f'Scheduling {len(predictions)} predictions ({args.schedule}), '
+                f'{len(history)} historical timings, estimated makespan {estimated_makespan:.0f}s')
+
+    # host-wide budget for the commands of all instances and their test threads
+    governor = ResourceGovernor(args.cpu_slots, args.mem_headroom_mb) if args.cpu_slots > 0 else None
+    container_limits = {'cpus': args.container_cpus, 'mem_limit': args.container_mem}
+    apply_cache = ApplyCache(args.apply_cache) if args.apply_cache else None
+
+    # warm container pool, keyed by image
+    pool = None
+    if args.pool_size > 0 and client is not None:
+        pool = ContainerPool(client, pool_size=args.pool_size, max_reuse=args.pool_max_reuse, proxy=args.proxy,
+                             container_limits=container_limits, max_idle=args.pool_max_idle)
+        pool.remove_stale(logger)
+
+        # containers are only kept while a queued prediction still needs their image
+        def pool_image(pred):
+            task = tasks_record[pred['instance_id']]
+            repo_name = task['repo'].split('/')[-1]
+            if args.image_level != 'repo':
+                return f"ncbench_{pred['instance_id']}:latest"
+            if args.base_cache:
+                return base_commit_image_name(f'fb_{repo_name}', task['version'], task['base_commit'])
+            return f'fb_{repo_name}:dev'
+        pool.expect(Counter(pool_image(p) for p in predictions
+                            if p['instance_id'] in tasks_record and not already_reported(p['instance_id'])))
+        if args.image_level == 'repo' and not args.base_cache:
+            image_counts = Counter(tasks_record[p['instance_id']]['repo'].split('/')[-1] for p in predictions)
+            for repo_name, count in image_counts.items():
+                n = min(count, args.max_workers, args.max_per_repo or args.max_workers)
+                logger.info(f'Warming {n} containers for fb_{repo_name}:dev')
+                pool.warm(f'fb_{repo_name}:dev', f'/root/{repo_name}', n, logger, snapshot=False)
+
     # run evaluation and store results in reports_fapth
     reports_fpath = os.path.join(args.log_dir, '0reports.jsonl')
     write_lock = Lock()
-    if args.max_workers == 1:
-        for pred in tqdm(predictions):
-            process_instance(pred, tasks_record, write_lock)
-    else:
-        with ThreadPoolExecutor(args.max_workers) as executor:
-            futures = [executor.submit(process_instance, pred, tasks_record, write_lock) for pred in predictions]
+    for report in cached_reports + rejected_reports:
+        write_report(report)
+
+    # print running metrics of the reports written so far
+    live_stop = Event()
+
+    def live_summary():
+        aggregator = EvalAggregator(list(tasks_record.values()), predictions_record, args.gold,
+                                    strict_skipped=args.p2p_memo_strict)
+        offset = 0
+        while not live_stop.wait(args.live_summary):
+            offset = aggregator.consume(report_stream(reports_fpath, store, offset), offset)
+            summary = aggregator.summary_lines(args.predictions_path, f"Live ({len(aggregator.reported)} reports so far)")
+            tqdm.write("\n".join(summary))
+
+    live_thread = None
+    if args.live_summary > 0:
+        live_thread = Thread(target=live_summary, daemon=True)
+        live_thread.start()
+
+    run_start = time.time()
+    try:
+        if args.coordinator:
+            # workers on other docker hosts lease the jobs and send back the reports
+            jobs = [instance_job(pred, tasks_record[pred['instance_id']], args, p2p_skips.get(pred['instance_id']))
+                    for pred in predictions]
+            work_queue = WorkQueue(jobs, write_report, lease_seconds=args.lease_seconds)
+            serve_queue(work_queue, parse_address(args.coordinator), args.authkey.encode())
+            logger.info(f'Coordinator serving {len(jobs)} jobs on {args.coordinator}')
+            with tqdm(total=len(jobs), colour="MAGENTA") as progress:
+                while not work_queue.finished():
+                    status = work_queue.status()
+                    progress.update(status['done'] + status['failed'] - progress.n)
+                    progress.set_postfix(running=status['running'], failed=status['failed'])
+                    time.sleep(5)
+            logger.info(f'Coordinator finished: {work_queue.status()}')
+        elif args.max_workers == 1:
+            for pred in tqdm(predictions):
+                process_instance(pred, tasks_record, write_lock)
+        else:
+            futures = run_scheduled(predictions, lambda pred: process_instance(pred, tasks_record, write_lock),
+                                    args.max_workers, repo_key, args.max_per_repo)
             for future in tqdm(
-                    as_completed(futures),
+                    futures,
                     total=len(predictions),
                     colour="MAGENTA",
             ):
                 future.result()
+    finally:
+        live_stop.set()
+        if pool is not None:
+            pool.close(logger)
+    actual_makespan = time.time() - run_start
 
     logger.info(f"Finished process for {len(predictions)} predictions")
+    logger.info(f"Makespan: estimated {estimated_makespan:.0f}s, actual {actual_makespan:.0f}s")
+    if governor is not None:
+        logger.info(f"Resource governor: {governor.cpu_slots} cpu slots, peak {governor.max_in_use} in use, "
+                    f"{governor.wait_time:.0f}s total wait")
+    if store is not None:
+        # latest attempt per instance, for tools reading the jsonl
+        store.export_reports_jsonl(reports_fpath)
+    if args.timing_table:
+        update_timing_table(args.timing_table, [report for report, _ in report_stream(reports_fpath, store)])
+
+
+class EvalAggregator:
+    """
+    Incrementally maintained evaluation details and metrics.
+
+    Reports are fed one at a time (e.g. streamed from `0reports.jsonl`); only the instance of
+    each report is recomputed and the running counters behind Applied%, Success%, RT%,
+    FV-Micro and FV-Macro are updated by removing its old contribution and adding the new one.
+
+    Args:
+        all_tasks (list[dict]): Benchmark tasks, defines the instances and their order.
+        predictions_record (dict): instance_id -> prediction (or task in gold mode).
+        gold (bool): Whether the gold patch was evaluated.
+        keep_resolved (bool): Never replace an already resolved instance (unresolved_only mode).
+        strict_skipped (bool): An instance with P2P tests skipped by p2p memoization is neither
+            resolved nor counted in RT%. By default it is judged on the P2P tests that ran
+            (the skipped ones passed with the gold patch and cannot reach the changed files).
+    """
+
+    def __init__(self, all_tasks, predictions_record, gold=False, keep_resolved=False, strict_skipped=False):
+        self.tasks_record = {t['instance_id']: t for t in all_tasks}
+        self.predictions_record = predictions_record
+        self.gold = gold
+        self.keep_resolved = keep_resolved
+        self.strict_skipped = strict_skipped
+        self.details = {}
+        self.reported = set()
+        self.processed = set()
+        self.counters = Counter()
+
+    def _p2p_passed(self, p2p):
+        # tests skipped without being run neither pass nor fail, unless strict
+        return not p2p.get('failure') and not (self.strict_skipped and p2p.get('skipped'))
+
+    def _contribution(self, detail):
+        f2p_data = detail.get("F2P", {})
+        success_count = len(f2p_data.get("success", []))
+        failure_count = len(f2p_data.get("failure", [])) + len(f2p_data.get("fail", []))
+        total_f2p = success_count + failure_count
+        return Counter({
+            'applied': int(bool(detail.get("applied", False))),
+            'resolved': int(bool(detail.get("resolved", False))),
+            # RT: instances without P2P failures
+            'rt': int(self._p2p_passed(detail.get("P2P", {}))),
+            'fv_micro_ok': success_count,
+            'fv_micro_all': total_f2p,
+            # perfect score if no tests
+            'fv_macro_sum': success_count / total_f2p if total_f2p > 0 else 1.0,
+            'rows': 1,
+            # P2P tests skipped without being run (p2p memoization)
+            'p2p_skipped': len(detail.get("P2P", {}).get("skipped", [])),
+            'p2p_skipped_instances': int(bool(detail.get("P2P", {}).get("skipped"))),
+        })
+
+    def set_detail(self, instance_id, detail):
+        old = self.details.pop(instance_id, None)
+        if old is not None:
+            self.counters.subtract(self._contribution(old))
+        if detail is not None:
+            self.details[instance_id] = detail
+            self.counters.update(self._contribution(detail))
+
+    def mark_not_attempted(self, instance_id):
+        task = self.tasks_record[instance_id]
+        self.processed.add(instance_id)
+        self.set_detail(instance_id, {
+            "instance_id": instance_id,
+            "resolved": False,
+            "notes": "Instance not attempted or report was empty.",
+            "P2P": {"success": [], "fail": task.get('PASS2PASS', [])},
+            "F2P": {"success": [], "fail": task.get('FAIL2PASS', [])}
+        })
+
+    def add_report(self, report):
+        """
+        Recompute the instance of `report`. Later reports of the same instance win.
+        """
+        if not report or report['instance_id'] not in self.tasks_record:
+            return
+        instance_id = report['instance_id']
+        self.reported.add(instance_id)
+        existing = self.details.get(instance_id)
+        if self.keep_resolved and existing is not None and existing.get('resolved', False):
+            return
+        task = self.tasks_record[instance_id]
+        self.processed.add(instance_id)
+
+        patch_applied = report.get('feature_patch_applied', False)
+        if self.gold and 'feature_patch_applied' not in report:
+            patch_applied = True
+
+        result = eval_instance(task, report)
+        if not result:
+            self.set_detail(instance_id, None)
+            return
+
+        p2p_success = self._p2p_passed(result['p2p'])
+        f2p_success = not result['f2p']['failure']
+
+        model_patch = ''
+        if self.gold:
+            model_patch = task.get('feature_patch', '')
+        elif instance_id in self.predictions_record:
+            model_patch = self.predictions_record[instance_id].get('model_patch', '')
+
+        instance_eval_details = {
+            "instance_id": instance_id,
+            "resolved": p2p_success and f2p_success,
+            "applied": patch_applied,
+            "model_patch": model_patch,
+            "P2P": result.get('p2p', {}),
+            "F2P": result.get('f2p', {})
+        }
+        if report.get('timing'):
+            instance_eval_details['timing'] = report['timing']
+        if report.get('leaked_processes'):
+            instance_eval_details['leaked_processes'] = report['leaked_processes']
+        self.set_detail(instance_id, instance_eval_details)
+
+    def consume(self, reports, position=0):
+        """
+        Feed the (report, position) pairs of a `report_stream`; returns the last position.
+        """
+        for report, position in reports:
+            self.add_report(report)
+        return position
+
+    def ordered_details(self):
+        return [self.details[i] for i in self.tasks_record if i in self.details]
+
+    def summary_lines(self, predictions_path, scope_description):
+        total_instances = len(self.tasks_record)
+        submitted_instances = len(self.reported & self.details.keys())
+        fpt_rate = self.counters['resolved']
+        rt_rate = self.counters['rt']
+        fp_apply_rate = self.counters['applied']
+        fv_micro_ok = self.counters['fv_micro_ok']
+        fv_micro_all = self.counters['fv_micro_all']
+        fv_micro_score = fv_micro_ok / fv_micro_all if fv_micro_all > 0 else 0
+        fv_macro_score = self.counters['fv_macro_sum'] / self.counters['rows'] if self.counters['rows'] else 0
+        skipped_lines = []
+        if self.counters['p2p_skipped'] > 0:
+            counted = 'failing Success% and RT%' if self.strict_skipped else 'judged on the P2P tests that ran'
+            skipped_lines.append(f"P2P skipped by proof ({counted}): "
+                                 f"{self.counters['p2p_skipped']} tests in {self.counters['p2p_skipped_instances']} instances")
+        return [
+            "-" * 90,
+            f"{predictions_path}",
+            f"Evaluation Results - {scope_description}",
+            "-" * 90,
+            f"Total Instances: {total_instances}",
+            f"Submitted Instances: {submitted_instances}",
+            f"Applied%: {fp_apply_rate / total_instances:.2%} ({fp_apply_rate} / {total_instances})" if total_instances > 0 else "Applied%: 0.00% (0 / 0)",
+            f"Success%: {fpt_rate / total_instances:.2%} ({fpt_rate} / {total_instances})" if total_instances > 0 else "Resolved%: 0.00% (0 / 0)",
+            f"Regression Test (RT%): {rt_rate / total_instances:.2%} ({rt_rate} / {total_instances})" if total_instances > 0 else "RT%: 0.00% (0 / 0)",
+            f"FV-Micro: {fv_micro_score:.4f} ({fv_micro_ok} / {fv_micro_all})",
+            f"FV-Macro: {fv_macro_score:.4f}",
+        ] + skipped_lines
 
 
 def eval_instances(args):
@@ -419,186 +1242,147 @@ def eval_instances(args):
     else:
         all_tasks = load_dataset(args.bench_tasks, split='test')
     reports_fpath = os.path.join(args.log_dir, '0reports.jsonl')
-    if os.path.exists(reports_fpath):
-        reports = load_jsonl(reports_fpath)
-    else:
-        reports = []
-
-    predictions = load_jsonl(args.predictions_path)
+    store = open_result_store(args)
 
-    reports_record = {r['instance_id']: r for r in reports if r}
     if args.gold:
         predictions_record = {t['instance_id']: t for t in all_tasks}
     else:
-        predictions_record = {p['instance_id']: p for p in predictions if p}
+        predictions_record = {p['instance_id']: p for p in load_jsonl(args.predictions_path) if p}
 
     # ==== Phase 1: Process and save results ====
     output_fpath = os.path.join(args.log_dir, 'evaluation_details.jsonl')
+    state_fpath = os.path.join(args.log_dir, 'evaluation_state.json')
 
     # Load existing results (if any)
     existing_results = {}
-    if os.path.exists(output_fpath):
-        existing_details = load_jsonl(output_fpath)
-        existing_results = {item["instance_id"]: item for item in existing_details}
-
-    # Process all tasks, build final results list
-    final_results_to_write = []
-    newly_processed_instances = set()  # Track instances processed in this run
-
+    if store is not None:
+        existing_results = {item["instance_id"]: item for item in store.details()}
+    elif os.path.exists(output_fpath):
+        existing_results = {item["instance_id"]: item for item in load_jsonl(output_fpath)}
+
+    # The details were built from the reports up to `reports_offset` (byte offset, or row id of the
+    # store) with the same settings: only the reports added since then need to be processed.
+    state = {}
+    if store is not None:
+        state = store.get_meta('evaluation_state', {}) if existing_results else {}
+        reports_size = store.last_position()
+    else:
+        if os.path.exists(state_fpath) and existing_results:
+            with open(state_fpath, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        reports_size = os.path.getsize(reports_fpath) if os.path.exists(reports_fpath) else 0
+    incremental = (state.get('predictions_path') == args.predictions_path and state.get('gold') == args.gold
+                   and state.get('bench_tasks') == args.bench_tasks
+                   and state.get('p2p_memo_strict', False) == args.p2p_memo_strict
+                   and state.get('reports_offset', reports_size + 1) <= reports_size)
+    if incremental and store is None:
+        # the same file, with the same reports before the saved offset
+        incremental = reports_fingerprint(reports_fpath, state['reports_offset']) == state.get('reports_fingerprint')
+
+    aggregator = EvalAggregator(all_tasks, predictions_record, args.gold, keep_resolved=args.unresolved_only,
+                                strict_skipped=args.p2p_memo_strict)
+    offset = 0
+    if incremental:
+        offset = state['reports_offset']
+        aggregator.reported.update(state.get('reported', []))
     for task in all_tasks:
         instance_id = task['instance_id']
-
-        # In unresolved_only mode, only process unresolved instances
-        if args.unresolved_only:
-            # If instance exists in current results and is resolved, add to final results without reprocessing
-            if instance_id in existing_results:
-                if existing_results[instance_id].get('resolved', False):
-                    final_results_to_write.append(existing_results[instance_id])
-                    continue
-                # Only unresolved instances will be processed, and these instances must have new reports
-                elif instance_id not in reports_record:
-                    final_results_to_write.append(existing_results[instance_id])
-                    continue
-
-        # Process new instances or reprocess all instances
-        if instance_id in reports_record:
-            report = reports_record[instance_id]
-
-            patch_applied = report.get('feature_patch_applied', False)
-            
-            if args.gold and 'feature_patch_applied' not in report:
-                patch_applied = True
-
-            result = eval_instance(task, report)
-
-            if not result:
-                continue
-
-            p2p_success = not result['p2p']['failure']
-            f2p_success = not result['f2p']['failure']
-            resolved = p2p_success and f2p_success
-
-            model_patch = ''
-            if args.gold:
-                model_patch = task.get('feature_patch', '')
-            else:
-                if instance_id in predictions_record:
-                    model_patch = predictions_record[instance_id].get('model_patch', '')
-
-            instance_eval_details = {
-                "instance_id": instance_id,
-                "resolved": resolved,
-                "applied": patch_applied,
-                "model_patch": model_patch,
-                "P2P": result.get('p2p', {}),
-                "F2P": result.get('f2p', {})
-            }
-
-            newly_processed_instances.add(instance_id)
-            final_results_to_write.append(instance_eval_details)
-
-        else:
-            # Instances without reports
-            resolved = False
-
-            instance_eval_details = {
-                "instance_id": instance_id,
-                "resolved": resolved,
-                "notes": "Instance not attempted or report was empty.",
-                "P2P": {"success": [], "fail": task.get('PASS2PASS', [])},
-                "F2P": {"success": [], "fail": task.get('FAIL2PASS', [])}
-            }
-
-            newly_processed_instances.add(instance_id)
-            final_results_to_write.append(instance_eval_details)
+        if instance_id in existing_results and (incremental or args.unresolved_only):
+            aggregator.set_detail(instance_id, existing_results[instance_id])
+    offset = aggregator.consume(report_stream(reports_fpath, store, offset), offset)
+    # Instances without reports
+    for task in all_tasks:
+        if task['instance_id'] not in aggregator.details and task['instance_id'] not in aggregator.reported:
+            aggregator.mark_not_attempted(task['instance_id'])
 
     # Save results to file
-    dump_jsonl(final_results_to_write, output_fpath)
+    if aggregator.processed or not os.path.exists(output_fpath):
+        dump_jsonl(aggregator.ordered_details(), output_fpath)
+    new_state = {'predictions_path': args.predictions_path, 'gold': args.gold, 'bench_tasks': args.bench_tasks,
+                 'p2p_memo_strict': args.p2p_memo_strict, 'reports_offset': offset,
+                 'reported': sorted(aggregator.reported)}
+    if store is not None:
+        if not incremental:
+            store.delete_details(set(existing_results) - aggregator.details.keys())
+        store.put_details(aggregator.details[i] for i in aggregator.processed if i in aggregator.details)
+        store.delete_details(i for i in aggregator.processed if i not in aggregator.details)
+        store.set_meta('evaluation_state', new_state)
+    else:
+        new_state['reports_fingerprint'] = reports_fingerprint(reports_fpath, offset)
+        with open(state_fpath, 'w', encoding='utf-8') as f:
+            json.dump(new_state, f)
     print(f"Detailed evaluation results saved to: {output_fpath}")
 
-    # ==== Phase 2: Read data from saved file and calculate metrics ====
-    saved_results = load_jsonl(output_fpath)
-
-    # Scope explanation for metrics calculation
+    # ==== Phase 2: Generate and output report from the running metrics ====
     total_instances = len(all_tasks)
     if args.unresolved_only:
-        newly_processed_count = len(newly_processed_instances)
+        newly_processed_count = len(aggregator.processed)
         scope_description = f"Unresolved Only Mode (Processed {newly_processed_count} instances this run, Total {total_instances} instances)"
     else:
         scope_description = f"All Instances Mode (Total {total_instances} instances)"
 
-    # Calculate metrics based on saved results
-    submitted_instances = len([r for r in saved_results if r['instance_id'] in reports_record])
-
-    # FPT rate: Count of completely resolved instances
-    fpt_rate = sum(1 for r in saved_results if r.get("resolved", False))
-
-    # RT rate: Count of instances without P2P failures
-    rt_rate = 0
-    for r in saved_results:
-        p2p_data = r.get("P2P", {})
-        has_p2p_failure = (
-                p2p_data.get("failure") or
-                len(p2p_data.get("failure", [])) > 0
-        )
-        if not has_p2p_failure:
-            rt_rate += 1
-
-    # Apply rate: Count of instances where patch was successfully applied
-    fp_apply_rate = sum(1 for r in saved_results if r.get("applied", False))
-
-    # FV-Micro calculation
-    fv_micro_ok = 0
-    fv_micro_all = 0
-    for r in saved_results:
-        f2p_data = r.get("F2P", {})
-        success_count = len(f2p_data.get("success", []))
-        failure_count = len(f2p_data.get("failure", [])) + len(f2p_data.get("fail", []))
-
-        fv_micro_ok += success_count
-        fv_micro_all += success_count + failure_count
-
-    fv_micro_score = fv_micro_ok / fv_micro_all if fv_micro_all > 0 else 0
-
-    # FV-Macro calculation
-    fv_macro_scores = []
-    for r in saved_results:
-        f2p_data = r.get("F2P", {})
-        success_count = len(f2p_data.get("success", []))
-        failure_count = len(f2p_data.get("failure", [])) + len(f2p_data.get("fail", []))
-        total_f2p = success_count + failure_count
-
-        if total_f2p > 0:
-            instance_score = success_count / total_f2p
-        else:
-            instance_score = 1.0  # Perfect score if no tests
-        fv_macro_scores.append(instance_score)
-
-    fv_macro_score = sum(fv_macro_scores) / len(fv_macro_scores) if fv_macro_scores else 0
-
-    # ==== Phase 3: Generate and output report ====
-    summary_lines = [
-        "-" * 90,
-        f"{args.predictions_path}",
-        f"Evaluation Results - {scope_description}",
-        "-" * 90,
-        f"Total Instances: {total_instances}",
-        f"Submitted Instances: {submitted_instances}",
-        f"Applied%: {fp_apply_rate / total_instances:.2%} ({fp_apply_rate} / {total_instances})" if total_instances > 0 else "Applied%: 0.00% (0 / 0)",
-        f"Success%: {fpt_rate / total_instances:.2%} ({fpt_rate} / {total_instances})" if total_instances > 0 else "Resolved%: 0.00% (0 / 0)",
-        f"Regression Test (RT%): {rt_rate / total_instances:.2%} ({rt_rate} / {total_instances})" if total_instances > 0 else "RT%: 0.00% (0 / 0)",
-        f"FV-Micro: {fv_micro_score:.4f} ({fv_micro_ok} / {fv_micro_all})",
-        f"FV-Macro: {fv_macro_score:.4f}",
-    ]
-
-
-    summary_report_str = "\n".join(summary_lines)
+    summary_report_str = "\n".join(aggregator.summary_lines(args.predictions_path, scope_description))
     print(summary_report_str)
 
     summary_output_fpath = args.output_file if args.output_file else f'{args.predictions_path.split(".")[0]}_summary_report.txt'
     with open(summary_output_fpath, 'w', encoding='utf-8') as f:
         f.write(summary_report_str)
 
+    latency_report_str = "\n".join(latency_breakdown(all_tasks, report_stream(reports_fpath, store)))
+    print(latency_report_str)
+    with open(os.path.join(args.log_dir, 'latency_report.txt'), 'w', encoding='utf-8') as f:
+        f.write(latency_report_str)
+
+
+def latency_breakdown(all_tasks, reports, top_k=10):
+    '''
+    Summarize the stage timings of the reports per repo, and list the slowest
+    instances and test invocations (including timed out ones).
+    Only the timing fields of the streamed reports are kept in memory.
+    '''
+    stages = ['base_image', 'container_start', 'checkout', 'pre_install', 'patch_apply', 'install', 'f2p_tests',
+              'p2p_tests', 'cleanup', 'total']
+    repo_of = {t['instance_id']: t['repo'] for t in all_tasks}
+    per_repo = defaultdict(lambda: defaultdict(float))
+    repo_counts = Counter()
+    instance_totals = []
+    test_runs = []
+    reports_record = {}
+    for report, _ in reports:
+        if report:
+            reports_record[report['instance_id']] = {k: report.get(k) for k in ['timing', 'f2p_timing', 'p2p_timing']}
+    for instance_id, report in reports_record.items():
+        timing = report.get('timing')
+        if not timing:
+            continue
+        repo = repo_of.get(instance_id, 'unknown')
+        repo_counts[repo] += 1
+        for stage in stages:
+            per_repo[repo][stage] += timing.get(stage, 0.0)
+        instance_totals.append((timing.get('total', 0.0), instance_id, timing))
+        for test_timing in (report.get('f2p_timing') or []) + (report.get('p2p_timing') or []):
+            if test_timing:
+                test_runs.append((test_timing['duration'], test_timing['timed_out'], instance_id, test_timing['tests']))
+
+    lines = ["-" * 90, "Latency Breakdown (seconds, mean per instance)", "-" * 90]
+    lines.append(f"{'repo':<28}{'n':>5}" + ''.join(f"{stage:>16}" for stage in stages))
+    for repo in sorted(per_repo, key=lambda r: -per_repo[r]['total']):
+        n = repo_counts[repo]
+        lines.append(f"{repo:<28}{n:>5}" + ''.join(f"{per_repo[repo][stage] / n:>16.1f}" for stage in stages))
+
+    lines.append(f"Slowest {top_k} instances:")
+    for total, instance_id, timing in sorted(instance_totals, reverse=True)[:top_k]:
+        stage_str = ', '.join(f"{stage}={timing[stage]:.1f}" for stage in stages[:-1] if stage in timing)
+        lines.append(f"  {instance_id}: {total:.1f}s ({stage_str})")
+
+    timed_out = [run for run in test_runs if run[1]]
+    lines.append(f"Timed out test invocations: {len(timed_out)} / {len(test_runs)}")
+    lines.append(f"Slowest {top_k} test invocations:")
+    for duration, is_timed_out, instance_id, tests in sorted(test_runs, key=lambda run: -run[0])[:top_k]:
+        label = tests[0] if len(tests) == 1 else f"{tests[0]} (+{len(tests) - 1} more)"
+        lines.append(f"  {instance_id}: {duration:.1f}s{' [timeout]' if is_timed_out else ''} {label}")
+    return lines
+
 
 def eval_file_localization(args):
     """
@@ -693,12 +1477,73 @@ if __name__ == "__main__":
     parser.add_argument("--image_level", type=str, choices=['instance', 'repo'], default='repo')
     parser.add_argument("--output_file", type=str, default=None,
                         help="(Optional) Path to save detailed evaluation results (.jsonl).")
-    parser.add_argument("--timeout", type=int, help="(Optional) Timeout in seconds (default: 600)", default=600)
+    parser.add_argument("--timeout", type=int, help="(Optional) Timeout in seconds (default: 1200), applied to every F2P and P2P test invocation", default=1200)
     parser.add_argument("--max_workers", type=int, help="(Optional) Max workers (default: 1)", default=1)
     parser.add_argument("--proxy", type=str, help="(Optional) Http proxy (default: None)", default=None)
+    parser.add_argument("--base_cache", action="store_true",
+                        help="(Optional) In repo-level mode, reuse a committed post-install image per (repo, version, base_commit)")
+    parser.add_argument("--skip_reinstall", action="store_true",
+                        help="(Optional) Skip reinstall after the feature patch for pure-Python edits of an already installed editable checkout")
+    parser.add_argument("--report_cache", type=str, default=None,
+                        help="(Optional) SQLite file of reports keyed by instance, base commit, patches and image digest, shared by runs")
+    parser.add_argument("--precheck_repos", type=str, default=None,
+                        help="(Optional) Directory with the repo clones of repos/collect.sh; predictions that do not apply there are rejected before any container is started")
+    parser.add_argument("--p2p_memo_map", type=str, default=None,
+                        help="(Optional) Test -> file map (evaluation/build_test_map.py or construction/filter_execution/coverage_map.py); with --p2p_memo_gold, P2P tests unaffected by the patch are not run")
+    parser.add_argument("--p2p_memo_gold", type=str, default=None,
+                        help="(Optional) Log dir of a gold run whose passing P2P tests may be skipped")
+    parser.add_argument("--p2p_memo_static_repos", type=str, nargs='*', default=[],
+                        help="(Optional) Repos (e.g. psf/requests) whose static import closures may prove a P2P test unaffected; other repos only use coverage rows")
+    parser.add_argument("--p2p_memo_strict", action="store_true",
+                        help="(Optional) Instances with P2P tests skipped by --p2p_memo_map are neither resolved nor counted in RT%% (default: judged on the P2P tests that ran)")
+    parser.add_argument("--apply_cache", type=str, default=None,
+                        help="(Optional) JSON file remembering which apply command works per (base_commit, patch), reused by reruns")
+    parser.add_argument("--structured_results", action="store_true",
+                        help="(Optional) Read pytest results from JUnit XML reports, falling back to stdout scraping")
+    parser.add_argument("--max_output_kb", type=int, default=0,
+                        help="(Optional) Keep only the last KB of each test output plus its result lines (default: 0, keep everything)")
+    parser.add_argument("--test_batch_size", type=int, default=1,
+                        help="(Optional) Max test ids per test invocation, grouped by file (default: 1, one invocation per test)")
+    parser.add_argument("--schedule", type=str, choices=['dataset', 'longest_first'], default='dataset',
+                        help="(Optional) Instance order: dataset order, or longest predicted duration first")
+    parser.add_argument("--max_per_repo", type=int, default=0,
+                        help="(Optional) Max instances of the same repo running concurrently (default: 0, no limit)")
+    parser.add_argument("--timing_history", type=str, nargs='*', default=None,
+                        help="(Optional) Previous log dirs or JSON timing tables used to predict instance durations")
+    parser.add_argument("--timing_table", type=str, default=None,
+                        help="(Optional) JSON timing table read before and updated after the run")
+    parser.add_argument("--cpu_slots", type=int, default=0,
+                        help="(Optional) Max installs/test commands running at once across all instances (default: 0, no limit)")
+    parser.add_argument("--mem_headroom_mb", type=int, default=0,
+                        help="(Optional) Do not start a command while the host has less available memory (MB)")
+    parser.add_argument("--container_cpus", type=float, default=None,
+                        help="(Optional) CPU limit per container, e.g. 2.0")
+    parser.add_argument("--container_mem", type=str, default=None,
+                        help="(Optional) Memory limit per container, e.g. 8g")
+    parser.add_argument("--live_summary", type=int, default=0,
+                        help="(Optional) Print running metrics every N seconds while instances are running (default: 0, off)")
+    parser.add_argument("--result_store", type=str, default=None,
+                        help="(Optional) SQLite file storing reports, details and per-test outcomes instead of the jsonl files")
+    parser.add_argument("--run_id", type=str, default=None,
+                        help="(Optional) Run name in the result store (default: absolute path of the log directory)")
+    parser.add_argument("--coordinator", type=str, default=None,
+                        help="(Optional) host:port to serve the predictions to evaluation/eval_worker.py workers instead of running them locally")
+    parser.add_argument("--authkey", type=str, default=os.getenv('NCBENCH_AUTHKEY'),
+                        help="(Optional) Shared secret of coordinator and workers, required with --coordinator (default: $NCBENCH_AUTHKEY)")
+    parser.add_argument("--lease_seconds", type=int, default=300,
+                        help="(Optional) A job is handed out again if its worker sends no heartbeat for this long")
+    parser.add_argument("--pool_size", type=int, default=0,
+                        help="(Optional) Warm containers kept per image and reused across instances (default: 0, one container per instance)")
+    parser.add_argument("--pool_max_reuse", type=int, default=20,
+                        help="(Optional) Instances served by a pooled container before it is discarded (default: 20)")
+    parser.add_argument("--pool_max_idle", type=int, default=None,
+                        help="(Optional) Idle pooled containers kept over all images, least recently used removed first (default: pool_size)")
     parser.add_argument("--gold", action="store_true", help="(Optional) Use golden patch (feature_patch) from dataset instead of model predictions")
     parser.add_argument("--unresolved_only", action="store_true", help="(Optional) Only run unresolved tasks from previous evaluation")
 
     args = parser.parse_args()
+    if args.coordinator and not args.authkey:
+        # the queue manager unpickles what its peers send, a public default key would let anyone in
+        parser.error("--coordinator requires --authkey or $NCBENCH_AUTHKEY")
     main(args)
 
@@ -0,0 +1,138 @@
+import argparse
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import docker
+
+from evaluation.eval import run_instance
+from utils.apply_cache import ApplyCache
+from utils.container_pool import ContainerPool
+from utils.image_index import ImageIndex
+from utils.logger import get_logger
+from utils.resource_governor import ResourceGovernor
+from utils.work_queue import connect_queue, parse_address
+
+
+def worker_loop(work_queue, worker_id, run_fn, logger, poll_interval=5):
+    '''
+    Lease jobs from the coordinator until all jobs are finished, run them with `run_fn(job)`
+    and send the reports back. A failing job is returned to the queue for another attempt.
+    '''
+    while True:
+        job = work_queue.get(worker_id)
+        if job is None:
+            return
+        if not job:
+            # other workers still hold leases that may expire and come back
+            time.sleep(poll_interval)
+            continue
+        instance_id = job['instance_id']
+        try:
+            report = run_fn(job)
+        except Exception as e:
+            logger.error(f"Instance {instance_id} failed on {worker_id}: {e}")
+            work_queue.fail(worker_id, instance_id, str(e))
+            continue
+        report['worker'] = worker_id
+        work_queue.complete(worker_id, instance_id, report)
+
+
+def main(args):
+    os.makedirs(args.log_dir, exist_ok=True)
+    worker_id = args.worker_id or f'{socket.gethostname()}-{os.getpid()}'
+    logger = get_logger(log_name=f'worker_{worker_id}', log_file=os.path.join(args.log_dir, '0worker.log'))
+    logger.info(args)
+
+    client = docker.DockerClient(base_url=args.docker_host) if args.docker_host else docker.from_env()
+    governor = ResourceGovernor(args.cpu_slots, args.mem_headroom_mb) if args.cpu_slots > 0 else None
+    apply_cache = ApplyCache(args.apply_cache) if args.apply_cache else None
+    images = ImageIndex(client)
+
+    pool = None
+    pool_lock = threading.Lock()
+
+    def run_fn(job):
+        nonlocal pool
+        # proxy and container limits of the coordinator's run, unless this worker overrides them
+        job = dict(job)
+        if args.proxy is not None:
+            job['proxy'] = args.proxy
+        limits = dict(job.get('container_limits') or {})
+        if args.container_cpus is not None:
+            limits['cpus'] = args.container_cpus
+        if args.container_mem is not None:
+            limits['mem_limit'] = args.container_mem
+        job['container_limits'] = limits
+        with pool_lock:
+            if pool is None and args.pool_size > 0:
+                pool = ContainerPool(client, pool_size=args.pool_size, max_reuse=args.pool_max_reuse,
+                                     proxy=job['proxy'], container_limits=limits, max_idle=args.pool_max_idle)
+        return run_instance(**job, client=client, log_dir=args.log_dir, pool=pool, governor=governor,
+                            apply_cache=apply_cache, images=images)
+
+    stop = threading.Event()
+
+    def heartbeat():
+        heartbeat_queue = connect_queue(parse_address(args.coordinator), args.authkey.encode())
+        while not stop.wait(args.heartbeat_interval):
+            try:
+                heartbeat_queue.heartbeat(worker_id)
+            except Exception as e:
+                logger.error(f"Heartbeat failed: {e}")
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+
+    def run_slot(slot):
+        # every thread uses its own connection to the coordinator
+        work_queue = connect_queue(parse_address(args.coordinator), args.authkey.encode())
+        worker_loop(work_queue, worker_id, run_fn, logger)
+
+    try:
+        with ThreadPoolExecutor(args.max_workers) as executor:
+            for future in [executor.submit(run_slot, i) for i in range(args.max_workers)]:
+                future.result()
+    finally:
+        stop.set()
+        if pool is not None:
+            pool.close(logger)
+    logger.info(f"Worker {worker_id} finished")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run evaluation jobs served by eval.py --coordinator')
+    parser.add_argument("--coordinator", type=str, help="host:port of the coordinator", required=True)
+    parser.add_argument("--authkey", type=str, default=os.getenv('NCBENCH_AUTHKEY'),
+                        help="Shared secret of coordinator and workers (default: $NCBENCH_AUTHKEY)")
+    parser.add_argument("--docker_host", type=str, default=os.getenv('DOCKER_HOST'),
+                        help="(Optional) Docker daemon URL, e.g. tcp://10.0.0.2:2375 (default: $DOCKER_HOST)")
+    parser.add_argument("--log_dir", type=str, help="Path to the local log directory of this worker", required=True)
+    parser.add_argument("--worker_id", type=str, default=None, help="(Optional) Worker name (default: host-pid)")
+    parser.add_argument("--max_workers", type=int, default=1, help="(Optional) Instances run in parallel (default: 1)")
+    parser.add_argument("--heartbeat_interval", type=int, default=60,
+                        help="(Optional) Seconds between lease heartbeats, must be below the coordinator's --lease_seconds")
+    parser.add_argument("--cpu_slots", type=int, default=0,
+                        help="(Optional) Max installs/test commands running at once on this worker (default: 0, no limit)")
+    parser.add_argument("--mem_headroom_mb", type=int, default=0,
+                        help="(Optional) Do not start a command while the docker host has less available memory (MB)")
+    parser.add_argument("--apply_cache", type=str, default=None,
+                        help="(Optional) JSON file remembering which apply command works per (base_commit, patch)")
+    parser.add_argument("--pool_size", type=int, default=0, help="(Optional) Warm containers kept per image")
+    parser.add_argument("--pool_max_reuse", type=int, default=20,
+                        help="(Optional) Instances served by a pooled container before it is discarded")
+    parser.add_argument("--pool_max_idle", type=int, default=None,
+                        help="(Optional) Idle pooled containers kept over all images (default: pool_size)")
+    parser.add_argument("--proxy", type=str, default=None,
+                        help="(Optional) Proxy of the containers (default: the coordinator's --proxy)")
+    parser.add_argument("--container_cpus", type=float, default=None,
+                        help="(Optional) CPU limit per container (default: the coordinator's --container_cpus)")
+    parser.add_argument("--container_mem", type=str, default=None,
+                        help="(Optional) Memory limit per container (default: the coordinator's --container_mem)")
+
+    args = parser.parse_args()
+    if not args.authkey:
+        # the queue manager unpickles what its peers send, a public default key would let anyone in
+        parser.error("--authkey or $NCBENCH_AUTHKEY is required")
+    main(args)
@@ -0,0 +1,41 @@
+import hashlib
+import json
+import os
+import threading
+
+
+def patch_key(base_commit, patch):
+    return f"{base_commit}:{hashlib.sha256(patch.encode('utf-8')).hexdigest()}"
+
+
+class ApplyCache:
+    """
+    Host-side record of how a patch applies to a base commit, persisted as a JSON file
+    `{base_commit:sha256(patch): {"applied": bool, "strategy": int | None}}`.
+
+    `strategy` is the index of the first apply command that succeeded. A rerun tries that
+    command directly, and skips a patch that no command could apply.
+
+    Args:
+        fpath (str): JSON file, shared by runs (and threads) of this host.
+    """
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(fpath):
+            with open(fpath, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+
+    def get(self, base_commit, patch):
+        with self._lock:
+            return self._entries.get(patch_key(base_commit, patch))
+
+    def put(self, base_commit, patch, applied, strategy):
+        with self._lock:
+            self._entries[patch_key(base_commit, patch)] = {'applied': applied, 'strategy': strategy}
+            tmp_fpath = f'{self.fpath}.{os.getpid()}.tmp'
+            with open(tmp_fpath, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_fpath, self.fpath)
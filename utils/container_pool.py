@@ -0,0 +1,196 @@
+import threading
+import uuid
+from collections import Counter, OrderedDict, defaultdict, deque
+
+import docker
+from docker.models.containers import Container
+
+import utils.docker_utils as du
+
+POOL_LABEL = "ncbench.pool"
+PRISTINE_INDEX = "/tmp/ncbench_pristine.index"
+
+# Record the worktree (tracked + untracked, ignored files excluded) in a private index
+# so the container can be brought back to this exact state without touching HEAD.
+SNAPSHOT_CMD = f"bash -c 'cp .git/index {PRISTINE_INDEX} && GIT_INDEX_FILE={PRISTINE_INDEX} git add -A'"
+# Restore every snapshotted file and drop anything untracked that appeared since.
+# Ignored files (build artifacts of the editable install) are kept on purpose.
+RESET_CMD = f"bash -c 'export GIT_INDEX_FILE={PRISTINE_INDEX} && git checkout-index -a -f && git clean -fdq'"
+# Containers without a snapshot only get a clean worktree at HEAD; their next user checks out
+# its commit and installs it again (repo-level mode of run_instance).
+CLEAN_CMD = "bash -c 'git clean -fdxq && git reset -q --hard HEAD'"
+
+
+class ContainerPool:
+    """
+    Per-image pool of started containers that are handed out to workers and reset
+    between uses instead of being created and destroyed for every instance.
+
+    Args:
+        client (docker.DockerClient): Docker client used to create containers.
+        pool_size (int): Max number of idle containers kept per image.
+        max_reuse (int): Number of instances a container serves before it is discarded.
+        proxy (str): Http proxy passed to the containers.
+        container_limits (dict): Optional `cpus` / `mem_limit` of the containers.
+        max_idle (int): Max number of idle containers over all images; the least recently
+            released ones are removed first (default: pool_size).
+
+    Containers acquired with `snapshot=True` are reset to their snapshot, the others only to
+    a clean worktree (CLEAN_CMD), so their users must check out and install their commit
+    themselves. Once `expect` has been called, a released container is discarded when no
+    expected job still needs its image. Discarded containers are killed, not stopped:
+    PID 1 (`tail -f /dev/null`) ignores SIGTERM.
+    """
+
+    def __init__(self, client: docker.DockerClient, pool_size=4, max_reuse=20, proxy=None, container_limits=None,
+                 max_idle=None):
+        self.client = client
+        self.pool_size = pool_size
+        self.max_reuse = max_reuse
+        self.proxy = proxy
+        self.container_limits = container_limits or {}
+        self.max_idle = max_idle or pool_size
+        self._idle = defaultdict(deque)
+        # idle container id -> image, in release order (LRU first)
+        self._idle_order = OrderedDict()
+        self._pending = Counter()
+        self._track_demand = False
+        self._uses = {}
+        self._meta = {}
+        self._lock = threading.Lock()
+
+    def expect(self, image_counts):
+        """
+        Register the number of jobs that will still acquire a container of each image.
+        """
+        with self._lock:
+            self._track_demand = True
+            self._pending.update(image_counts)
+
+    def remove_stale(self, logger=None):
+        """
+        Remove pooled containers left behind by a previous (crashed) run.
+        """
+        for container in self.client.containers.list(all=True, filters={"label": POOL_LABEL}):
+            du.cleanup_container(self.client, container, logger, stop_timeout=0)
+
+    def _create(self, image_name, work_dir, logger, snapshot):
+        repo = image_name.split(':')[0]
+        container = du.build_container(
+            image_name=image_name,
+            container_name=f'{repo}__pool_{uuid.uuid4().hex[:8]}',
+            client=self.client,
+            logger=logger,
+            proxy=self.proxy,
+            labels={POOL_LABEL: image_name},
+            **self.container_limits
+        )
+        if container is None:
+            raise RuntimeError(f"Failed to create pooled container for {image_name}")
+        container.start()
+        if snapshot:
+            cmd_res = container.exec_run(SNAPSHOT_CMD, workdir=work_dir)
+            if cmd_res.exit_code != 0:
+                du.cleanup_container(self.client, container, logger, stop_timeout=0)
+                raise RuntimeError(f"Failed to snapshot worktree of {image_name}: {cmd_res.output}")
+        with self._lock:
+            self._uses[container.id] = 0
+            self._meta[container.id] = (image_name, work_dir, snapshot)
+        return container
+
+    def warm(self, image_name, work_dir, n, logger=None, snapshot=True):
+        """
+        Pre-start up to `n` containers for `image_name` (bounded by pool_size).
+        """
+        with self._lock:
+            missing = min(n, self.pool_size) - len(self._idle[image_name])
+        for _ in range(max(missing, 0)):
+            container = self._create(image_name, work_dir, logger, snapshot)
+            with self._lock:
+                self._idle[image_name].append(container)
+                self._idle_order[container.id] = image_name
+
+    def acquire(self, image_name, work_dir, logger, snapshot=True) -> Container:
+        """
+        Hand out an idle container for `image_name`, creating one if the pool is empty.
+
+        Args:
+            image_name (str): Image tag, e.g. `fb_django:dev` or `ncbench_{id}:latest`.
+            work_dir (str): Repository directory inside the container.
+            logger (logging.Logger): Logger of the instance.
+            snapshot (bool): Record the worktree so that `release` can restore it.
+        """
+        with self._lock:
+            if self._pending[image_name] > 0:
+                self._pending[image_name] -= 1
+            idle = self._idle[image_name]
+            container = idle.popleft() if idle else None
+            if container is not None:
+                self._idle_order.pop(container.id, None)
+                self._uses[container.id] += 1
+        if container is not None:
+            logger.info(f"Reusing pooled container {container.name} for {image_name}")
+            return container
+        container = self._create(image_name, work_dir, logger, snapshot)
+        with self._lock:
+            self._uses[container.id] += 1
+        logger.info(f"Created pooled container {container.name} for {image_name}")
+        return container
+
+    def _discard(self, container, logger):
+        with self._lock:
+            self._uses.pop(container.id, None)
+            self._meta.pop(container.id, None)
+        du.cleanup_container(self.client, container, logger, stop_timeout=0)
+
+    def release(self, container, logger, recycle=True):
+        """
+        Return a container to the pool. It is reset to its snapshotted (or a clean) worktree,
+        or discarded when `recycle` is False, the reset fails, the reuse limit is reached,
+        no expected job needs its image or the pool for its image is already full. The least recently released idle containers beyond `max_idle` are removed.
+        """
+        if container is None:
+            return
+        with self._lock:
+            uses = self._uses.get(container.id, self.max_reuse)
+            image_name, work_dir, snapshot = self._meta.get(container.id, (None, None, False))
+            unneeded = self._track_demand and self._pending[image_name] <= 0
+        if not recycle or unneeded or uses >= self.max_reuse or image_name is None:
+            self._discard(container, logger)
+            return
+        try:
+            cmd_res = container.exec_run(RESET_CMD if snapshot else CLEAN_CMD, workdir=work_dir)
+            if cmd_res.exit_code != 0:
+                logger.error(f"Failed to reset pooled container {container.name}: {cmd_res.output}")
+                self._discard(container, logger)
+                return
+        except Exception as e:
+            logger.error(f"Failed to reset pooled container {container.name}: {e}")
+            self._discard(container, logger)
+            return
+        evicted = []
+        with self._lock:
+            if len(self._idle[image_name]) >= self.pool_size:
+                evicted.append(container)
+            else:
+                self._idle[image_name].append(container)
+                self._idle_order[container.id] = image_name
+                while len(self._idle_order) > self.max_idle:
+                    old_id, old_image = self._idle_order.popitem(last=False)
+                    idle = self._idle[old_image]
+                    old = next(c for c in idle if c.id == old_id)
+                    idle.remove(old)
+                    evicted.append(old)
+        for old in evicted:
+            self._discard(old, logger)
+
+    def close(self, logger=None):
+        """
+        Stop and remove all idle containers.
+        """
+        with self._lock:
+            containers = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+            self._idle_order.clear()
+        for container in containers:
+            self._discard(container, logger)
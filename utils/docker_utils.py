@@ -1,8 +1,12 @@
+import io
+import shlex
 import tarfile
 import threading
 import os
 import signal
 import time
+import uuid
+from collections import Counter
 from pathlib import Path
 import docker
 from docker.models.containers import Container
@@ -11,7 +15,7 @@ import sys
 
 HEREDOC_DELIMITER = "EOF_1399519320"  # different from dataset HEREDOC_DELIMITERs!
 
-def copy_to_container(container: Container, src: Path, dst: Path):
+def copy_to_container(container: Container, src: Path, dst: Path, mkdir=True):
     """
     Copy a file from local to a docker container
 
@@ -19,6 +23,7 @@ def copy_to_container(container: Container, src: Path, dst: Path):
         container (Container): Docker container to copy to
         src (Path): Source file path
         dst (Path): Destination file path in the container
+        mkdir (bool): Create the destination directory first (skip if it is known to exist)
     """
     # Check if destination path is valid
     if os.path.dirname(dst) == "":
@@ -26,25 +31,70 @@ def copy_to_container(container: Container, src: Path, dst: Path):
             f"Destination path parent directory cannot be empty!, dst: {dst}"
         )
 
-    # temporary tar file
-    tar_path = src.with_suffix(".tar")
-    with tarfile.open(tar_path, "w") as tar:
-        tar.add(
-            src, arcname=dst.name
-        )  # use destination name, so after `put_archive`, name is correct
-
-    # get bytes for put_archive cmd
-    with open(tar_path, "rb") as tar_file:
-        data = tar_file.read()
+    # tar in memory, use destination name, so after `put_archive`, name is correct
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w") as tar:
+        tar.add(src, arcname=dst.name)
 
     # Make directory if necessary
-    container.exec_run(f"mkdir -p {dst.parent}")
+    if mkdir:
+        container.exec_run(f"mkdir -p {dst.parent}")
 
     # Send tar file to container and extract
-    container.put_archive(os.path.dirname(dst), data)
+    container.put_archive(os.path.dirname(dst), data.getvalue())
+
+
+def put_files_to_container(container: Container, files: dict, dst_dir, mkdir=False):
+    """
+    Write in-memory files into a directory of a docker container with a single archive upload
+
+    Args:
+        container (Container): Docker container to copy to
+        files (dict): File name (relative to `dst_dir`) -> content (str or bytes)
+        dst_dir (str): Destination directory in the container
+        mkdir (bool): Create `dst_dir` first (skip if it is known to exist, e.g. /tmp)
+    """
+    data = io.BytesIO()
+    now = time.time()
+    with tarfile.open(fileobj=data, mode="w") as tar:
+        for name, content in files.items():
+            if isinstance(content, str):
+                content = content.encode("utf-8")
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mtime = now
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(content))
+
+    if mkdir:
+        container.exec_run(f"mkdir -p {dst_dir}")
+
+    if not container.put_archive(str(dst_dir), data.getvalue()):
+        raise RuntimeError(f"Failed to copy {list(files)} to {dst_dir} in container {container.name}")
+
+
+def fetch_files_from_container(container: Container, src) -> dict:
+    """
+    Read all files under a path of a docker container with a single archive download
+
+    Args:
+        container (Container): Docker container to copy from
+        src (str): File or directory path in the container
 
-    # clean up in locally and in container
-    tar_path.unlink()
+    Returns:
+        dict: Path relative to the parent of `src` -> content (bytes); empty if `src` does not exist
+    """
+    try:
+        stream, _ = container.get_archive(str(src))
+    except docker.errors.NotFound:
+        return {}
+    data = io.BytesIO(b"".join(stream))
+    files = {}
+    with tarfile.open(fileobj=data, mode="r") as tar:
+        for member in tar:
+            if member.isfile():
+                files[member.name] = tar.extractfile(member).read()
+    return files
 
 
 def write_to_container(container: Container, data: str, dst: Path):
@@ -55,29 +105,160 @@ def write_to_container(container: Container, data: str, dst: Path):
     command = f"cat <<'{HEREDOC_DELIMITER}' > {dst}\n{data}\n{HEREDOC_DELIMITER}"
     container.exec_run(command)
 
-def exec_run_with_timeout(container: Container, cmd, workdir: str | None = None, timeout: int | None = 60):
+
+TRUNCATED_MARKER = "[ncbench: output truncated, dropped"
+
+
+class OutputBuffer:
+    """
+    Bounded tail of a byte stream: only the last `max_bytes` are retained (all if None).
+    Complete lines are passed to `line_callback` as they arrive, including the dropped ones.
+    `write` and `getvalue` may be called from different threads.
+    """
+
+    def __init__(self, max_bytes=None, line_callback=None):
+        self.max_bytes = max_bytes
+        self.line_callback = line_callback
+        self.dropped = 0
+        self._data = bytearray()
+        self._partial = bytearray()
+        self._lock = threading.Lock()
+
+    def write(self, chunk):
+        with self._lock:
+            self._write(chunk)
+
+    def _write(self, chunk):
+        self._data += chunk
+        if self.line_callback is not None:
+            self._partial += chunk
+            end = self._partial.rfind(b"\n")
+            if end != -1:
+                for line in self._partial[:end].split(b"\n"):
+                    self.line_callback(line.decode("utf-8", errors="replace"))
+                del self._partial[:end + 1]
+            if self.max_bytes and len(self._partial) > self.max_bytes:
+                # a single huge line is not worth parsing
+                self._partial.clear()
+        if self.max_bytes and len(self._data) > 2 * self.max_bytes:
+            # trim in amortized steps instead of on every chunk
+            self._trim()
+
+    def _trim(self):
+        drop = len(self._data) - self.max_bytes
+        if drop > 0:
+            del self._data[:drop]
+            self.dropped += drop
+
+    def getvalue(self):
+        with self._lock:
+            return self._getvalue()
+
+    def _getvalue(self):
+        if self.line_callback is not None and self._partial:
+            self.line_callback(self._partial.decode("utf-8", errors="replace"))
+            self._partial.clear()
+        if self.max_bytes:
+            self._trim()
+        text = self._data.decode("utf-8", errors="replace")
+        if self.dropped:
+            return f"{TRUNCATED_MARKER} {self.dropped} bytes]\n{text}"
+        return text
+
+
+# seconds between SIGTERM to the process group of a timed out command and SIGKILL
+KILL_GRACE_PERIOD = 5
+# processes of timed out commands still alive after SIGKILL, per container id,
+# until read with reset=True or the container is removed by cleanup_container
+_leaked_processes = Counter()
+_leaked_lock = threading.Lock()
+
+
+def leaked_processes(container: Container, reset=False) -> int:
+    """
+    Processes of timed out exec_run_with_timeout commands that survived SIGKILL in `container`
+    since the last read with `reset`.
+    """
+    with _leaked_lock:
+        if reset:
+            return _leaked_processes.pop(container.id, 0)
+        return _leaked_processes[container.id]
+
+
+def _group_size(container: Container, pgid):
+    """
+    Live (non-zombie) processes of process group `pgid` in the container, read from /proc.
+    """
+    script = ('n=0; for s in /proc/[0-9]*/stat; do read -r line 2>/dev/null < "$s" || continue; '
+              'set -- ${line##*) }; '
+              f'[ "$3" = {pgid} ] && [ "$1" != Z ] && n=$((n+1)); done; echo $n')
+    lines = container.exec_run(["sh", "-c", script]).output.decode(errors="ignore").split()
+    return int(lines[-1]) if lines and lines[-1].isdigit() else 0
+
+
+def _kill_process_group(container: Container, exec_id, pid_file):
+    """
+    Stop a timed out command started by exec_run_with_timeout: SIGTERM to its process group
+    (conda run, the test runner and its workers), SIGKILL to whatever is left after
+    KILL_GRACE_PERIOD seconds. Returns the number of processes still alive after that.
+    """
+    res = container.exec_run(["cat", pid_file])
+    pgid = res.output.decode(errors="ignore").strip()
+    if res.exit_code != 0 or not pgid.isdigit():
+        # the wrapper has not started (or already exited)
+        return 0
+    container.exec_run(f"kill -TERM -- -{pgid}")
+    deadline = time.time() + KILL_GRACE_PERIOD
+    while time.time() < deadline:
+        if not container.client.api.exec_inspect(exec_id)["Running"] and not _group_size(container, pgid):
+            break
+        time.sleep(0.5)
+    leaked = 0
+    if _group_size(container, pgid):
+        container.exec_run(f"kill -KILL -- -{pgid}")
+        time.sleep(0.5)
+        leaked = _group_size(container, pgid)
+    container.exec_run(["rm", "-f", pid_file])
+    if leaked:
+        with _leaked_lock:
+            _leaked_processes[container.id] += leaked
+    return leaked
+
+
+def exec_run_with_timeout(container: Container, cmd, workdir: str | None = None, timeout: int | None = 60,
+                          max_output_bytes=None, line_callback=None):
     """
     Run a command in a container with a timeout.
 
+    The command runs in its own session (setsid), so on timeout its whole process group is
+    terminated, not only the exec process; survivors are counted in leaked_processes().
+
     Args:
         container (docker.Container): Container to run the command in.
         cmd (str): Command to run.
         timeout (int): Timeout in seconds.
+        max_output_bytes (int): Keep only the last bytes of the output (prefixed with TRUNCATED_MARKER).
+        line_callback (callable): Called with every output line as it arrives.
     """
     # Local variables to store the result of executing the command
-    exec_result = b""
+    output = OutputBuffer(max_output_bytes, line_callback)
     exec_id = None
     exception = None
     timed_out = False
+    # the session leader records its pid (= process group id) for the kill on timeout
+    pid_file = f"/tmp/ncbench_exec_{uuid.uuid4().hex}.pid"
+    argv = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+    wrapped = ["setsid", "-w", "sh", "-c", f'echo $$ > {pid_file}; "$@"; status=$?; rm -f {pid_file}; exit $status',
+               "sh"] + argv
 
     # Wrapper function to run the command
     def run_command():
-        nonlocal exec_result, exec_id, exception
+        nonlocal exec_id, exception
         try:
-            exec_id = container.client.api.exec_create(container.id, cmd, workdir=workdir)["Id"]
+            exec_id = container.client.api.exec_create(container.id, wrapped, workdir=workdir)["Id"]
             exec_stream = container.client.api.exec_start(exec_id, stream=True)
             for chunk in exec_stream:
-                exec_result += chunk
+                output.write(chunk)
         except Exception as e:
             exception = e
 
@@ -92,16 +273,18 @@ def exec_run_with_timeout(container: Container, cmd, workdir: str | None = None,
 
     # If the thread is still alive, the command timed out
     if thread.is_alive():
-        if exec_id is not None:
-            exec_pid = container.client.api.exec_inspect(exec_id)["Pid"]
-            container.exec_run(f"kill -TERM {exec_pid}", detach=True)
         timed_out = True
-    end_time = time.time()
-    return exec_result.decode(), timed_out, end_time - start_time
-
+        end_time = time.time()
+        if exec_id is not None:
+            _kill_process_group(container, exec_id, pid_file)
+            # let the stream drain what was written before the kill
+            thread.join(KILL_GRACE_PERIOD)
+    else:
+        end_time = time.time()
+    return output.getvalue(), timed_out, end_time - start_time
 
 
-def cleanup_container(client, container, logger=None):
+def cleanup_container(client, container, logger=None, stop_timeout=15):
     """
     Stop and remove a Docker container.
     Performs this forcefully if the container cannot be stopped with the python API.
@@ -110,18 +293,21 @@ def cleanup_container(client, container, logger=None):
         client (docker.DockerClient): Docker client.
         container (docker.models.containers.Container): Container to remove.
         logger (logging.Logger): Logger to use for output. If None, print to stdout
+        stop_timeout (int): Seconds between SIGTERM and SIGKILL, 0 kills right away.
     """
     if not container:
         return
 
     container_id = container.id
+    with _leaked_lock:
+        _leaked_processes.pop(container_id, None)
 
     # Attempt to stop the container
     try:
         if container:
             if logger:
                 logger.info(f"Attempting to stop container {container.name}...")
-            container.stop(timeout=15)
+            container.stop(timeout=stop_timeout)
     except Exception as e:
         logger.error(
             f"Failed to stop container {container.name}: {e}. Trying to forcefully kill..."
@@ -161,12 +347,45 @@ def cleanup_container(client, container, logger=None):
             )
 
 
+def prepare_repo(container: Container, work_dir, base_commit, patches, config, logger):
+    """
+    Bring the repository of a started container to `base_commit`, apply `patches` in order,
+    then run the pre_install commands and the install of `config` (MAP_REPO_TO_CONFIG entry).
+
+    Args:
+        patches (dict): Patch name (used in log messages) -> patch text.
+
+    Returns:
+        The exit code of the install, or None if a patch does not apply.
+    """
+    # reset branch
+    container.exec_run('git clean -fdx', workdir=work_dir)
+    container.exec_run('git reset --hard HEAD', workdir=work_dir)
+    # checkout base_commit
+    container.exec_run(f"git checkout {base_commit}", workdir=work_dir)
+    for name, patch in patches.items():
+        put_files_to_container(container, {'ncbench_prepare.diff': patch}, '/tmp')
+        cmd_res = container.exec_run("git apply /tmp/ncbench_prepare.diff", workdir=work_dir)
+        if cmd_res.exit_code != 0:
+            logger.info(f"Failed to apply {name} to container")
+            return None
+    # run pre_install
+    for pre_install_cmd in config.get('pre_install', []):
+        container.exec_run(cmd=pre_install_cmd, workdir=work_dir)
+    # conda activate and install
+    cmd_res = container.exec_run(f"conda run -n {config['conda_env']} {config['install']}", workdir=work_dir)
+    return cmd_res.exit_code
+
+
 def build_container(
     image_name,
     container_name,
     client: docker.DockerClient,
     logger,
-    proxy=None
+    proxy=None,
+    labels=None,
+    cpus=None,
+    mem_limit=None
 ):
     """
     Builds the instance image for the given test spec and creates a container from the image.
@@ -178,6 +397,9 @@ def build_container(
         logger (logging.Logger): Logger to use for logging the build process
         nocache (bool): Whether to use the cache when building
         force_rebuild (bool): Whether to force rebuild the image even if it already exists
+        labels (dict): Optional labels attached to the container, e.g. to mark pooled containers
+        cpus (float): Optional CPU limit of the container, enforced via cpu_quota
+        mem_limit (str): Optional memory limit of the container, e.g. "8g"
     """
     container = None
     try:
@@ -189,7 +411,16 @@ def build_container(
             # Create the container
             logger.info(f"Creating container for {container_name}...")
             env_config = {}
-            
+            resource_config = {}
+
+            if cpus:
+                resource_config.update({
+                    'cpu_period': 100000,
+                    'cpu_quota': int(cpus * 100000)
+                })
+            if mem_limit:
+                resource_config['mem_limit'] = mem_limit
+
             if proxy:
                 env_config.update({
                     'https_proxy': proxy,
@@ -203,7 +434,9 @@ def build_container(
                 detach=True,
                 command="tail -f /dev/null",
                 network_mode='host',
-                environment=env_config
+                environment=env_config,
+                labels=labels or {},
+                **resource_config
             )
             logger.info(f"Container for {container_name} created: {container.id}")
             return container
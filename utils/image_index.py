@@ -0,0 +1,87 @@
+import threading
+
+import docker
+
+
+def normalize_tag(tag):
+    """
+    `name` -> `name:latest`, as the daemon lists tags.
+    """
+    return tag if ':' in tag.rsplit('/', 1)[-1] else f'{tag}:latest'
+
+
+class ImageIndex:
+    """
+    Inventory of the local images of a Docker daemon, `{tag: (image id, repo digests)}`,
+    built from a single `images.list` call so that planning the work of a whole dataset
+    does not query the daemon per task. It is kept up to date incrementally: images
+    committed or pulled through the caller are `add`-ed, single tags can be `refresh_tag`-ed.
+
+    Args:
+        client (docker.DockerClient): Docker client of the daemon to index.
+    """
+
+    def __init__(self, client: docker.DockerClient):
+        self.client = client
+        self._lock = threading.Lock()
+        self._images = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rebuild the whole index with one daemon call.
+        """
+        images = {}
+        for image in self.client.images.list():
+            for tag in image.tags:
+                images[tag] = (image.id, image.attrs.get('RepoDigests') or [])
+        with self._lock:
+            self._images = images
+
+    def add(self, image, tag=None):
+        """
+        Record an image the caller just committed, pulled or tagged (`tag` if it is not in `image.tags` yet).
+        """
+        tags = list(image.tags) + ([normalize_tag(tag)] if tag else [])
+        with self._lock:
+            for t in tags:
+                self._images[t] = (image.id, image.attrs.get('RepoDigests') or [])
+
+    def refresh_tag(self, tag):
+        """
+        Re-read a single tag from the daemon, e.g. after it was changed by another process.
+        """
+        tag = normalize_tag(tag)
+        try:
+            image = self.client.images.get(tag)
+        except docker.errors.ImageNotFound:
+            with self._lock:
+                self._images.pop(tag, None)
+            return None
+        self.add(image, tag)
+        return image.id
+
+    def __contains__(self, tag):
+        with self._lock:
+            return normalize_tag(tag) in self._images
+
+    def __len__(self):
+        with self._lock:
+            return len(self._images)
+
+    def image_id(self, tag):
+        with self._lock:
+            entry = self._images.get(normalize_tag(tag))
+        return entry[0] if entry else None
+
+    def repo_digests(self, tag):
+        with self._lock:
+            entry = self._images.get(normalize_tag(tag))
+        return list(entry[1]) if entry else []
+
+    def missing(self, tags):
+        """
+        The tags of `tags` that are not present locally, in order.
+        """
+        with self._lock:
+            return [tag for tag in tags if normalize_tag(tag) not in self._images]
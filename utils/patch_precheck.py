@@ -0,0 +1,124 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+from unidiff import PatchSet
+from unidiff.errors import UnidiffParseError
+
+
+def _strip_prefix(path):
+    return path[2:] if path.startswith(('a/', 'b/')) else path
+
+
+def patch_source_files(patch):
+    """
+    Paths (relative to the repo root) that must exist before `patch` is applied.
+    """
+    return {_strip_prefix(f.source_file) for f in PatchSet(patch) if not f.is_added_file}
+
+
+def has_commit(repo_dir, commit_id):
+    result = subprocess.run(['git', 'cat-file', '-e', f'{commit_id}^{{commit}}'], cwd=repo_dir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+
+def export_files(repo_dir, commit_id, paths, dst_dir):
+    """
+    Write the files of `paths` that exist at `commit_id` into `dst_dir` (no checkout needed).
+    The blobs are read as stored (`git cat-file --batch`), unlike `git archive`, which applies
+    the export-ignore, export-subst and eol rules of .gitattributes.
+    """
+    listed = subprocess.run(['git', 'ls-tree', '-r', '-z', commit_id, '--', *sorted(paths)],
+                            cwd=repo_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    entries = []
+    for entry in listed.stdout.decode('utf-8').split('\0'):
+        if not entry:
+            continue
+        meta, path = entry.split('\t', 1)
+        mode, obj_type, sha = meta.split()
+        if obj_type == 'blob':
+            entries.append((mode, sha, path))
+    if not entries:
+        return
+    batch = subprocess.run(['git', 'cat-file', '--batch'], cwd=repo_dir, check=True, stdout=subprocess.PIPE,
+                           stderr=subprocess.DEVNULL, input=''.join(f'{sha}\n' for _, sha, _ in entries).encode())
+    out = batch.stdout
+    pos = 0
+    for mode, sha, path in entries:
+        header_end = out.index(b'\n', pos)
+        size = int(out[pos:header_end].split()[2])
+        content = out[header_end + 1:header_end + 1 + size]
+        # each object is followed by a newline
+        pos = header_end + 1 + size + 1
+        dst = os.path.join(dst_dir, path)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        if mode == '120000':
+            os.symlink(content.decode('utf-8'), dst)
+            continue
+        with open(dst, 'wb') as f:
+            f.write(content)
+        if mode == '100755':
+            os.chmod(dst, 0o755)
+
+
+def precheck_patch(repo_dir, commit_id, test_patch, patch, apply_script):
+    """
+    Dry-run applying `patch` on top of `test_patch` at `commit_id` of the local clone `repo_dir`.
+
+    Only the files touched by the two patches are exported into a temporary directory, where
+    `apply_script(patch_path)` (the same fallback chain as in the container) is run with the
+    user and system git config ignored. The exported blobs are those the container checks
+    out, so a patch no command applies there does not apply in the container either.
+
+    Returns:
+        (applies, reason): `applies` is False for an empty, malformed or unappliable patch,
+            True when an apply command succeeds and None when the host cannot tell (no clone
+            or commit, `git` or `patch` missing, test patch or export failing): such
+            predictions are run in the container.
+    """
+    if not patch or not patch.strip():
+        return False, 'empty patch'
+    try:
+        feature_files = patch_source_files(patch)
+    except UnidiffParseError as e:
+        return False, f'malformed patch: {e}'
+    for tool in ['git', 'patch']:
+        # the fallback chain ends with GNU patch
+        if shutil.which(tool) is None:
+            return None, f'{tool} is not installed on the host'
+    if not os.path.isdir(repo_dir) or not has_commit(repo_dir, commit_id):
+        return None, f'{commit_id} not found in {repo_dir}'
+    try:
+        test_files = patch_source_files(test_patch) if test_patch else set()
+    except UnidiffParseError:
+        return None, 'malformed test patch'
+
+    with tempfile.TemporaryDirectory(prefix='ncbench_precheck_') as tmp_dir:
+        # git apply must not discover a repository above the temporary directory,
+        # nor read settings of the host user (e.g. apply.whitespace)
+        env = {**os.environ, 'GIT_CEILING_DIRECTORIES': tmp_dir, 'GIT_CONFIG_NOSYSTEM': '1',
+               'GIT_CONFIG_GLOBAL': os.devnull}
+        work_dir = os.path.join(tmp_dir, 'repo')
+        os.makedirs(work_dir)
+        try:
+            export_files(repo_dir, commit_id, feature_files | test_files, work_dir)
+        except (subprocess.CalledProcessError, OSError, ValueError, IndexError) as e:
+            return None, f'export failed: {e}'
+        test_patch_path = os.path.join(tmp_dir, 'test_patch.diff')
+        patch_path = os.path.join(tmp_dir, 'patch.diff')
+        with open(test_patch_path, 'w', encoding='utf-8') as f:
+            f.write(test_patch or '')
+        with open(patch_path, 'w', encoding='utf-8') as f:
+            f.write(patch)
+        if test_patch:
+            result = subprocess.run(['git', 'apply', test_patch_path], cwd=work_dir, env=env,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if result.returncode != 0:
+                return None, 'test patch does not apply on the host'
+        result = subprocess.run(['bash', '-c', apply_script(patch_path)], cwd=work_dir, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if result.returncode != 0:
+        return False, f'no apply command succeeded at {commit_id[:12]} (exit code {result.returncode})'
+    return True, 'applies'
@@ -0,0 +1,97 @@
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+
+def available_memory_mb():
+    """
+    MemAvailable of the host in MB, or None if it cannot be read.
+    """
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        return None
+    return None
+
+
+def free_disk_mb(path):
+    """
+    Free space of the file system holding `path` in MB, or None if it cannot be read
+    (e.g. the Docker root dir of a remote daemon).
+    """
+    try:
+        return shutil.disk_usage(path).free // (1024 * 1024)
+    except OSError:
+        return None
+
+
+class ResourceGovernor:
+    """
+    Host-wide budget shared by every process started in containers (installs and test runs),
+    regardless of which instance or test thread starts it.
+
+    A process needs one CPU slot, and is only started while the host keeps at least
+    `mem_headroom_mb` of available memory (and `disk_headroom_mb` of free space on
+    `disk_path`, e.g. the Docker root dir while committing images). Slots are held only around single commands,
+    never around a whole instance, so nested instance/test parallelism cannot deadlock.
+
+    Args:
+        cpu_slots (int): Max number of concurrently running commands.
+        mem_headroom_mb (int): Min available host memory before a new command starts (0 disables).
+        disk_headroom_mb (int): Min free space on `disk_path` before a new command starts (0 disables).
+        disk_path (str): Path whose file system is checked for `disk_headroom_mb`.
+        poll_interval (float): Seconds between memory checks while waiting.
+    """
+
+    def __init__(self, cpu_slots, mem_headroom_mb=0, poll_interval=1.0, disk_headroom_mb=0, disk_path=None):
+        self.cpu_slots = cpu_slots
+        self.mem_headroom_mb = mem_headroom_mb
+        self.disk_headroom_mb = disk_headroom_mb
+        self.disk_path = disk_path
+        self.poll_interval = poll_interval
+        self._slots = threading.Semaphore(cpu_slots)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self.max_in_use = 0
+        self.wait_time = 0.0
+
+    def _memory_ok(self):
+        if self.disk_headroom_mb and self.disk_path:
+            free = free_disk_mb(self.disk_path)
+            if free is not None and free < self.disk_headroom_mb:
+                return False
+        if not self.mem_headroom_mb:
+            return True
+        available = available_memory_mb()
+        return available is None or available >= self.mem_headroom_mb
+
+    def acquire(self):
+        start = time.time()
+        self._slots.acquire()
+        # waiting for memory (or disk) only helps while other commands are running and can free it
+        while not self._memory_ok():
+            with self._lock:
+                if self._in_use == 0:
+                    break
+            time.sleep(self.poll_interval)
+        with self._lock:
+            self._in_use += 1
+            self.max_in_use = max(self.max_in_use, self._in_use)
+            self.wait_time += time.time() - start
+
+    def release(self):
+        with self._lock:
+            self._in_use -= 1
+        self._slots.release()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
@@ -0,0 +1,263 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils.utils import iter_jsonl_from
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    created REAL NOT NULL,
+    report TEXT NOT NULL,
+    UNIQUE (run, instance_id, attempt)
+);
+CREATE TABLE IF NOT EXISTS details (
+    run TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    resolved INTEGER NOT NULL,
+    detail TEXT NOT NULL,
+    PRIMARY KEY (run, instance_id)
+);
+CREATE TABLE IF NOT EXISTS test_outcomes (
+    run TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    test_type TEXT NOT NULL,
+    test_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    PRIMARY KEY (run, instance_id, test_type, test_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    run TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (run, key)
+);
+"""
+
+CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cached_reports (
+    key TEXT PRIMARY KEY,
+    instance_id TEXT NOT NULL,
+    run TEXT,
+    created REAL NOT NULL,
+    report TEXT NOT NULL
+);
+"""
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class ResultStore:
+    """
+    SQLite store of evaluation reports, details and per-test outcomes of a run.
+
+    Reports are keyed by (run, instance_id, attempt): a retry adds a new attempt instead of
+    silently overriding the previous line, and the latest attempt is the effective one.
+    Every write is its own transaction, so concurrent threads and processes need no shared
+    file lock. Each thread uses its own connection.
+
+    Args:
+        path (str): SQLite database file.
+        run (str): Run identifier, e.g. the name of the log directory.
+    """
+
+    def __init__(self, path, run):
+        self.path = path
+        self.run = run
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    # ---- reports ----
+
+    def add_report(self, report):
+        """
+        Store `report` as the next attempt of its instance; returns the attempt number.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            attempt = conn.execute(
+                "SELECT COALESCE(MAX(attempt), 0) + 1 FROM reports WHERE run = ? AND instance_id = ?",
+                (self.run, report['instance_id'])).fetchone()[0]
+            conn.execute(
+                "INSERT INTO reports (run, instance_id, attempt, created, report) VALUES (?, ?, ?, ?, ?)",
+                (self.run, report['instance_id'], attempt, time.time(), json.dumps(report)))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return attempt
+
+    def latest_report(self, instance_id):
+        row = self._conn().execute(
+            "SELECT report FROM reports WHERE run = ? AND instance_id = ? ORDER BY attempt DESC LIMIT 1",
+            (self.run, instance_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def last_position(self):
+        return self._conn().execute(
+            "SELECT COALESCE(MAX(id), 0) FROM reports WHERE run = ?", (self.run,)).fetchone()[0]
+
+    def iter_reports(self, after=0):
+        """
+        Yield (report, position) for every report stored after `position`, in insertion order.
+        """
+        cursor = self._conn().execute(
+            "SELECT id, report FROM reports WHERE run = ? AND id > ? ORDER BY id", (self.run, after))
+        for row_id, report in cursor:
+            yield json.loads(report), row_id
+
+    # ---- details ----
+
+    def put_details(self, details):
+        """
+        Insert or replace evaluation details and their per-test outcomes in one transaction.
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for detail in details:
+                instance_id = detail['instance_id']
+                conn.execute(
+                    "INSERT OR REPLACE INTO details (run, instance_id, resolved, detail) VALUES (?, ?, ?, ?)",
+                    (self.run, instance_id, int(bool(detail.get('resolved', False))), json.dumps(detail)))
+                conn.execute("DELETE FROM test_outcomes WHERE run = ? AND instance_id = ?", (self.run, instance_id))
+                outcomes = []
+                for test_type in ['F2P', 'P2P']:
+                    results = detail.get(test_type, {})
+                    for key, status in [('success', 'PASSED'), ('failure', 'FAILED'), ('fail', 'NOT_RUN'),
+                                        ('skipped', 'SKIPPED')]:
+                        outcomes.extend((self.run, instance_id, test_type, test_id, status)
+                                        for test_id in results.get(key, []))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO test_outcomes (run, instance_id, test_type, test_id, status) "
+                    "VALUES (?, ?, ?, ?, ?)", outcomes)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete_details(self, instance_ids):
+        keys = [(self.run, i) for i in instance_ids]
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany("DELETE FROM details WHERE run = ? AND instance_id = ?", keys)
+            conn.executemany("DELETE FROM test_outcomes WHERE run = ? AND instance_id = ?", keys)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get_detail(self, instance_id):
+        row = self._conn().execute(
+            "SELECT detail FROM details WHERE run = ? AND instance_id = ?", (self.run, instance_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def details(self):
+        cursor = self._conn().execute("SELECT detail FROM details WHERE run = ?", (self.run,))
+        return [json.loads(row[0]) for row in cursor]
+
+    def has_details(self):
+        return self._conn().execute(
+            "SELECT 1 FROM details WHERE run = ? LIMIT 1", (self.run,)).fetchone() is not None
+
+    # ---- meta ----
+
+    def get_meta(self, key, default=None):
+        row = self._conn().execute(
+            "SELECT value FROM meta WHERE run = ? AND key = ?", (self.run, key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        self._conn().execute("INSERT OR REPLACE INTO meta (run, key, value) VALUES (?, ?, ?)",
+                             (self.run, key, json.dumps(value)))
+
+    # ---- import / export ----
+
+    def import_reports_jsonl(self, fpath):
+        """
+        Load the reports of an append-only `0reports.jsonl` into an empty run; returns their number.
+        """
+        if self.last_position() or not os.path.exists(fpath):
+            return 0
+        count = 0
+        for report, _ in iter_jsonl_from(fpath):
+            if report:
+                self.add_report(report)
+                count += 1
+        return count
+
+    def export_reports_jsonl(self, fpath):
+        """
+        Write the latest attempt of every instance as `0reports.jsonl`-compatible lines.
+        """
+        cursor = self._conn().execute(
+            "SELECT r.report FROM reports r JOIN ("
+            "  SELECT instance_id, MAX(attempt) AS attempt FROM reports WHERE run = ? GROUP BY instance_id"
+            ") latest ON r.instance_id = latest.instance_id AND r.attempt = latest.attempt "
+            "WHERE r.run = ? ORDER BY r.id", (self.run, self.run))
+        with open(fpath, 'w', encoding='utf-8') as f:
+            for (report,) in cursor:
+                f.write(report + '\n')
+
+
+def report_key(instance_id, base_commit, test_patch, model_patch, image_digest, options=None):
+    """
+    Content address of an evaluation: everything the outcome of `run_instance` depends on,
+    including the evaluation `options` (timeout, batching, skipped tests, ...) that change the report.
+    """
+    content = json.dumps([instance_id, base_commit, test_patch, model_patch, image_digest, options or {}],
+                         sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class ReportCache:
+    """
+    Reports of previous runs keyed by `report_key`, shared by all runs using the same file.
+
+    Args:
+        path (str): SQLite database file (may be the file of a `ResultStore`).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(CACHE_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = _connect(self.path)
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute("SELECT report, run FROM cached_reports WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        report = json.loads(row[0])
+        report['cached_from'] = row[1]
+        return report
+
+    def put(self, key, report, run=None):
+        report = {k: v for k, v in report.items() if k != 'cached_from'}
+        self._conn().execute(
+            "INSERT OR REPLACE INTO cached_reports (key, instance_id, run, created, report) VALUES (?, ?, ?, ?, ?)",
+            (key, report['instance_id'], run, time.time(), json.dumps(report)))
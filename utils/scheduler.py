@@ -0,0 +1,200 @@
+import heapq
+import json
+import os
+import queue
+import re
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from utils.utils import load_jsonl
+
+LOG_TIME_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}),\d+ - ")
+# logged once per run_instance call, when it starts (START_MARKER, newer logs) and when it reaches the tests
+START_MARKER = "begin to run instance"
+RUN_MARKER = "begin to run f2p tests"
+
+
+def _run_spans(lines):
+    """
+    (start, end) timestamps of the runs appended to one exec log. A run starts at its
+    START_MARKER (or, in older logs, its RUN_MARKER) and ends at the last timestamp before
+    the next run starts, so the idle time between runs is not counted.
+    """
+    spans = []
+    current = None
+    for line in lines:
+        match = LOG_TIME_PATTERN.match(line)
+        if not match:
+            continue
+        ts = datetime.strptime(match.group(1), "%Y-%m-%d %H:%M:%S")
+        if START_MARKER in line or (RUN_MARKER in line and (current is None or current['tests'])):
+            if current is not None and current['tests']:
+                spans.append((current['start'], current['end']))
+            current = {'start': ts, 'end': ts, 'tests': False}
+        if current is None:
+            continue
+        current['end'] = ts
+        if RUN_MARKER in line:
+            current['tests'] = True
+    if current is not None and current['tests']:
+        spans.append((current['start'], current['end']))
+    return spans
+
+
+def _exec_log_durations(logfile_dir):
+    """
+    Rough per-instance durations from `exec_logs/{instance_id}.log`: the mean duration of the
+    runs appended to the file that reached the tests.
+    """
+    durations = {}
+    if not os.path.isdir(logfile_dir):
+        return durations
+    for fname in os.listdir(logfile_dir):
+        if not fname.endswith('.log'):
+            continue
+        with open(os.path.join(logfile_dir, fname), 'r', encoding='utf-8', errors='ignore') as f:
+            spans = _run_spans(f)
+        if spans:
+            durations[fname[:-len('.log')]] = sum((end - start).total_seconds() for start, end in spans) / len(spans)
+    return durations
+
+
+def load_timing_history(paths):
+    """
+    Load historical instance durations (seconds) from previous runs.
+
+    Args:
+        paths (list[str]): Evaluation log directories (their `0reports.jsonl` timings are used,
+            falling back to `exec_logs`) or JSON timing tables `{instance_id: seconds}`.
+    """
+    history = {}
+    for path in paths:
+        if os.path.isdir(path):
+            history.update(_exec_log_durations(os.path.join(path, 'exec_logs')))
+            reports_fpath = os.path.join(path, '0reports.jsonl')
+            if os.path.exists(reports_fpath):
+                for report in load_jsonl(reports_fpath):
+                    total = (report or {}).get('timing', {}).get('total')
+                    if total:
+                        history[report['instance_id']] = total
+        elif os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                history.update(json.load(f))
+    return history
+
+
+def update_timing_table(table_fpath, reports):
+    """
+    Merge the instance durations of `reports` into the JSON timing table at `table_fpath`.
+    """
+    table = {}
+    if os.path.exists(table_fpath):
+        with open(table_fpath, 'r', encoding='utf-8') as f:
+            table = json.load(f)
+    for report in reports:
+        total = (report or {}).get('timing', {}).get('total')
+        if total:
+            table[report['instance_id']] = total
+    with open(table_fpath, 'w', encoding='utf-8') as f:
+        json.dump(table, f, indent=2, sort_keys=True)
+
+
+def estimate_costs(tasks, history):
+    """
+    Predict the duration of every task: its own history if known, else the mean of its repo,
+    else the global mean scaled by the number of F2P/P2P tests.
+    """
+    by_repo = defaultdict(list)
+    for task in tasks:
+        if task['instance_id'] in history:
+            by_repo[task['repo']].append(history[task['instance_id']])
+    known = [d for durations in by_repo.values() for d in durations]
+    global_mean = sum(known) / len(known) if known else 60.0
+    mean_tests = sum(len(t['FAIL2PASS']) + len(t['PASS2PASS']) for t in tasks) / len(tasks) if tasks else 1.0
+
+    costs = {}
+    for task in tasks:
+        instance_id = task['instance_id']
+        if instance_id in history:
+            costs[instance_id] = history[instance_id]
+        elif by_repo[task['repo']]:
+            costs[instance_id] = sum(by_repo[task['repo']]) / len(by_repo[task['repo']])
+        else:
+            n_tests = len(task['FAIL2PASS']) + len(task['PASS2PASS'])
+            costs[instance_id] = global_mean * max(n_tests, 1) / max(mean_tests, 1)
+    return costs
+
+
+def simulate_makespan(jobs, max_workers, key_fn, cost_fn, max_per_key=0):
+    """
+    Makespan (seconds) of running `jobs` in order with the same greedy policy as `run_scheduled`.
+    """
+    pending = list(jobs)
+    running = []  # heap of (end_time, key)
+    per_key = Counter()
+    now = 0.0
+    while pending or running:
+        started = True
+        while started and len(running) < max_workers:
+            started = False
+            for i, job in enumerate(pending):
+                key = key_fn(job)
+                if not max_per_key or per_key[key] < max_per_key:
+                    heapq.heappush(running, (now + cost_fn(job), key))
+                    per_key[key] += 1
+                    pending.pop(i)
+                    started = True
+                    break
+        if not running:
+            break
+        now, key = heapq.heappop(running)
+        per_key[key] -= 1
+    return now
+
+
+def run_scheduled(jobs, fn, max_workers, key_fn, max_per_key=0):
+    """
+    Run `fn(job)` for every job in the given order on `max_workers` threads. A job is only
+    started while fewer than `max_per_key` jobs with the same key are running; later jobs
+    of other keys may overtake it. Yields the futures as they complete.
+    """
+    pending = list(jobs)
+    cond = threading.Condition()
+    done = queue.Queue()
+    running = Counter()
+    state = {'active': 0}
+
+    def on_done(future, key):
+        with cond:
+            running[key] -= 1
+            state['active'] -= 1
+            cond.notify()
+        done.put(future)
+
+    submitted = 0
+    with ThreadPoolExecutor(max_workers) as executor:
+        while pending:
+            with cond:
+                while True:
+                    index = None
+                    if state['active'] < max_workers:
+                        index = next((i for i, job in enumerate(pending)
+                                      if not max_per_key or running[key_fn(job)] < max_per_key), None)
+                    if index is not None:
+                        break
+                    cond.wait()
+                job = pending.pop(index)
+                key = key_fn(job)
+                running[key] += 1
+                state['active'] += 1
+            future = executor.submit(fn, job)
+            future.add_done_callback(lambda f, key=key: on_done(f, key))
+            submitted += 1
+            while not done.empty():
+                submitted -= 1
+                yield done.get()
+        while submitted:
+            submitted -= 1
+            yield done.get()
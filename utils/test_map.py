@@ -0,0 +1,277 @@
+import ast
+import os
+import posixpath
+import re
+import sqlite3
+import threading
+from collections import defaultdict, deque
+
+from unidiff import PatchSet
+from unidiff.errors import UnidiffParseError
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS test_files (
+    instance_id TEXT NOT NULL,
+    test_id TEXT NOT NULL,
+    file TEXT NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (instance_id, test_id, file)
+);
+CREATE INDEX IF NOT EXISTS test_files_by_file ON test_files (instance_id, file);
+"""
+
+# directories put on sys.path by the test runners of the benchmark repos
+IMPORT_ROOTS = ['', 'src', 'lib', 'tests']
+DJANGO_TEST_PATTERN = re.compile(r"^(\S+) \((\S+)\)$")
+# changes to these affect every test without being imported by it (test runners, settings, hooks)
+GLOBAL_FILE_PATTERN = re.compile(r'(^|/)(conftest|runtests|setup|test_sqlite|sitecustomize|__main__)\.py$|^bin/')
+
+
+class TestMap:
+    """
+    Per-instance map of test id -> repository files the test depends on, stored in SQLite.
+
+    `source` tells how a row was obtained (`static` import closure or `coverage`). A test
+    without rows is unknown and never treated as unaffected.
+
+    Args:
+        path (str): SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def put(self, instance_id, test_files, source):
+        """
+        Replace the `source` rows of an instance with `test_files` ({test_id: files}).
+        """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM test_files WHERE instance_id = ? AND source = ?", (instance_id, source))
+            conn.executemany(
+                "INSERT OR REPLACE INTO test_files (instance_id, test_id, file, source) VALUES (?, ?, ?, ?)",
+                [(instance_id, test_id, f, source) for test_id, files in test_files.items() for f in files])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def files_of(self, instance_id, source=None):
+        test_files = defaultdict(set)
+        if source is None:
+            cursor = self._conn().execute("SELECT test_id, file FROM test_files WHERE instance_id = ?", (instance_id,))
+        else:
+            cursor = self._conn().execute("SELECT test_id, file FROM test_files WHERE instance_id = ? AND source = ?",
+                                          (instance_id, source))
+        for test_id, f in cursor:
+            test_files[test_id].add(f)
+        return dict(test_files)
+
+    def tests_of_file(self, instance_id, f):
+        cursor = self._conn().execute(
+            "SELECT DISTINCT test_id FROM test_files WHERE instance_id = ? AND file = ?", (instance_id, f))
+        return {row[0] for row in cursor}
+
+    def instance_ids(self, source=None):
+        if source is None:
+            cursor = self._conn().execute("SELECT DISTINCT instance_id FROM test_files")
+        else:
+            cursor = self._conn().execute("SELECT DISTINCT instance_id FROM test_files WHERE source = ?", (source,))
+        return {row[0] for row in cursor}
+
+
+def test_file_of(test_id, repo, files):
+    """
+    Repository file defining `test_id` (pytest node id or django `name (module.Class)`), or None.
+    """
+    if '::' in test_id or test_id.endswith('.py'):
+        path = test_id.split('::')[0]
+        return path if path in files else None
+    match = DJANGO_TEST_PATTERN.match(test_id)
+    if match and 'django' in repo:
+        parts = match.group(2).split('.')
+        for end in range(len(parts), 0, -1):
+            path = posixpath.join('tests', *parts[:end]) + '.py'
+            if path in files:
+                return path
+    # e.g. sympy only reports function names
+    return None
+
+
+def _module_files(module, files, roots):
+    """
+    Files executed by importing `module`: the module itself and the __init__.py of its packages.
+    """
+    parts = module.split('.')
+    for root in roots:
+        found = []
+        for end in range(1, len(parts) + 1):
+            base = posixpath.join(root, *parts[:end])
+            if f'{base}/__init__.py' in files:
+                found.append(f'{base}/__init__.py')
+            elif f'{base}.py' in files and end == len(parts):
+                found.append(f'{base}.py')
+            else:
+                break
+        else:
+            if found:
+                return found
+    return []
+
+
+def _imported_modules(source, path):
+    """
+    (roots, module) pairs imported by a file: absolute imports are looked up in the import
+    roots and the file's directory, relative ones in the package directory they refer to.
+    """
+    try:
+        tree = ast.parse(source, filename=path)
+    except (SyntaxError, ValueError):
+        return None
+    directory = posixpath.dirname(path)
+    absolute_roots = IMPORT_ROOTS + [directory]
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.extend((absolute_roots, alias.name) for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            roots = absolute_roots
+            if node.level:
+                base = directory
+                for _ in range(node.level - 1):
+                    base = posixpath.dirname(base)
+                roots = [base]
+            module = node.module or ''
+            if module:
+                imports.append((roots, module))
+            # `from pkg import submodule`
+            prefix = f'{module}.' if module else ''
+            imports.extend((roots, f'{prefix}{alias.name}') for alias in node.names if alias.name != '*')
+    return imports
+
+
+def import_closure(start_files, read_file, files):
+    """
+    Repository files reachable from `start_files` through static imports.
+
+    Args:
+        start_files (list[str]): Files relative to the repository root.
+        read_file (callable): path -> source text.
+        files (set[str]): All files of the repository.
+
+    Returns:
+        The closure, or None if a file of it could not be parsed (the closure is then unknown).
+    """
+    closure = set()
+    queue = deque(start_files)
+    while queue:
+        path = queue.popleft()
+        if path in closure:
+            continue
+        closure.add(path)
+        imports = _imported_modules(read_file(path), path)
+        if imports is None:
+            return None
+        for roots, module in imports:
+            queue.extend(f for f in _module_files(module, files, roots) if f not in closure)
+    return closure
+
+
+def ancestor_files(test_file, files, name):
+    """
+    Files called `name` in the directory of `test_file` and all its parents, e.g. the
+    conftest.py files pytest loads or the __init__.py of the packages of a test module.
+    """
+    found = []
+    directory = posixpath.dirname(test_file)
+    while True:
+        candidate = posixpath.join(directory, name)
+        if candidate in files:
+            found.append(candidate)
+        if not directory:
+            return found
+        directory = posixpath.dirname(directory)
+
+
+def static_test_files(repo_dir, repo, test_ids):
+    """
+    {test_id: import closure of its test file, conftests and packages} for the checked out repository
+    `repo_dir`; tests whose file cannot be determined or parsed are left out.
+    """
+    files = set()
+    for root, dirs, names in os.walk(repo_dir):
+        dirs[:] = [d for d in dirs if d != '.git']
+        rel_root = os.path.relpath(root, repo_dir)
+        for name in names:
+            files.add(posixpath.normpath(posixpath.join(rel_root.replace(os.sep, '/'), name)))
+
+    def read_file(path):
+        with open(os.path.join(repo_dir, path), 'r', encoding='utf-8', errors='ignore') as f:
+            return f.read()
+
+    closures = {}
+    test_files = {}
+    for test_id in test_ids:
+        test_file = test_file_of(test_id, repo, files)
+        if test_file is None:
+            continue
+        if test_file not in closures:
+            start_files = [test_file] + ancestor_files(test_file, files, 'conftest.py') + \
+                ancestor_files(test_file, files, '__init__.py')
+            closures[test_file] = import_closure(start_files, read_file, files)
+        if closures[test_file] is not None:
+            test_files[test_id] = closures[test_file]
+    return test_files
+
+
+def memo_test_files(test_map, instance_id, repo, static_repos=()):
+    """
+    {test_id: files} of an instance usable to skip tests: coverage rows, plus static rows for
+    the repos of `static_repos`. Most benchmark repos load code the import closure cannot see
+    (sphinx extensions, django INSTALLED_APPS, pytest plugins, scikit-learn's all_estimators,
+    matplotlib backends, xarray entry points, astropy registries), so static rows are only
+    trusted for repos the caller vouches for; tests without trusted rows are always run.
+    """
+    if repo in static_repos:
+        return test_map.files_of(instance_id)
+    return test_map.files_of(instance_id, 'coverage')
+
+
+def changed_files(patch):
+    """
+    Files touched by `patch` (old and new paths), or None if it cannot be parsed.
+    """
+    try:
+        patch_set = PatchSet(patch)
+    except UnidiffParseError:
+        return None
+    paths = set()
+    for patched_file in patch_set:
+        for path in [patched_file.source_file, patched_file.target_file]:
+            if path and path != '/dev/null':
+                paths.add(path[2:] if path.startswith(('a/', 'b/')) else path)
+    return paths
+
+
+def provably_unaffected(p2p, gold_passed, test_files, patch):
+    """
+    P2P tests that passed in the gold run and whose dependency files do not intersect the
+    files changed by `patch`. Nothing is skipped for patches touching non-Python files
+    (build files, data, extensions) or test runner files, whose effect imports cannot show.
+    """
+    changed = changed_files(patch)
+    if not changed or any(not path.endswith('.py') or GLOBAL_FILE_PATTERN.search(path) for path in changed):
+        return []
+    return [test_id for test_id in p2p
+            if test_id in gold_passed and test_id in test_files and not (test_files[test_id] & changed)]
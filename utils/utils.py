@@ -67,7 +67,22 @@ def load_jsonl(fpath):
         for line in f:
             lines.append(json.loads(line))
         return lines
-    
+
+
+def iter_jsonl_from(fpath, offset=0):
+    """
+    Yield (record, end_offset) for every complete line of a jsonl file starting at byte `offset`.
+    A trailing line that is still being written (no newline yet) is left for the next call.
+    """
+    with open(fpath, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            offset += len(line)
+            if line.strip():
+                yield json.loads(line), offset
+
 
 def get_url_content(url):
     # try:
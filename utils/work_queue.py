@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import Counter, deque
+from multiprocessing.managers import BaseManager
+
+
+class WorkQueue:
+    """
+    Lease-based work queue shared by a coordinator and remote workers.
+
+    A job handed out by `get` is leased to the worker for `lease_seconds`; workers extend
+    their leases with `heartbeat`. Jobs whose lease expired (lost worker) are handed out
+    again, up to `max_attempts` times. The first result of a job wins, late duplicates
+    from a worker that was presumed lost are dropped.
+
+    Args:
+        jobs (list[dict]): Jobs, each with a unique `instance_id`.
+        on_result (callable): Called with every accepted result (in the coordinator process).
+        lease_seconds (int): Lease duration without heartbeat.
+        max_attempts (int): Max number of times a job is handed out.
+    """
+
+    def __init__(self, jobs, on_result, lease_seconds=300, max_attempts=3):
+        self.on_result = on_result
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._pending = deque(jobs)
+        self._leases = {}  # instance_id -> (worker_id, deadline, job)
+        self._done = set()
+        self._failed = set()
+        self._attempts = Counter()
+        self._total = len(jobs)
+        self._lock = threading.Lock()
+
+    def _requeue_expired(self):
+        now = time.time()
+        for instance_id, (worker_id, deadline, job) in list(self._leases.items()):
+            if deadline < now:
+                del self._leases[instance_id]
+                self._retry_or_fail(instance_id, job)
+
+    def _retry_or_fail(self, instance_id, job):
+        if self._attempts[instance_id] < self.max_attempts:
+            self._pending.appendleft(job)
+        else:
+            self._failed.add(instance_id)
+
+    def get(self, worker_id):
+        """
+        Lease the next job. Returns None once all jobs are finished, and an empty dict
+        when nothing is pending right now but leased jobs may still come back.
+        """
+        with self._lock:
+            self._requeue_expired()
+            if self._pending:
+                job = self._pending.popleft()
+                self._attempts[job['instance_id']] += 1
+                self._leases[job['instance_id']] = (worker_id, time.time() + self.lease_seconds, job)
+                return job
+            return {} if self._leases else None
+
+    def heartbeat(self, worker_id):
+        with self._lock:
+            deadline = time.time() + self.lease_seconds
+            for instance_id, (owner, _, job) in list(self._leases.items()):
+                if owner == worker_id:
+                    self._leases[instance_id] = (owner, deadline, job)
+
+    def complete(self, worker_id, instance_id, result):
+        with self._lock:
+            if instance_id in self._done:
+                return False
+            self._done.add(instance_id)
+            self._failed.discard(instance_id)
+            self._leases.pop(instance_id, None)
+            # a late result of a job that was already handed out again
+            self._pending = deque(job for job in self._pending if job['instance_id'] != instance_id)
+        self.on_result(result)
+        return True
+
+    def fail(self, worker_id, instance_id, error=None):
+        with self._lock:
+            lease = self._leases.pop(instance_id, None)
+            if lease is not None and instance_id not in self._done:
+                self._retry_or_fail(instance_id, lease[2])
+
+    def status(self):
+        with self._lock:
+            self._requeue_expired()
+            return {
+                'total': self._total,
+                'done': len(self._done),
+                'failed': len(self._failed),
+                'running': len(self._leases),
+                'pending': len(self._pending),
+            }
+
+    def finished(self):
+        status = self.status()
+        return status['done'] + status['failed'] >= status['total']
+
+
+class _QueueServer(BaseManager):
+    pass
+
+
+class _QueueClient(BaseManager):
+    pass
+
+
+_QueueClient.register('get_queue')
+
+
+def serve_queue(work_queue, address, authkey):
+    """
+    Expose `work_queue` on `address` (host, port) in a background thread of this process.
+    """
+    _QueueServer.register('get_queue', callable=lambda: work_queue)
+    server = _QueueServer(address=address, authkey=authkey).get_server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def connect_queue(address, authkey):
+    """
+    Proxy of the WorkQueue served by the coordinator at `address`.
+    """
+    manager = _QueueClient(address=address, authkey=authkey)
+    manager.connect()
+    return manager.get_queue()
+
+
+def parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)